@@ -0,0 +1,124 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class IVFIndex:
+    """Inverted-file approximate index over the rows of a normalized embedding matrix
+
+    Rows are assigned to the nearest of nlist spherical k-means centroids. A
+    search scores the centroids, visits the nprobe best cells and ranks only
+    their rows exactly, so cost scales with nprobe/nlist of the corpus.
+    New rows are inserted into their nearest cell without retraining.
+    """
+
+    def __init__(self, nlist: int = 256, nprobe: int = 8, train_iterations: int = 10,
+                 max_training_points: int = 50000, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.max_training_points = max_training_points
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._cells = []
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._positions: Dict[int, Tuple[int, int]] = {}
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def train(self, vectors: np.ndarray):
+        """Fit centroids with spherical k-means on (a sample of) normalized vectors"""
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.max_training_points:
+            vectors = vectors[rng.choice(len(vectors), self.max_training_points, replace=False)]
+        nlist = min(self.nlist, len(vectors))
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].astype(np.float32)
+
+        for _ in range(self.train_iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            counts = np.bincount(assignment, minlength=nlist)
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(vectors[order], starts[filled], axis=0)
+            # Re-seed empty cells from random points so every list stays useful
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        self.load_centroids(centroids)
+
+    def load_centroids(self, centroids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._cells = [np.empty(16, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._counts = np.zeros(len(self.centroids), dtype=np.int64)
+        self._positions = {}
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        """Insert matrix rows into the cell of their nearest centroid"""
+        if len(rows) == 0:
+            return
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for row, cell in zip(rows.tolist(), assignment.tolist()):
+            count = self._counts[cell]
+            if count == len(self._cells[cell]):
+                grown = np.empty(2 * count, dtype=np.int64)
+                grown[:count] = self._cells[cell]
+                self._cells[cell] = grown
+            self._cells[cell][count] = row
+            self._positions[row] = (cell, int(count))
+            self._counts[cell] = count + 1
+
+    def remove(self, row: int):
+        position = self._positions.pop(row, None)
+        if position is None:
+            return
+        cell, pos = position
+        last = self._counts[cell] - 1
+        if pos != last:
+            moved = int(self._cells[cell][last])
+            self._cells[cell][pos] = moved
+            self._positions[moved] = (cell, pos)
+        self._counts[cell] = last
+
+    def relabel(self, old_row: int, new_row: int):
+        """Follow a row that the owning matrix moved to another position"""
+        position = self._positions.pop(old_row, None)
+        if position is None:
+            return
+        cell, pos = position
+        self._cells[cell][pos] = new_row
+        self._positions[new_row] = position
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        if nprobe < len(self.centroids):
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(len(self.centroids))
+        return np.concatenate([self._cells[cell][:self._counts[cell]] for cell in probe])
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k rows of matrix for a normalized query, best first"""
+        rows = self.candidates(query, nprobe)
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        scores = matrix[rows] @ query
+        k = min(k, len(rows))
+        if k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
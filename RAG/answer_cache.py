@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Earlier answers looked up by cosine similarity of the question embedding
+
+    Entries belong to a collection and one corpus version of it; when a
+    collection's index changes only that collection's entries are dropped.
+    Eviction is least-recently-used across all collections with an optional TTL.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._versions: Dict[Hashable, str] = {}
+        self._next_key = 0
+        # Per collection: entry keys and their stacked vectors, rebuilt lazily
+        self._matrices: Dict[Hashable, Tuple[List[int], np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, keys: Iterable[int]):
+        for key in keys:
+            self._matrices.pop(self._entries.pop(key)["collection"], None)
+
+    def _set_version(self, collection: Hashable, corpus_version: str):
+        if self._versions.get(collection) != corpus_version:
+            self._drop([key for key, entry in self._entries.items() if entry["collection"] == collection])
+            self._matrices.pop(collection, None)
+            self._versions[collection] = corpus_version
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        self._drop([key for key, entry in self._entries.items() if entry["created"] < cutoff])
+
+    def _matrix(self, collection: Hashable) -> Tuple[List[int], Optional[np.ndarray]]:
+        if collection not in self._matrices:
+            # Rebuilt lazily so a burst of stores costs one stack, not one per store
+            keys = [key for key, entry in self._entries.items() if entry["collection"] == collection]
+            matrix = np.stack([self._entries[key]["vector"] for key in keys]) if keys else None
+            self._matrices[collection] = (keys, matrix)
+        return self._matrices[collection]
+
+    def lookup(self, vector: Sequence[float], corpus_version: str,
+               collection: Hashable = None) -> Optional[Dict]:
+        """Cached answer for a question close enough to an earlier one on the same collection, or None"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._set_version(collection, corpus_version)
+            self._expire()
+            keys, matrix = self._matrix(collection)
+            if matrix is not None:
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(self._entries[key]["answer"], cache_similarity=round(float(scores[best]), 4))
+            self.misses += 1
+            return None
+
+    def store(self, vector: Sequence[float], corpus_version: str, answer: Dict, collection: Hashable = None):
+        with self._lock:
+            self._set_version(collection, corpus_version)
+            self._entries[self._next_key] = {
+                "vector": self._normalize(vector),
+                "answer": answer,
+                "collection": collection,
+                "created": time.time()
+            }
+            self._next_key += 1
+            self._matrices.pop(collection, None)
+            while len(self._entries) > self.max_entries:
+                self._drop([next(iter(self._entries))])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "collections": len({entry["collection"] for entry in self._entries.values()}),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -1,3 +1,4 @@
+import os
 from document_manager import DocumentManager
 from vector_store import VectorStoreManager  
 from llm_manager import LLMManager
@@ -10,22 +11,37 @@ class RAGApplication:
         self.llm_manager = LLMManager()
         self.rag_chain = None
         self.setup_complete = False
+        # Empty disables snapshots: the corpus is then re-embedded on every launch
+        self.snapshot_path = os.getenv('INDEX_SNAPSHOT_PATH', 'index.snapshot')
 
     def setup(self):
         print("Initializing RAG Application...")
         
         llm = self.llm_manager.get_llm()
         embeddings = self.llm_manager.get_embeddings()
+        # The model loads into Ollama while documents are read and embedded
+        self.llm_manager.warm_up()
         
-        documents = self.doc_manager.load_documents()
-        chunks = self.doc_manager.split_documents(documents)
-        
-        vector_store = self.vector_manager.create_vector_store(chunks, embeddings)
+        vector_store = None
+        if self.snapshot_path:
+            # An unchanged corpus is loaded from the last run's snapshot instead of being re-embedded
+            snapshot_key = {"embedding": self.llm_manager.embedding_spec.describe(), **self.doc_manager.snapshot_key()}
+            vector_store = self.vector_manager.open_snapshot(self.snapshot_path, embeddings, snapshot_key)
+        if vector_store is None:
+            documents = self.doc_manager.load_documents()
+            if self.snapshot_path and self.doc_manager.corpus_source == "documents":
+                vector_store = self.vector_manager.create_snapshot(
+                    self.snapshot_path, documents, self.doc_manager.text_splitter, embeddings, snapshot_key
+                )
+            else:
+                # Web and sample corpora are re-embedded each run rather than pinned in a snapshot
+                chunks = self.doc_manager.split_documents(documents)
+                vector_store = self.vector_manager.create_vector_store(chunks, embeddings)
         
         self.rag_chain = RAGChain(llm, vector_store)
         self.setup_complete = True
         
-        print(f"RAG setup complete! Loaded {len(chunks)} document chunks.")
+        print(f"RAG setup complete! Loaded {self.vector_manager.document_count} document chunks.")
 
     def chat(self):
         if not self.setup_complete:
@@ -0,0 +1,421 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List
+
+from aiohttp import web
+
+import metrics
+import tracing
+from generation_scheduler import SchedulerRejected
+from wire_format import MIN_COMPRESS_BYTES, MissingDocuments
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not change what is being asked"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?!.")
+
+
+def corpus_fingerprint(documents: List[Dict], document_refs: List[Dict] = ()) -> str:
+    """Order-independent hash of the documents sent or referenced with a query"""
+    digest = hashlib.sha256()
+    entries = sorted(
+        [f"{doc.get('id') or doc.get('title', '')}\0{hashlib.sha256(doc.get('content', '').encode('utf-8')).hexdigest()}"
+         for doc in documents]
+        + [f"{ref.get('id') or ref.get('title', '')}\0ref:{ref.get('hash')}" for ref in document_refs]
+    )
+    for entry in entries:
+        digest.update(entry.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Runs one computation per key; concurrent callers with the same key await the same result
+
+    The shared task is shielded, so a caller that disconnects does not cancel
+    the work for the others still waiting on it.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {"in_flight": len(self._inflight), "started": self.started, "coalesced": self.coalesced}
+
+
+def compressed(response: web.Response) -> web.Response:
+    """Compress a large response in an encoding the client accepts (request bodies are inflated by aiohttp itself)"""
+    if response.body is not None and len(response.body) >= MIN_COMPRESS_BYTES:
+        response.enable_compression()
+    return response
+
+
+async def iterate_in_thread(make_iterator: Callable[[], Iterator]) -> AsyncIterator:
+    """Items of a blocking iterator run to completion on its own thread, as they are produced
+
+    Closing the async iterator (the client went away) stops the thread at its
+    next item and closes the iterator there, so a generator's cleanup, such as
+    releasing a scheduler slot, runs on the thread that ran it.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+    finished = object()
+
+    def run():
+        iterator = make_iterator()
+        try:
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    threading.Thread(target=tracing.wrap(run), name="stream", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+@web.middleware
+async def trace_requests(request: web.Request, handler):
+    """Trace requests sent with X-RAG-Trace (or ?trace=); see tracing.py"""
+    modes = tracing.requested_modes(request.headers.get('X-RAG-Trace') or request.query.get('trace'))
+    if not modes:
+        return await handler(request)
+    # Each request runs in its own task, so the trace stays with this request's context
+    trace = tracing.Trace(f"{request.method} {request.path}", modes).activate()
+    request["trace"] = trace
+    try:
+        return await handler(request)
+    finally:
+        trace.stop()
+        await asyncio.to_thread(trace.finish)
+
+
+async def trace_headers(request: web.Request, response: web.StreamResponse):
+    """Name the trace in the headers, before they are sent (streamed responses send them from the handler)"""
+    trace = request.get("trace")
+    if trace is not None:
+        response.headers['X-RAG-Trace-Id'] = trace.id
+        response.headers['X-RAG-Trace-File'] = trace.file_prefix + ".trace.json"
+
+
+def ingestion_jobs():
+    """rag_service's background ingestion jobs, shared with the Flask routes"""
+    # Imported here so async_service can bind its port before rag_service loads (see startup.py)
+    from rag_service import ingestion_jobs as jobs
+
+    return jobs
+
+
+def create_app(processor, startup=None) -> web.Application:
+    """aiohttp application serving the API of rag_service.py for a RAGProcessor without blocking on Ollama
+
+    With startup (a startup.BackgroundStartup still building the processor)
+    processor is None and requests are answered 503 until it is ready.
+    """
+    middlewares = [trace_requests]
+    if startup is not None:
+        @web.middleware
+        async def startup_gate(request: web.Request, handler):
+            if request.path == '/startup':
+                return web.json_response(startup.report())
+            if startup.processor is None:
+                status, body, headers = startup.unavailable()
+                return web.json_response(body, status=status, headers=headers)
+            return await handler(request)
+
+        middlewares.insert(0, startup_gate)
+
+    def rag():
+        return startup.processor if startup is not None else processor
+
+    app = web.Application(client_max_size=int(os.getenv('MAX_REQUEST_MB', '512')) * 1024 * 1024,
+                          middlewares=middlewares)
+    app.on_response_prepare.append(trace_headers)
+    flights = SingleFlight()
+    app["single_flight"] = flights
+
+    async def health(request: web.Request) -> web.Response:
+        status = await asyncio.to_thread(rag().ollama.health)
+        if not status["ollama_connected"]:
+            return web.json_response({"status": "error", "message": f"Ollama connection failed: {status.get('error')}",
+                                      **status}, status=503)
+        return web.json_response({"status": "ok", **status})
+
+    async def ready(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ready"})
+
+    async def json_body(request: web.Request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def open_collection(name, create=False, shards=None):
+        """The named collection and None, or None and the error response when it is invalid or does not exist
+
+        Opening a collection the first time reads its manifest and rebuilds
+        its keyword index, so it runs off the event loop.
+        """
+        try:
+            return await asyncio.to_thread(rag().collections.get, name, create=create, shards=shards), None
+        except ValueError as e:
+            return None, web.json_response({"error": str(e)}, status=400)
+        except KeyError:
+            return None, web.json_response({"error": f"Collection not found: {name}"}, status=404)
+
+    async def rag_query(request: web.Request) -> web.Response:
+        data = await json_body(request)
+        if not data or 'query' not in data:
+            return web.json_response({"error": "Query is required"}, status=400)
+
+        query = data['query'].strip()
+        if not query:
+            return web.json_response({"error": "Query cannot be empty"}, status=400)
+
+        documents = data.get('documents') or []
+        document_refs = data.get('document_refs') or []
+        prune = bool(data.get('prune'))
+        try:
+            priority = rag().scheduler.priority(data.get('priority'))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        deadline = rag().scheduler.deadline(data.get('deadline_ms'))
+        collection = data.get('collection')
+        index, error = await open_collection(collection, create=bool(documents or document_refs))
+        if error:
+            return error
+        logger.info(f"Processing {priority} query: {query[:50]}... with {len(documents)} documents"
+                    f" and {len(document_refs)} references")
+
+        # Coalesced callers share the priority and deadline of the first one. Sent documents are
+        # upserted into the collection, so the answer depends on both them and what it already holds;
+        # hashing their content takes a while for large uploads, so it runs off the event loop
+        key = await asyncio.to_thread(lambda: (
+            normalize_question(query), index.name, index.version,
+            corpus_fingerprint(documents, document_refs) if documents or document_refs else None, prune
+        ))
+        try:
+            result = await flights.do(key, lambda: rag().aquery(query, documents, priority, deadline, collection,
+                                                                document_refs, prune))
+            return compressed(web.json_response(result))
+        except SchedulerRejected as e:
+            logger.warning(f"⏳ Query turned away: {e}")
+            return web.json_response(e.to_dict(), status=e.status, headers={"Retry-After": e.retry_after_header})
+        except MissingDocuments as e:
+            logger.info(f"📨 Asking for {len(e.hashes)} referenced documents")
+            return web.json_response(e.to_dict(), status=409)
+        except Exception as e:
+            logger.error(f"Error in rag_query endpoint: {e}")
+            return web.json_response({"error": f"Internal server error: {str(e)}"}, status=500)
+
+    async def rag_query_stream(request: web.Request) -> web.StreamResponse:
+        data = await json_body(request)
+        if not data or 'query' not in data:
+            return web.json_response({"error": "Query is required"}, status=400)
+
+        query = data['query'].strip()
+        if not query:
+            return web.json_response({"error": "Query cannot be empty"}, status=400)
+
+        documents = data.get('documents') or []
+        document_refs = data.get('document_refs') or []
+        prune = bool(data.get('prune'))
+        try:
+            priority = rag().scheduler.priority(data.get('priority'))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        deadline = rag().scheduler.deadline(data.get('deadline_ms'))
+        collection = data.get('collection')
+        _, error = await open_collection(collection, create=bool(documents or document_refs))
+        if error:
+            return error
+
+        # Once the stream has started the status is 200, so a full queue or missing documents are refused up front
+        try:
+            rag().scheduler.check()
+        except SchedulerRejected as e:
+            return web.json_response(e.to_dict(), status=e.status, headers={"Retry-After": e.retry_after_header})
+        if document_refs:
+            missing = await asyncio.to_thread(rag().missing_documents, document_refs, documents, collection)
+            if missing:
+                return web.json_response(MissingDocuments(missing).to_dict(), status=409)
+
+        logger.info(f"Streaming {priority} query: {query[:50]}... with {len(documents)} documents"
+                    f" and {len(document_refs)} references")
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"
+        })
+        await response.prepare(request)
+        events = iterate_in_thread(lambda: rag().stream_query(query, documents, priority, deadline, collection,
+                                                              document_refs, prune))
+        try:
+            async for event in events:
+                await response.write(event.encode("utf-8"))
+        finally:
+            await events.aclose()
+        await response.write_eof()
+        return response
+
+    async def list_collections(request: web.Request) -> web.Response:
+        return web.json_response({"collections": await asyncio.to_thread(rag().collections.list)})
+
+    async def create_collection(request: web.Request) -> web.Response:
+        data = await json_body(request) or {}
+        name = data.get('name')
+        if not name:
+            return web.json_response({"error": "Collection name is required"}, status=400)
+        try:
+            shards = int(data['shards']) if data.get('shards') else None
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        existed = rag().collections.exists(name)
+        index, error = await open_collection(name, create=True, shards=shards)
+        if error:
+            return error
+        return web.json_response({"collection": index.stats()}, status=200 if existed else 201)
+
+    async def list_documents(request: web.Request) -> web.Response:
+        collection = request.query.get('collection')
+        index, error = await open_collection(collection)
+        if error:
+            return error
+        documents = await asyncio.to_thread(index.list_documents)
+        return compressed(web.json_response({"documents": documents}))
+
+    async def upsert_documents(request: web.Request) -> web.Response:
+        data = await json_body(request)
+        if not data or not data.get('documents'):
+            return web.json_response({"error": "Documents are required"}, status=400)
+
+        documents = data['documents']
+        if any(not doc.get('id') for doc in documents):
+            return web.json_response({"error": "Every document needs an id"}, status=400)
+
+        collection = data.get('collection')
+        try:
+            shards = int(data['shards']) if data.get('shards') else None
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        index, error = await open_collection(collection, create=True, shards=shards)
+        if error:
+            return error
+
+        try:
+            langchain_docs = await asyncio.to_thread(rag().process_documents, documents)
+            if data.get('async'):
+                job = ingestion_jobs().start(rag(), langchain_docs, index)
+                return web.json_response({"job": job}, status=202)
+
+            # Embedding and index writes block, so they run off the event loop
+            results = await asyncio.to_thread(lambda: [
+                index.upsert(doc.metadata['doc_id'], doc.page_content, doc.metadata)
+                for doc in langchain_docs
+            ])
+            return web.json_response({"documents": results})
+        except Exception as e:
+            logger.error(f"Error in upsert_documents endpoint: {e}")
+            return web.json_response({"error": f"Internal server error: {str(e)}"}, status=500)
+
+    async def get_ingestion_job(request: web.Request) -> web.Response:
+        job = ingestion_jobs().get(request.match_info['job_id'])
+        if job is None:
+            return web.json_response({"error": "Job not found"}, status=404)
+        return web.json_response({"job": job})
+
+    async def delete_document(request: web.Request) -> web.Response:
+        doc_id = request.match_info['doc_id']
+        collection = request.query.get('collection')
+        index, error = await open_collection(collection)
+        if error:
+            return error
+        try:
+            if not await asyncio.to_thread(index.delete, doc_id):
+                return web.json_response({"error": "Document not found"}, status=404)
+            return web.json_response({"message": "Document deleted", "id": doc_id})
+        except Exception as e:
+            logger.error(f"Error in delete_document endpoint: {e}")
+            return web.json_response({"error": f"Internal server error: {str(e)}"}, status=500)
+
+    async def answer_cache_stats(request: web.Request) -> web.Response:
+        if rag().answer_cache is None:
+            return web.json_response({"enabled": False})
+        return web.json_response({"enabled": True, **rag().answer_cache.stats()})
+
+    async def prometheus_metrics(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.REGISTRY.render().encode("utf-8"),
+                            headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    async def coalescing_stats(request: web.Request) -> web.Response:
+        return web.json_response(flights.stats())
+
+    async def scheduler_stats(request: web.Request) -> web.Response:
+        return web.json_response(rag().scheduler.stats())
+
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', ready)
+    app.router.add_post('/rag/query', rag_query)
+    app.router.add_post('/rag/query/stream', rag_query_stream)
+    app.router.add_get('/rag/collections', list_collections)
+    app.router.add_post('/rag/collections', create_collection)
+    app.router.add_get('/rag/documents', list_documents)
+    app.router.add_post('/rag/documents', upsert_documents)
+    app.router.add_get('/rag/documents/jobs/{job_id}', get_ingestion_job)
+    app.router.add_delete('/rag/documents/{doc_id}', delete_document)
+    app.router.add_get('/rag/cache', answer_cache_stats)
+    app.router.add_get('/rag/inflight', coalescing_stats)
+    app.router.add_get('/rag/scheduler', scheduler_stats)
+    app.router.add_get('/metrics', prometheus_metrics)
+    return app
+
+
+def run_async_server(processor, host: str = '0.0.0.0', port: int = 8080):
+    web.run_app(create_app(processor), host=host, port=port)
+
+
+if __name__ == '__main__':
+    import rag_service
+
+    if rag_service.rag_processor is None:
+        raise SystemExit("RAG processor failed to initialize")
+    run_async_server(
+        rag_service.rag_processor,
+        host=os.getenv('FLASK_HOST', '0.0.0.0'),
+        port=int(os.getenv('FLASK_PORT', 8080))
+    )
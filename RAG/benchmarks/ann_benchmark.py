@@ -0,0 +1,118 @@
+"""Recall@k and latency of the IVF index against exact search
+
+Run from the RAG directory, either on synthetic clustered vectors:
+
+    python -m benchmarks.ann_benchmark --rows 200000 --dim 768 --nlist 256 1024 --nprobe 1 4 8 16 32
+
+or on a persisted numpy index (VECTOR_STORE_TYPE=numpy):
+
+    python -m benchmarks.ann_benchmark --index-path chroma_db/rag_documents
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from numpy_store import NumpyVectorStore
+
+
+def synthetic_vectors(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Gaussian mixture, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=rows)
+    vectors = centers[labels] + 0.5 * rng.normal(size=(rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, nlists, nprobes):
+    texts = [""] * len(vectors)
+    flat = NumpyVectorStore(None)
+    flat.add_vectors(vectors, texts)
+
+    exact_results, exact_latency = [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact_results.append({row for row, _ in flat.search_vector(query, k)})
+        exact_latency.append(time.perf_counter() - start)
+
+    results = [{
+        "index": "flat",
+        "recall_at_k": 1.0,
+        "p50_ms": percentile_ms(exact_latency, 50),
+        "p99_ms": percentile_ms(exact_latency, 99)
+    }]
+
+    for nlist in nlists:
+        build_start = time.perf_counter()
+        store = NumpyVectorStore(None, index_type="ivf", nlist=nlist, ivf_train_size=len(vectors))
+        store.add_vectors(vectors, texts)
+        build_time = time.perf_counter() - build_start
+
+        for nprobe in nprobes:
+            if nprobe > nlist:
+                continue
+            recalls, latency = [], []
+            for query, expected in zip(queries, exact_results):
+                start = time.perf_counter()
+                found = store.search_vector(query, k, nprobe=nprobe)
+                latency.append(time.perf_counter() - start)
+                recalls.append(len(expected & {row for row, _ in found}) / len(expected))
+            results.append({
+                "index": "ivf",
+                "nlist": nlist,
+                "nprobe": nprobe,
+                "build_s": round(build_time, 2),
+                "recall_at_k": round(float(np.mean(recalls)), 4),
+                "p50_ms": percentile_ms(latency, 50),
+                "p99_ms": percentile_ms(latency, 99)
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF recall vs latency benchmark")
+    parser.add_argument("--index-path", help="persisted NumpyVectorStore directory to benchmark instead of synthetic data")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if args.index_path:
+        vectors = np.asarray(NumpyVectorStore(None, persist_path=args.index_path).vectors)
+        print(f"Loaded {len(vectors)} vectors from {args.index_path}")
+    else:
+        vectors = synthetic_vectors(args.rows, args.dim, args.clusters, args.seed)
+        print(f"Generated {len(vectors)} synthetic {args.dim}-d vectors")
+
+    # Queries are perturbed corpus rows, like questions phrased close to a chunk
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    results = run(vectors, queries, args.k, args.nlist, args.nprobe)
+
+    print(f"\n{'index':<6} {'nlist':>6} {'nprobe':>6} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for result in results:
+        print(f"{result['index']:<6} {result.get('nlist', '-'):>6} {result.get('nprobe', '-'):>6} "
+              f"{result['recall_at_k']:>9.3f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": len(vectors), "k": args.k, "results": results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""Stage-level latency of the RAG pipelines against a local stub Ollama server
+
+Runs RAGProcessor (rag_service.py), VectorStoreManager + RAGChain (app.py) and
+the LangGraph pipeline (main.py) over synthetic corpora, for every combination
+of corpus size, chunk size and concurrency. Nothing leaves the machine, so the
+numbers only move when our code does. Run from the RAG directory:
+
+    python -m benchmarks.pipeline_benchmark --docs 20 200 --chunk-size 500 1000 --concurrency 1 4 --json bench.json
+
+Compare a later run against a saved one; the exit status is 1 when a latency
+grows (or a throughput drops) by more than --max-regression:
+
+    python -m benchmarks.pipeline_benchmark --baseline bench.json --max-regression 0.25
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from benchmarks.stub_ollama import StubOllamaServer
+
+MODEL = "deepseek-r1:8b"
+
+TOPICS = ["health insurance", "motor insurance", "home loan", "personal loan", "fixed deposit",
+          "travel insurance", "credit card", "gold loan", "term life cover", "two-wheeler loan"]
+CLAUSES = [
+    "Claims under policy {code} are settled within {days} days of receiving the documents.",
+    "The {topic} plan covers hospitalisation, day-care procedures and ambulance charges up to Rs {amount}.",
+    "Pre-existing conditions are covered after a waiting period of {days} months for {topic}.",
+    "Prepayment of the {topic} is allowed after {days} EMIs without any foreclosure charges.",
+    "Customers can raise a service request for {topic} from the app using reference {code}.",
+    "Interest on the {topic} is calculated on a reducing balance at {rate} percent per annum.",
+    "Policy {code} excludes damage caused by wear and tear, war or nuclear risks.",
+    "Renewal of {topic} within {days} days of expiry keeps the no-claim bonus intact."
+]
+
+
+def synthetic_corpus(docs: int, paragraphs: int = 6, seed: int = 0) -> List[Dict]:
+    """Policy-like documents in the payload shape the Go backend sends"""
+    rng = random.Random(seed)
+    corpus = []
+    for doc_number in range(docs):
+        topic = TOPICS[doc_number % len(TOPICS)]
+        body = []
+        for _ in range(paragraphs):
+            sentences = [
+                rng.choice(CLAUSES).format(
+                    topic=topic,
+                    code=f"POL-{rng.randint(1000, 9999)}",
+                    days=rng.randint(7, 90),
+                    amount=rng.randint(1, 50) * 10000,
+                    rate=round(rng.uniform(7, 16), 2)
+                )
+                for _ in range(rng.randint(3, 6))
+            ]
+            body.append(" ".join(sentences))
+        corpus.append({"id": str(doc_number), "title": f"{topic.title()} terms {doc_number}", "content": "\n\n".join(body)})
+    return corpus
+
+
+def synthetic_questions(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    templates = ["How long does claim settlement take for {topic}?", "What does the {topic} plan cover?",
+                 "Can I prepay my {topic}?", "What is the waiting period for {topic}?",
+                 "How is interest calculated on {topic}?"]
+    return [rng.choice(templates).format(topic=rng.choice(TOPICS)) for _ in range(count)]
+
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return round(ordered[index] * 1000, 3)
+
+
+def run_concurrent(fn: Callable[[str], object], questions: List[str], concurrency: int) -> Dict:
+    """Latency percentiles and throughput of fn over questions with a fixed number of workers"""
+    latencies = []
+    results = []
+
+    def timed(question):
+        start = time.perf_counter()
+        result = fn(question)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results.extend(pool.map(timed, questions))
+    wall = time.perf_counter() - wall_start
+    return {
+        "results": results,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "qps": round(len(questions) / wall, 2)
+    }
+
+
+def bench_rag_service(corpus: List[Dict], chunk_size: int, concurrencies: List[int],
+                      questions: List[str], base_url: str, workdir: str) -> Dict:
+    os.environ.update({
+        "CHUNK_SIZE": str(chunk_size),
+        "CHUNK_OVERLAP": str(chunk_size // 5),
+        "CHROMA_PERSIST_DIRECTORY": os.path.join(workdir, "index"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embedding_cache")
+    })
+    from rag_service import RAGProcessor
+
+    processor = RAGProcessor()
+    # Stage means come from each query's StageClock, processing_time rounds them to 10 ms
+    clocks = []
+    retrieve_context = processor.retrieve_context
+
+    def recording_retrieve_context(*args, **kwargs):
+        retrieval = retrieve_context(*args, **kwargs)
+        if "clock" in retrieval:
+            clocks.append(retrieval["clock"])
+        return retrieval
+
+    processor.retrieve_context = recording_retrieve_context
+    documents = processor.process_documents(corpus)
+    start = time.perf_counter()
+    processor.update_index(documents)
+    result = {"index_s": round(time.perf_counter() - start, 3), "chunks": processor.index.chunk_count()}
+
+    for concurrency in concurrencies:
+        clocks.clear()
+        run = run_concurrent(lambda q: processor.query(q, corpus), questions, concurrency)
+        errors = [r for r in run["results"] if "error" in r]
+        if errors:
+            raise RuntimeError(errors[0]["error"])
+        stages = {}
+        for stage in sorted({name for clock in clocks for name in clock.wall}):
+            values = [clock.wall[stage] for clock in clocks if stage in clock.wall]
+            stages[f"{stage}_mean_ms"] = round(statistics.mean(values) * 1000, 3)
+        if clocks:
+            overlap = [max(0.0, sum(clock.wall.values()) - sum(clock.critical.values())) for clock in clocks]
+            stages["overlap_mean_ms"] = round(statistics.mean(overlap) * 1000, 3)
+        result[f"c{concurrency}"] = {
+            "query_p50_ms": run["p50_ms"], "query_p99_ms": run["p99_ms"], "query_qps": run["qps"], **stages
+        }
+    return result
+
+
+def split_corpus(corpus: List[Dict], chunk_size: int):
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_size // 5,
+        separators=["\n\n", "\n", ". ", " "],
+        add_start_index=True
+    )
+    return splitter.split_documents(
+        [Document(page_content=doc["content"], metadata={"source": doc["title"]}) for doc in corpus]
+    )
+
+
+def bench_app(corpus: List[Dict], chunk_size: int, concurrencies: List[int],
+              questions: List[str], base_url: str, workdir: str) -> Dict:
+    from llm_manager import LLMManager
+    from vector_store import VectorStoreManager
+
+    llm_manager = LLMManager(model_name=MODEL, base_url=base_url)
+    chunks = split_corpus(corpus, chunk_size)
+    manager = VectorStoreManager()
+    start = time.perf_counter()
+    vector_store = manager.create_vector_store(chunks, llm_manager.get_embeddings())
+    result = {"index_s": round(time.perf_counter() - start, 3), "chunks": len(chunks)}
+
+    try:
+        from rag_chain import ERROR_PREFIX, RAGChain
+        rag_chain = RAGChain(llm_manager.get_llm(), vector_store)
+    except ImportError as e:
+        rag_chain = None
+        result["chain_skipped"] = str(e)
+
+    for concurrency in concurrencies:
+        search = run_concurrent(lambda q: manager.similarity_search(q), questions, concurrency)
+        entry = {"search_p50_ms": search["p50_ms"], "search_p99_ms": search["p99_ms"], "search_qps": search["qps"]}
+        if rag_chain is not None:
+            chain = run_concurrent(rag_chain.invoke, questions, concurrency)
+            # RAGChain.invoke reports failures as an answer rather than raising
+            errors = [r["answer"] for r in chain["results"] if r["answer"].startswith(ERROR_PREFIX)]
+            if errors:
+                raise RuntimeError(errors[0])
+            entry.update({"query_p50_ms": chain["p50_ms"], "query_p99_ms": chain["p99_ms"], "query_qps": chain["qps"]})
+        result[f"c{concurrency}"] = entry
+
+    if hasattr(vector_store, "delete_collection"):
+        vector_store.delete_collection()
+    return result
+
+
+def bench_main(corpus: List[Dict], chunk_size: int, concurrencies: List[int],
+               questions: List[str], base_url: str, workdir: str) -> Dict:
+    from langchain_community.vectorstores import Chroma
+    from langchain_core.prompts import PromptTemplate
+    from langgraph.graph import START, StateGraph
+    from main import State, generate, retrieve
+    from ollama_client import OllamaClients
+
+    clients = OllamaClients(base_url=base_url, model=MODEL)
+    llm = clients.llm()
+    embeddings = clients.embeddings()
+    prompt = PromptTemplate.from_template("Context: {context}\n\nQuestion: {question}\n\nAnswer:")
+    chunks = split_corpus(corpus, chunk_size)
+
+    start = time.perf_counter()
+    vector_store = Chroma.from_documents(documents=chunks, embedding=embeddings)
+    result = {"index_s": round(time.perf_counter() - start, 3), "chunks": len(chunks)}
+
+    def retrieve_with_store(state: State):
+        return retrieve(state, vector_store)
+
+    def generate_with_llm(state: State):
+        return generate(state, llm, prompt)
+
+    graph_builder = StateGraph(State).add_sequence([retrieve_with_store, generate_with_llm])
+    graph_builder.add_edge(START, "retrieve_with_store")
+    graph = graph_builder.compile()
+
+    for concurrency in concurrencies:
+        run = run_concurrent(lambda q: graph.invoke({"question": q}), questions, concurrency)
+        result[f"c{concurrency}"] = {"query_p50_ms": run["p50_ms"], "query_p99_ms": run["p99_ms"], "query_qps": run["qps"]}
+
+    vector_store.delete_collection()
+    return result
+
+
+PIPELINES = {"rag_service": bench_rag_service, "app": bench_app, "main": bench_main}
+
+
+def flatten(results: Dict) -> Dict[str, float]:
+    """metric name -> value, e.g. "rag_service/docs=20/chunk=500/c4/query_p50_ms" """
+    metrics = {}
+
+    def walk(prefix, node):
+        for key, value in node.items():
+            name = f"{prefix}/{key}" if prefix else key
+            if isinstance(value, dict):
+                walk(name, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics[name] = value
+
+    walk("", results)
+    return metrics
+
+
+def find_regressions(current: Dict[str, float], baseline: Dict[str, float], max_regression: float,
+                     min_delta_ms: float = 1.0) -> List[Dict]:
+    """Latencies that grew, or throughputs that fell, by more than max_regression"""
+    regressions = []
+    for name, value in current.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if name.endswith("_ms") or name.endswith("_s"):
+            delta_ms = (value - before) * (1 if name.endswith("_ms") else 1000)
+            # Sub-millisecond stages are dominated by noise
+            regressed = value > before * (1 + max_regression) and delta_ms > min_delta_ms
+        elif name.endswith("qps"):
+            regressed = value < before * (1 - max_regression)
+        else:
+            continue
+        if regressed:
+            regressions.append({"metric": name, "baseline": before, "current": value,
+                                "change": round(value / before - 1, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG pipeline stage benchmark against a stub Ollama server")
+    parser.add_argument("--pipelines", nargs="+", choices=sorted(PIPELINES), default=["rag_service", "app", "main"])
+    parser.add_argument("--docs", type=int, nargs="+", default=[20, 100], help="corpus sizes in documents")
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[500, 1000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--queries", type=int, default=20, help="queries per concurrency level")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], help="VECTOR_STORE_TYPE for rag_service and app")
+    parser.add_argument("--dim", type=int, default=256, help="stub embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=2.0)
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0.1)
+    parser.add_argument("--first-token-latency-ms", type=float, default=20.0)
+    parser.add_argument("--token-latency-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    stub = StubOllamaServer(
+        dim=args.dim,
+        model=MODEL,
+        embed_latency=args.embed_latency_ms / 1000,
+        embed_item_latency=args.embed_item_latency_ms / 1000,
+        first_token_latency=args.first_token_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000
+    ).start()
+    # Configure rag_service before it is imported, its module-level processor reads the environment
+    os.environ.update({
+        "OLLAMA_BASE_URL": stub.base_url,
+        "OLLAMA_MODEL": MODEL,
+        "ANSWER_CACHE_ENABLED": "False",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "CHROMA_PERSIST_DIRECTORY": os.path.join(workdir, "default"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "default_cache")
+    })
+    if args.backend:
+        os.environ["VECTOR_STORE_TYPE"] = args.backend
+    questions = synthetic_questions(args.queries, args.seed + 1)
+
+    results = {}
+    try:
+        for pipeline in args.pipelines:
+            for docs in args.docs:
+                corpus = synthetic_corpus(docs, seed=args.seed)
+                for chunk_size in args.chunk_size:
+                    name = f"{pipeline}/docs={docs}/chunk={chunk_size}"
+                    print(f"Running {name}...", file=sys.stderr)
+                    try:
+                        results[name] = PIPELINES[pipeline](corpus, chunk_size, args.concurrency, questions,
+                                                            stub.base_url, tempfile.mkdtemp(dir=workdir))
+                    except ImportError as e:
+                        results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+                        print(f"  skipped: {e}", file=sys.stderr)
+                    logging.getLogger().setLevel(os.environ["LOG_LEVEL"])
+    finally:
+        stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")},
+        "stub_requests": stub.requests,
+        "results": results
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(flatten(results), flatten(baseline["results"]), args.max_regression)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(output)
+        print(f"Wrote {args.json}", file=sys.stderr)
+    else:
+        print(output)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+              f"({regression['change']:+.0%})", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Recall@k, memory and latency of quantized numpy storage against float32
+
+Run from the RAG directory:
+
+    python -m benchmarks.quantization_benchmark --rows 200000 --dim 768 --rescore-factor 1 4 8
+
+Recall is measured against exact float32 search; memory is the size of the
+in-memory matrix, not counting the float32 copy kept on disk for re-scoring.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.ann_benchmark import percentile_ms, synthetic_vectors
+from numpy_store import NumpyVectorStore
+
+
+def measure(store: NumpyVectorStore, queries: np.ndarray, expected, k: int):
+    recalls, latency = [], []
+    for query, truth in zip(queries, expected):
+        start = time.perf_counter()
+        found = store.search_vector(query, k)
+        latency.append(time.perf_counter() - start)
+        recalls.append(len(truth & {row for row, _ in found}) / len(truth))
+    return {
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "memory_mb": round(store.memory_bytes() / 1024 / 1024, 1),
+        "p50_ms": percentile_ms(latency, 50),
+        "p99_ms": percentile_ms(latency, 99)
+    }
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, kinds, rescore_factors, index_type: str, nlist: int):
+    texts = [""] * len(vectors)
+    results = []
+    expected = None
+    for kind in kinds:
+        for rescore_factor in (rescore_factors if kind != "none" else [None]):
+            with tempfile.TemporaryDirectory() as workdir:
+                store = NumpyVectorStore(None, persist_path=workdir, index_type=index_type, nlist=nlist,
+                                         ivf_train_size=len(vectors), quantization=kind,
+                                         rescore_factor=rescore_factor or 1)
+                store.add_vectors(vectors, texts)
+                if expected is None:
+                    expected = [{row for row, _ in store.search_vector(query, k, exact=True)} for query in queries]
+                results.append({"quantization": kind, "rescore_factor": rescore_factor,
+                                **measure(store, queries, expected, k)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantized storage recall vs memory benchmark")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--quantization", nargs="+", default=["none", "float16", "int8"])
+    parser.add_argument("--rescore-factor", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--index-type", default="flat", choices=["flat", "ivf"])
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.rows, args.dim, args.clusters, args.seed)
+    print(f"Generated {len(vectors)} synthetic {args.dim}-d vectors")
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    results = run(vectors, queries, args.k, args.quantization, args.rescore_factor, args.index_type, args.nlist)
+
+    print(f"\n{'storage':<8} {'rescore':>7} {'recall@' + str(args.k):>9} {'MB':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for result in results:
+        print(f"{result['quantization']:<8} {result['rescore_factor'] or '-':>7} {result['recall_at_k']:>9.3f} "
+              f"{result['memory_mb']:>8.1f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": len(vectors), "dim": args.dim, "k": args.k, "results": results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
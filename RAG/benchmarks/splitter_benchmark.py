@@ -0,0 +1,95 @@
+"""Throughput of OffsetTextSplitter against LangChain's RecursiveCharacterTextSplitter
+
+Run from the RAG directory:
+
+    python -m benchmarks.splitter_benchmark --mb 100 --chunk-size 500 --chunk-overlap 100
+
+Compatibility mode is checked chunk for chunk against LangChain's output.
+"""
+import argparse
+import json
+import time
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.pipeline_benchmark import synthetic_corpus
+from offset_splitter import DEFAULT_SEPARATORS, OffsetTextSplitter
+
+
+def synthetic_text(megabytes: float, seed: int) -> str:
+    corpus = synthetic_corpus(500, paragraphs=8, seed=seed)
+    text = "\n\n".join(doc["content"] for doc in corpus)
+    size = int(megabytes * 1024 * 1024)
+    return (text * (size // len(text) + 1))[:size]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, round(time.perf_counter() - start, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text splitter throughput benchmark")
+    parser.add_argument("--mb", type=float, default=100)
+    parser.add_argument("--documents", type=int, default=1, help="split the text into this many documents")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--skip-langchain", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    text = synthetic_text(args.mb, args.seed)
+    step = len(text) // args.documents + 1
+    documents = [Document(page_content=text[i:i + step], metadata={"title": f"doc {i // step}"})
+                 for i in range(0, len(text), step)]
+    print(f"Splitting {args.mb} MB in {len(documents)} document(s)")
+
+    splitters = {
+        "offset_compat": OffsetTextSplitter(args.chunk_size, args.chunk_overlap, add_start_index=True,
+                                            compat=True, max_workers=args.workers),
+        "offset_fast": OffsetTextSplitter(args.chunk_size, args.chunk_overlap, add_start_index=True,
+                                          compat=False, max_workers=args.workers)
+    }
+    results = {}
+    outputs = {}
+
+    texts = [doc.page_content for doc in documents]
+    spans, seconds = timed(lambda: splitters["offset_fast"].split_many_offsets(texts))
+    results["offset_fast_offsets_only"] = {"seconds": seconds, "chunks": sum(len(s) for s in spans)}
+
+    for name, splitter in splitters.items():
+        outputs[name], seconds = timed(lambda: splitter.split_documents(documents))
+        results[name] = {"seconds": seconds, "chunks": len(outputs[name])}
+
+    if not args.skip_langchain:
+        langchain = RecursiveCharacterTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            separators=DEFAULT_SEPARATORS,
+            add_start_index=True
+        )
+        expected, seconds = timed(lambda: langchain.split_documents(documents))
+        results["langchain"] = {"seconds": seconds, "chunks": len(expected)}
+        identical = len(expected) == len(outputs["offset_compat"]) and all(
+            a.page_content == b.page_content and a.metadata == b.metadata
+            for a, b in zip(expected, outputs["offset_compat"])
+        )
+        results["offset_compat"]["identical_to_langchain"] = identical
+
+    for name, result in results.items():
+        rate = args.mb / result["seconds"] if result["seconds"] else float("inf")
+        extra = "" if "identical_to_langchain" not in result else f"  identical={result['identical_to_langchain']}"
+        print(f"{name:<26} {result['seconds']:>8.2f}s {rate:>8.1f} MB/s {result['chunks']:>9} chunks{extra}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"mb": args.mb, "documents": len(documents), "results": results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
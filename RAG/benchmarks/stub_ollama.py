@@ -0,0 +1,186 @@
+"""Deterministic stand-in for the Ollama embedding and generate APIs
+
+Embeddings are a hash of the text plus a bag-of-words component, so similar
+texts get similar vectors and results are identical across runs. Latency is
+simulated with sleeps, which makes benchmarks measure our own overhead on a
+machine with no GPU and no network.
+
+    python -m benchmarks.stub_ollama --port 11434 --dim 768 --token-latency-ms 5
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+ANSWER_TOKENS = [
+    "<think>", "Looking at ", "the policy ", "context.", "</think>",
+    "\n\nThe policy ", "covers ", "the situation ", "described ", "in the question. ",
+    "Claims ", "are settled ", "within ", "30 days.",
+    "\n\nPlease ", "contact ", "support ", "for details."
+]
+
+
+def stub_embedding(text: str, dim: int) -> List[float]:
+    values = []
+    block = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{block}:{text}".encode("utf-8")).digest()
+        values.extend(byte / 255 - 0.5 for byte in digest)
+        block += 1
+    values = values[:dim]
+    for word in text.lower().split():
+        values[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dim] += 1.0
+    return values
+
+
+class StubOllamaServer:
+    """Threaded HTTP server answering /api/embed, /api/embeddings, /api/generate and /api/tags"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dim: int = 64, model: str = "deepseek-r1:8b",
+                 embed_latency: float = 0.0, embed_item_latency: float = 0.0,
+                 first_token_latency: float = 0.0, token_latency: float = 0.0):
+        self.dim = dim
+        self.model = model
+        self.embed_latency = embed_latency
+        self.embed_item_latency = embed_item_latency
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload: Dict, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, payload: Dict):
+                line = (json.dumps(payload) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                server._count(self.path)
+                if self.path.startswith("/api/tags"):
+                    self._json({"models": [{"name": server.model}]})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                server._count(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                    time.sleep(server.embed_latency + server.embed_item_latency * len(texts))
+                    self._json({"model": body["model"], "embeddings": [stub_embedding(t, server.dim) for t in texts]})
+                elif self.path == "/api/embeddings":
+                    time.sleep(server.embed_latency + server.embed_item_latency)
+                    self._json({"embedding": stub_embedding(body["prompt"], server.dim)})
+                elif self.path in ("/api/generate", "/api/chat"):
+                    self._generate(body)
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def _generate(self, body: Dict):
+                stats = {
+                    "done": True, "done_reason": "stop",
+                    "prompt_eval_count": len(body.get("prompt", "").split()),
+                    "eval_count": len(ANSWER_TOKENS),
+                    "total_duration": 0, "load_duration": 0, "prompt_eval_duration": 0, "eval_duration": 0
+                }
+                time.sleep(server.first_token_latency)
+                if not body.get("stream", True):
+                    time.sleep(server.token_latency * len(ANSWER_TOKENS))
+                    self._json({"model": body["model"], "response": "".join(ANSWER_TOKENS), **stats})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in ANSWER_TOKENS:
+                    time.sleep(server.token_latency)
+                    self._chunk({"model": body["model"], "created_at": "2024-01-01T00:00:00Z",
+                                 "response": token, "done": False})
+                self._chunk({"model": body["model"], "created_at": "2024-01-01T00:00:00Z",
+                             "response": "", "context": [], **stats})
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+    def serve_forever(self):
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StubOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic stub Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--model", default="deepseek-r1:8b")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="fixed cost per embedding request")
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0.0, help="extra cost per embedded text")
+    parser.add_argument("--first-token-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubOllamaServer(
+        args.host, args.port, args.dim, args.model,
+        embed_latency=args.embed_latency_ms / 1000,
+        embed_item_latency=args.embed_item_latency_ms / 1000,
+        first_token_latency=args.first_token_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000
+    )
+    print(f"Stub Ollama listening on {server.base_url} ({args.dim}-d embeddings)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
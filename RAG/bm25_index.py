@@ -0,0 +1,89 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+# Keeps policy numbers, versions and product codes such as "pol-2023/114" or "4.5" as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from', 'how',
+    'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'the', 'to', 'was', 'were', 'what',
+    'when', 'which', 'who', 'why', 'with', 'you', 'your'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge ranked id lists, scoring each id by the sum of 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class BM25Index:
+    """Incremental inverted index scoring chunks with Okapi BM25"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, Tuple[str, ...]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, chunk_id: str, text: str):
+        tokens = tokenize(text)
+        with self._lock:
+            if chunk_id in self._lengths:
+                self.remove(chunk_id)
+            counts = Counter(tokens)
+            for term, count in counts.items():
+                self._postings.setdefault(term, {})[chunk_id] = count
+            self._terms[chunk_id] = tuple(counts)
+            self._lengths[chunk_id] = len(tokens)
+            self._total_length += len(tokens)
+
+    def add_many(self, chunk_ids: Sequence[str], texts: Sequence[str]):
+        for chunk_id, text in zip(chunk_ids, texts):
+            self.add(chunk_id, text)
+
+    def remove(self, chunk_id: str):
+        with self._lock:
+            length = self._lengths.pop(chunk_id, None)
+            if length is None:
+                return
+            self._total_length -= length
+            for term in self._terms.pop(chunk_id):
+                postings = self._postings[term]
+                del postings[chunk_id]
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._lengths)
+            if not n or not terms:
+                return []
+            avg_length = self._total_length / n
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:k]
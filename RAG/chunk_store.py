@@ -0,0 +1,172 @@
+import json
+import mmap
+import os
+import threading
+from typing import Dict, List, Optional
+
+
+class ChunkRef:
+    """A chunk as a character range of a document held in a DocumentTextStore"""
+
+    __slots__ = ("doc_key", "start", "end")
+
+    def __init__(self, doc_key: str, start: int, end: int):
+        self.doc_key = doc_key
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f"ChunkRef({self.doc_key!r}, {self.start}, {self.end})"
+
+    def to_json(self):
+        return [self.doc_key, self.start, self.end]
+
+
+class DocumentTextStore:
+    """Append-only file of full document texts, read through a memory map
+
+    ASCII documents are stored one byte per character and everything else as
+    UTF-32, so a character range maps to a byte range without scanning.
+    Document metadata is kept once per document instead of once per chunk.
+
+    Removals are two-phase: a removed document stays readable until
+    commit_removals(), which the owner calls once nothing persisted refers to
+    it. Space held by removed documents is reclaimed by rewriting the live
+    ones into a new data file when it exceeds half of the current one.
+    """
+
+    def __init__(self, path: str, compact_min_bytes: int = 64 * 1024 * 1024, read_only: bool = False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.index_path = os.path.join(path, "documents.json")
+        self.compact_min_bytes = compact_min_bytes
+        self._documents: Dict[str, Dict] = {}
+        self._removed = set()
+        self._dead_bytes = 0
+        self._generation = 0
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.RLock()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self._documents = saved["documents"]
+            self._dead_bytes = saved.get("dead_bytes", 0)
+            self._generation = saved.get("generation", 0)
+        # Bytes past the last persisted document belong to an interrupted write
+        end = max((doc["offset"] + doc["size"] for doc in self._documents.values()), default=0)
+        if not read_only:
+            with open(self.data_path, "ab") as f:
+                f.truncate(end)
+        self._size = end
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.path, f"documents.{self._generation}.bin")
+
+    def __contains__(self, doc_key: str) -> bool:
+        return doc_key in self._documents and doc_key not in self._removed
+
+    def __len__(self) -> int:
+        return len(self._documents) - len(self._removed)
+
+    def put(self, doc_key: str, text: str, metadata: Optional[Dict] = None):
+        width = 1 if text.isascii() else 4
+        data = text.encode("ascii" if width == 1 else "utf-32-le")
+        with self._lock:
+            with open(self.data_path, "ab") as f:
+                f.write(data)
+            if doc_key in self._documents:
+                self._dead_bytes += self._documents[doc_key]["size"]
+            self._removed.discard(doc_key)
+            self._documents[doc_key] = {
+                "offset": self._size,
+                "size": len(data),
+                "width": width,
+                "metadata": dict(metadata or {})
+            }
+            self._size += len(data)
+
+    def remove(self, doc_key: str):
+        with self._lock:
+            if doc_key in self._documents:
+                self._removed.add(doc_key)
+
+    def keys(self) -> List[str]:
+        return [doc_key for doc_key in self._documents if doc_key not in self._removed]
+
+    def metadata(self, doc_key: str) -> Dict:
+        return self._documents[doc_key]["metadata"]
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None or len(self._map) < self._size:
+            if self._map is not None:
+                self._map.close()
+            with open(self.data_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def text(self, doc_key: str, start: int = 0, end: Optional[int] = None) -> str:
+        """Characters start:end of a stored document"""
+        with self._lock:
+            entry = self._documents[doc_key]
+            width = entry["width"]
+            length = entry["size"] // width
+            end = length if end is None else min(end, length)
+            if end <= start:
+                return ""
+            data = self._mapped()[entry["offset"] + start * width:entry["offset"] + end * width]
+        return data.decode("ascii" if width == 1 else "utf-32-le")
+
+    def chunk_text(self, ref: ChunkRef) -> str:
+        return self.text(ref.doc_key, ref.start, ref.end)
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"documents": self._documents, "dead_bytes": self._dead_bytes,
+                                "generation": self._generation}))
+        os.replace(tmp_path, self.index_path)
+
+    def persist(self):
+        """Write the index, still listing documents whose removal is not committed"""
+        with self._lock:
+            self._write_index()
+
+    def commit_removals(self):
+        with self._lock:
+            if not self._removed:
+                return
+            for doc_key in self._removed:
+                self._dead_bytes += self._documents.pop(doc_key)["size"]
+            self._removed.clear()
+            if self._dead_bytes > self.compact_min_bytes and self._dead_bytes * 2 > self._size:
+                self._compact()
+            else:
+                self._write_index()
+
+    def _compact(self):
+        old_path = self.data_path
+        source = self._mapped()
+        self._generation += 1
+        offset = 0
+        with open(self.data_path, "wb") as f:
+            for entry in self._documents.values():
+                f.write(source[entry["offset"]:entry["offset"] + entry["size"]])
+                entry["offset"] = offset
+                offset += entry["size"]
+        self._map.close()
+        self._map = None
+        self._size = offset
+        self._dead_bytes = 0
+        # The old file is only dropped once the index points at the new one
+        self._write_index()
+        os.remove(old_path)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
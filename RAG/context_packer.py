@@ -0,0 +1,161 @@
+import re
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    """Rough token count, close enough for llama-style tokenizers on English prose"""
+    return int(len(text) / chars_per_token) + 1 if text else 0
+
+
+def source_key(doc: Document) -> Optional[str]:
+    metadata = doc.metadata or {}
+    for key in ("doc_id", "source", "title"):
+        if metadata.get(key):
+            return str(metadata[key])
+    return None
+
+
+def shingles(text: str, size: int = 3) -> set:
+    """Word n-grams of text, or its words when it is shorter than one n-gram"""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return set(words)
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def overlap(a: set, b: set) -> float:
+    """Share of the smaller set found in the other one"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+class PackedContext:
+    """Prompt context built from retrieved chunks, with the documents it came from"""
+
+    def __init__(self, context: str, documents: List[Document], tokens: int, input_tokens: int,
+                 merged: int, duplicates: int, dropped: int):
+        self.context = context
+        self.documents = documents
+        self.tokens = tokens
+        self.input_tokens = input_tokens
+        self.merged = merged
+        self.duplicates = duplicates
+        self.dropped = dropped
+
+    def stats(self) -> Dict:
+        return {
+            "context_tokens": self.tokens,
+            "input_tokens": self.input_tokens,
+            "merged_chunks": self.merged,
+            "duplicate_chunks": self.duplicates,
+            "dropped_chunks": self.dropped
+        }
+
+
+class ContextPacker:
+    """Assemble retrieved chunks into a prompt context that fits a token budget
+
+    Chunks are expected in ranking order. Chunks of the same source whose
+    start_index ranges overlap or touch are merged into one passage, so the
+    chunk_overlap characters they share are sent once. Passages are then
+    picked MMR-style: each next passage is the best ranked one whose word
+    trigram overlap with the already picked ones stays under duplicate_threshold.
+    Picked passages are added until token_budget is reached; the first one is
+    cut at a word boundary if it does not fit on its own.
+    """
+
+    def __init__(self, token_budget: int = 2560, chars_per_token: float = 4.0,
+                 duplicate_threshold: float = 0.85, separator: str = "\n\n"):
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.duplicate_threshold = duplicate_threshold
+        self.separator = separator
+
+    def tokens(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+
+    def merge_neighbours(self, docs: Sequence[Document]) -> List[Document]:
+        """Merge overlapping or adjacent chunks of the same source, keeping the best rank of each group"""
+        passages: List[Dict] = []
+        open_spans: Dict[str, List[Dict]] = {}
+        for rank, doc in enumerate(docs):
+            key = source_key(doc)
+            start = (doc.metadata or {}).get("start_index")
+            if key is None or not isinstance(start, int) or start < 0:
+                passages.append({"rank": rank, "doc": doc, "chunks": 1})
+                continue
+            passage = {"rank": rank, "doc": doc, "start": start, "end": start + len(doc.page_content), "chunks": 1}
+            open_spans.setdefault(key, []).append(passage)
+            passages.append(passage)
+
+        for spans in open_spans.values():
+            spans.sort(key=lambda p: p["start"])
+            current = spans[0]
+            for passage in spans[1:]:
+                if passage["start"] > current["end"] or not self._extend(current, passage):
+                    current = passage
+                    continue
+                passage["merged_into"] = current
+
+        merged = [p for p in passages if "merged_into" not in p]
+        merged.sort(key=lambda p: p["rank"])
+        return [p["doc"] for p in merged]
+
+    @staticmethod
+    def _extend(current: Dict, passage: Dict) -> bool:
+        """Append passage to current when their texts really agree on the overlap"""
+        text = current["doc"].page_content
+        offset = passage["start"] - current["start"]
+        tail = text[offset:]
+        shared = min(len(tail), len(passage["doc"].page_content))
+        # start_index can point at an earlier copy of repeated text; only merge what lines up
+        if tail[:shared] != passage["doc"].page_content[:shared]:
+            return False
+        if passage["end"] > current["end"]:
+            current["doc"] = Document(
+                page_content=text + passage["doc"].page_content[len(tail):],
+                metadata=dict(current["doc"].metadata)
+            )
+            current["end"] = passage["end"]
+        current["chunks"] += passage["chunks"]
+        current["rank"] = min(current["rank"], passage["rank"])
+        return True
+
+    def pack(self, docs: Sequence[Document]) -> PackedContext:
+        input_tokens = self.tokens(self.separator.join(doc.page_content for doc in docs))
+        passages = self.merge_neighbours(docs)
+        merged = len(docs) - len(passages)
+
+        picked: List[Document] = []
+        picked_shingles: List[set] = []
+        duplicates = 0
+        for doc in passages:
+            candidate = shingles(doc.page_content)
+            if any(overlap(candidate, other) >= self.duplicate_threshold for other in picked_shingles):
+                duplicates += 1
+                continue
+            picked.append(doc)
+            picked_shingles.append(candidate)
+
+        packed: List[Document] = []
+        used = 0
+        for doc in picked:
+            text = self.separator.join(d.page_content for d in packed + [doc])
+            if self.tokens(text) <= self.token_budget:
+                packed.append(doc)
+                used = self.tokens(text)
+            elif not packed:
+                limit = int(self.token_budget * self.chars_per_token)
+                text = doc.page_content[:limit]
+                cut = text.rfind(" ")
+                text = text[:cut] if cut > limit // 2 else text
+                packed.append(Document(page_content=text, metadata=dict(doc.metadata)))
+                used = self.tokens(text)
+
+        context = self.separator.join(doc.page_content for doc in packed)
+        return PackedContext(context, packed, used, input_tokens, merged, duplicates, len(picked) - len(packed))
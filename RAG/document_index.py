@@ -0,0 +1,419 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from bm25_index import BM25Index
+from embedding_model import EmbeddingSpec
+from numpy_store import NumpyVectorStore
+from vector_store import create_vector_store_backend
+import tracing
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def manifest_lock(manifest_path: str):
+    """Exclusive lock on a manifest shared between processes
+
+    The service holds it while it saves, migrate_embeddings.py while it
+    catches up for the last time and swaps, so no save falls in between.
+    """
+    with open(manifest_path + ".lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class IndexMismatchError(ValueError):
+    """The index on disk was built with different embeddings than the ones configured"""
+
+
+class DocumentIndex:
+    """Long-lived chunk index that is updated per document instead of rebuilt per query
+
+    The manifest is the commit point of the index: it names the vector store
+    collection holding the chunks and records the embedding settings that
+    produced them, so migrate_embeddings.py can build a new collection next
+    to the live one and swap it in with a single rename.
+    """
+
+    def __init__(self, embeddings: Embeddings, text_splitter, persist_directory: str = "./chroma_db",
+                 collection_name: str = "rag_documents", backend: str = None,
+                 embedding_spec: Optional[EmbeddingSpec] = None, read_only: bool = False):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.persist_directory = persist_directory
+        self.read_only = read_only
+        self.manifest_path = self.manifest_file(persist_directory, collection_name)
+        manifest = self._load_manifest()
+        self.collection = manifest.get("collection", collection_name)
+        self.embedding = self._check_embedding(manifest, embedding_spec)
+        self.vector_store = create_vector_store_backend(
+            embeddings,
+            backend,
+            persist_directory=persist_directory,
+            collection_name=self.collection,
+            read_only=read_only
+        )
+        self._lock = threading.RLock()
+        self._documents = manifest.get("documents", {})
+        self._manifest_stat = self._stat_manifest()
+        self._version = None
+        if not read_only:
+            self._reconcile()
+        # The lexical index is cheap to rebuild from stored chunk text, so it is not persisted
+        self.lexical = BM25Index()
+        if not read_only:
+            self._rebuild_lexical()
+
+    @staticmethod
+    def manifest_file(persist_directory: str, collection_name: str = "rag_documents") -> str:
+        return os.path.join(persist_directory, f"{collection_name}_manifest.json")
+
+    @classmethod
+    def store_collection(cls, persist_directory: str, collection_name: str = "rag_documents") -> str:
+        """Vector store collection the manifest currently points at"""
+        path = cls.manifest_file(persist_directory, collection_name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("collection", collection_name)
+        except (OSError, ValueError):
+            return collection_name
+
+    @staticmethod
+    def projection_file(persist_directory: str, store_collection: str) -> str:
+        return os.path.join(persist_directory, f"{store_collection}_pca.npz")
+
+    def _check_embedding(self, manifest: Dict, spec: Optional[EmbeddingSpec]) -> Optional[Dict]:
+        recorded = manifest.get("embedding")
+        if spec is None:
+            return recorded
+        if recorded is None and manifest.get("documents"):
+            # Indexes from before the settings were recorded were embedded with the generation model
+            recorded = EmbeddingSpec.legacy().describe()
+        if recorded is not None and not spec.matches(recorded):
+            raise IndexMismatchError(
+                f"Index was built with embeddings {recorded}, configured are {spec.describe()}. "
+                f"Re-embed it with: python migrate_embeddings.py --model {spec.model}"
+                + (f" --dim {spec.dim} --reduction {spec.reduction}" if spec.dim else "")
+            )
+        return spec.describe()
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _load_manifest(self) -> Dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not read index manifest, starting empty: {e}")
+            return {}
+
+    def _stat_manifest(self):
+        try:
+            stat = os.stat(self.manifest_path)
+            return stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def manifest(self) -> Dict:
+        with self._lock:
+            return {"documents": self._documents, "collection": self.collection, "embedding": self.embedding}
+
+    def _save_manifest(self):
+        if self.read_only:
+            raise RuntimeError("Index was opened read-only")
+        self._version = None
+        with manifest_lock(self.manifest_path):
+            # A manifest replaced by someone else means the index was migrated under us
+            if self._stat_manifest() != self._manifest_stat:
+                current = self._load_manifest().get("collection", self.collection)
+                if current != self.collection:
+                    raise RuntimeError(f"Index was migrated to collection {current}, restart the service to use it")
+            # In-process stores are written before the manifest that refers to them
+            if isinstance(self.vector_store, NumpyVectorStore):
+                self.vector_store.persist()
+            self.write_manifest(self.manifest_path, self.manifest())
+            self._manifest_stat = self._stat_manifest()
+
+    def save(self):
+        with self._lock:
+            self._save_manifest()
+
+    @staticmethod
+    def write_manifest(path: str, manifest: Dict):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(manifest))
+        os.replace(tmp_path, path)
+
+    def _stored_chunks(self):
+        if isinstance(self.vector_store, NumpyVectorStore):
+            store = self.vector_store
+            return list(store.ids), [store.chunk_text(row) for row in range(len(store))]
+        stored = self.vector_store.get(include=["documents"])
+        return stored["ids"], stored["documents"]
+
+    def _rebuild_lexical(self):
+        chunk_ids, texts = self._stored_chunks()
+        self.lexical.add_many(chunk_ids, texts)
+        if chunk_ids:
+            logger.info(f"🔤 Built lexical index over {len(chunk_ids)} chunks")
+
+    def _reconcile(self):
+        """Drop chunks the manifest does not know about, e.g. after a crash mid-upsert"""
+        known = {chunk_id for entry in self._documents.values() for chunk_id in entry["chunk_ids"]}
+        if isinstance(self.vector_store, NumpyVectorStore):
+            stored = set(self.vector_store.ids)
+        else:
+            stored = set(self.vector_store.get(include=[])["ids"])
+        orphans = list(stored - known)
+        if orphans:
+            self.vector_store.delete(ids=orphans)
+            logger.info(f"🧹 Removed {len(orphans)} orphaned chunks from index")
+        text_store = getattr(self.vector_store, "text_store", None)
+        if text_store is not None:
+            live = {self.text_key(doc_id, entry["hash"]) for doc_id, entry in self._documents.items()}
+            for doc_key in text_store.keys():
+                if doc_key not in live:
+                    text_store.remove(doc_key)
+
+    @staticmethod
+    def text_key(doc_id: str, content_hash: str) -> str:
+        return f"{doc_id}:{content_hash[:12]}"
+
+    def _compact_text(self, chunks: List[Document]) -> bool:
+        return (getattr(self.vector_store, "text_store", None) is not None
+                and all("start_index" in chunk.metadata for chunk in chunks))
+
+    def _remove_chunks(self, doc_id: str, entry: Dict):
+        if entry["chunk_ids"]:
+            with tracing.span("delete", "vectorstore", collection=self.collection, chunks=len(entry["chunk_ids"])):
+                self.vector_store.delete(ids=entry["chunk_ids"])
+            for chunk_id in entry["chunk_ids"]:
+                self.lexical.remove(chunk_id)
+        if getattr(self.vector_store, "text_store", None) is not None:
+            self.vector_store.remove_document_text(self.text_key(doc_id, entry["hash"]))
+
+    def _add_chunks(self, doc_key: str, content: Optional[str], metadata: Optional[Dict], chunks: List[Document],
+                    chunk_ids: List[str], vectors: Optional[List[List[float]]] = None):
+        with tracing.span("add", "vectorstore", collection=self.collection, chunks=len(chunks),
+                          embedded=vectors is not None):
+            self._store_chunks(doc_key, content, metadata, chunks, chunk_ids, vectors)
+        self.lexical.add_many(chunk_ids, [chunk.page_content for chunk in chunks])
+
+    def _store_chunks(self, doc_key: str, content: Optional[str], metadata: Optional[Dict], chunks: List[Document],
+                      chunk_ids: List[str], vectors: Optional[List[List[float]]]):
+        if content is not None and self._compact_text(chunks):
+            self.vector_store.add_document_chunks(doc_key, content, metadata or {}, chunks, chunk_ids, vectors=vectors)
+        elif vectors is None:
+            self.vector_store.add_documents(chunks, ids=chunk_ids)
+        elif isinstance(self.vector_store, NumpyVectorStore):
+            self.vector_store.add_vectors(vectors, [chunk.page_content for chunk in chunks],
+                                          [chunk.metadata for chunk in chunks], chunk_ids)
+        else:
+            # Chroma only embeds inside add_documents, already embedded chunks go to the collection directly
+            self.vector_store._collection.upsert(ids=chunk_ids, embeddings=vectors,
+                                                 documents=[chunk.page_content for chunk in chunks],
+                                                 metadatas=[chunk.metadata for chunk in chunks])
+
+    def prepare(self, doc_id: str, content: str, metadata: Dict = None) -> Dict:
+        """Hash and split a document version without touching the index
+
+        Safe to call from several threads; commit() adds the result. Documents
+        whose content is already indexed come back with unchanged=True and no chunks.
+        """
+        doc_id = str(doc_id)
+        metadata = dict(metadata or {})
+        content_hash = self.content_hash(content)
+        existing = self._documents.get(doc_id)
+        if existing and existing["hash"] == content_hash:
+            return {"id": doc_id, "hash": content_hash, "unchanged": True, "chunks": [], "chunk_ids": []}
+
+        metadata["doc_id"] = doc_id
+        with tracing.span("split", "splitter", doc_id=doc_id, chars=len(content)):
+            chunks = self.text_splitter.split_documents([Document(page_content=content, metadata=metadata)])
+        chunk_ids = [f"{self.text_key(doc_id, content_hash)}:{i}" for i in range(len(chunks))]
+        for chunk, chunk_id in zip(chunks, chunk_ids):
+            chunk.metadata["chunk_id"] = chunk_id
+        return {"id": doc_id, "hash": content_hash, "unchanged": False, "content": content,
+                "metadata": metadata, "chunks": chunks, "chunk_ids": chunk_ids}
+
+    def commit(self, prepared: Dict, vectors: Optional[List[List[float]]] = None, save: bool = True) -> Dict:
+        """Index a prepared document, embedding its chunks unless their vectors are given"""
+        doc_id = prepared["id"]
+        with self._lock:
+            existing = self._documents.get(doc_id)
+            if existing and existing["hash"] == prepared["hash"]:
+                return {"id": doc_id, "status": "unchanged", "chunks": len(existing["chunk_ids"])}
+
+            chunks, chunk_ids = prepared["chunks"], prepared["chunk_ids"]
+            if chunks:
+                self._add_chunks(self.text_key(doc_id, prepared["hash"]), prepared["content"], prepared["metadata"],
+                                 chunks, chunk_ids, vectors)
+            if existing:
+                self._remove_chunks(doc_id, existing)
+
+            self._documents[doc_id] = {
+                "hash": prepared["hash"],
+                "title": prepared["metadata"].get("title", doc_id),
+                "chunk_ids": chunk_ids,
+                "indexed_at": time.time()
+            }
+            if save:
+                self._save_manifest()
+
+        logger.info(f"📥 Indexed document {doc_id} ({len(chunks)} chunks)")
+        return {"id": doc_id, "status": "updated" if existing else "created", "chunks": len(chunks)}
+
+    def upsert(self, doc_id: str, content: str, metadata: Dict = None, save: bool = True) -> Dict:
+        """Index a document version, skipping the work when its content is unchanged"""
+        return self.commit(self.prepare(doc_id, content, metadata), save=save)
+
+    def restore_document(self, doc_id: str, entry: Dict, chunks: List[Document], content: Optional[str] = None,
+                         metadata: Optional[Dict] = None, save: bool = False) -> Dict:
+        """Index chunks that were already split, under their existing ids
+
+        Used to copy a document from another index, e.g. onto new embeddings.
+        content and metadata are the full document text and its metadata; when
+        given, a compact text store keeps chunks as ranges of it.
+        """
+        doc_id = str(doc_id)
+        chunk_ids = [chunk.metadata.get("chunk_id") or chunk.id for chunk in chunks]
+        with self._lock:
+            existing = self._documents.get(doc_id)
+            if existing:
+                self._remove_chunks(doc_id, existing)
+            if chunks:
+                self._add_chunks(self.text_key(doc_id, entry["hash"]), content, metadata, chunks, chunk_ids)
+            self._documents[doc_id] = dict(entry, chunk_ids=chunk_ids)
+            if save:
+                self._save_manifest()
+        return {"id": doc_id, "chunks": len(chunks)}
+
+    def document_source(self, doc_id: str):
+        """Full text and metadata of a document, when the store keeps them"""
+        text_store = getattr(self.vector_store, "text_store", None)
+        entry = self._documents.get(str(doc_id))
+        if text_store is None or entry is None:
+            return None, None
+        doc_key = self.text_key(doc_id, entry["hash"])
+        if doc_key not in text_store:
+            return None, None
+        return text_store.text(doc_key), text_store.metadata(doc_key)
+
+    def documents(self) -> Dict[str, Dict]:
+        """Manifest entries by document id"""
+        with self._lock:
+            return {doc_id: dict(entry) for doc_id, entry in self._documents.items()}
+
+    def delete(self, doc_id: str, save: bool = True) -> bool:
+        doc_id = str(doc_id)
+        with self._lock:
+            existing = self._documents.pop(doc_id, None)
+            if existing is None:
+                return False
+            self._remove_chunks(doc_id, existing)
+            if save:
+                self._save_manifest()
+
+        logger.info(f"🗑️ Removed document {doc_id} from index")
+        return True
+
+    def sync(self, documents: List[Document], keep: Iterable[str] = (), prune: bool = False) -> Dict:
+        """Upsert the given documents, keyed by their doc_id metadata
+
+        keep names documents already indexed that stay as they are, without
+        their content being sent again. Only with prune are the indexed
+        documents that are neither sent nor kept deleted, so the index holds
+        exactly the given ones.
+        """
+        stats = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        with self._lock:
+            wanted = {str(doc_id) for doc_id in keep if str(doc_id) in self._documents}
+            stats["unchanged"] += len(wanted)
+            for doc in documents:
+                doc_id = str(doc.metadata["doc_id"])
+                wanted.add(doc_id)
+                result = self.upsert(doc_id, doc.page_content, doc.metadata, save=False)
+                stats[result["status"]] += 1
+
+            for doc_id in list(self._documents) if prune else ():
+                if doc_id not in wanted:
+                    self.delete(doc_id, save=False)
+                    stats["deleted"] += 1
+
+            if stats["created"] or stats["updated"] or stats["deleted"]:
+                self._save_manifest()
+        return stats
+
+    @property
+    def version(self) -> str:
+        """Fingerprint of the indexed corpus, changes whenever a document is added, changed or removed"""
+        with self._lock:
+            if self._version is None:
+                digest = hashlib.sha256()
+                for doc_id in sorted(self._documents):
+                    digest.update(f"{doc_id}\0{self._documents[doc_id]['hash']}\0".encode("utf-8"))
+                self._version = digest.hexdigest()
+            return self._version
+
+    def list_documents(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {"id": doc_id, "title": entry["title"], "hash": entry["hash"], "chunks": len(entry["chunk_ids"])}
+                for doc_id, entry in self._documents.items()
+            ]
+
+    def chunk_count(self) -> int:
+        with self._lock:
+            return sum(len(entry["chunk_ids"]) for entry in self._documents.values())
+
+    def get_chunks(self, chunk_ids: List[str]) -> List[Document]:
+        """Fetch chunks by id, in the order given"""
+        if not chunk_ids:
+            return []
+        if isinstance(self.vector_store, NumpyVectorStore):
+            found = {doc.id: doc for doc in self.vector_store.get_by_ids(chunk_ids)}
+        else:
+            stored = self.vector_store.get(ids=chunk_ids, include=["documents", "metadatas"])
+            found = {
+                chunk_id: Document(id=chunk_id, page_content=text, metadata=metadata or {})
+                for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+            }
+        return [found[chunk_id] for chunk_id in chunk_ids if chunk_id in found]
+
+    def lexical_search(self, query: str, k: int = 4) -> List[Document]:
+        """BM25 ranked chunks, useful for policy numbers and product names"""
+        return self.get_chunks([chunk_id for chunk_id, _ in self.lexical.search(query, k)])
+
+    def as_retriever(self, k: int = 4):
+        return self.vector_store.as_retriever(search_type="similarity", search_kwargs={"k": k})
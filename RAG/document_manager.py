@@ -1,16 +1,21 @@
 import os
-from typing import List
+from typing import Dict, List
 from langchain_core.documents import Document
 from langchain_community.document_loaders import TextLoader, DirectoryLoader, WebBaseLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from offset_splitter import OffsetTextSplitter
+from index_snapshot import source_fingerprint
 import bs4
 
 class DocumentManager:
-    def __init__(self, documents_path: str = "documents"):
+    def __init__(self, documents_path: str = "documents", chunk_size: int = 500, chunk_overlap: int = 100):
         self.documents_path = documents_path
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,  # Optimized for better precision
-            chunk_overlap=100,  # Better context continuity
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # Where the last load_documents() corpus came from: documents, web or sample
+        self.corpus_source = None
+        self.text_splitter = OffsetTextSplitter(
+            chunk_size=chunk_size,  # Optimized for better precision
+            chunk_overlap=chunk_overlap,  # Better context continuity
             separators=["\n\n", "\n", ". ", " "],  # Better splitting points
             add_start_index=True
         )
@@ -28,6 +33,7 @@ class DocumentManager:
                 file_docs = loader.load()
                 if file_docs:
                     docs.extend(file_docs)
+                    self.corpus_source = "documents"
                     print(f"Loaded {len(file_docs)} local documents")
             except Exception as e:
                 print(f"Error loading local documents: {e}")
@@ -43,13 +49,27 @@ class DocumentManager:
                     )
                 )
                 docs = loader.load()
+                self.corpus_source = "web"
                 print(f"Loaded {len(docs)} web documents")
             except Exception as e:
                 print(f"Could not load web documents: {e}")
                 docs = self._get_fallback_documents()
+                self.corpus_source = "sample"
         
         return docs
 
+    def snapshot_key(self) -> Dict:
+        """What an index snapshot of these documents depends on besides the embedding model
+
+        Only corpora read from documents_path are snapshotted; the fingerprint
+        cannot tell when the web or sample documents change.
+        """
+        return {
+            "corpus": "documents",
+            "sources": source_fingerprint(self.documents_path),
+            "splitter": {"chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap}
+        }
+
     def split_documents(self, documents: List[Document]) -> List[Document]:
         chunks = self.text_splitter.split_documents(documents)
         print(f"Split documents into {len(chunks)} chunks")
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Persistent embedding store keyed by chunk text hash plus model name"""
+
+    def __init__(self, cache_dir: str = "./embedding_cache", max_bytes: int = 512 * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "embeddings.sqlite3")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        # Questions used to be cached here too and crowded out chunk vectors, they now stay in memory
+        if self._conn.execute("DELETE FROM embeddings WHERE model LIKE '%:query'").rowcount:
+            logger.info("🧹 Dropped cached question embeddings")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(model.encode("utf-8") + b"\0" + text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = array("f", vector).tobytes()
+            rows.append((self.make_key(model, text), model, blob, len(blob), now))
+
+        with self._lock:
+            keys = [row[0] for row in rows]
+            replaced = 0
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._total_bytes += sum(row[3] for row in rows) - replaced
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used vectors until the cache fits in max_bytes"""
+        evicted = 0
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            freed = 0
+            batch = []
+            for key, size in rows:
+                batch.append((key,))
+                freed += size
+                if self._total_bytes - freed <= self.max_bytes:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", batch)
+            self._total_bytes -= freed
+            evicted += len(batch)
+        if evicted:
+            logger.info(f"🧹 Evicted {evicted} cached embeddings")
+
+    def size_bytes(self) -> int:
+        return self._total_bytes
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model
+
+    Document chunks go to the persistent cache. Questions are mostly asked
+    once, so they only go to a small in-memory LRU of query_cache_size
+    entries instead of evicting chunk vectors (and landing on disk).
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str,
+                 query_cache_size: int = 1024):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.query_cache_size = query_cache_size
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset_request_stats(self):
+        self._local.hits = 0
+        self._local.misses = 0
+
+    def request_stats(self) -> dict:
+        """Hits and misses recorded on the calling thread since the last reset"""
+        return {
+            "hits": getattr(self._local, "hits", 0),
+            "misses": getattr(self._local, "misses", 0),
+        }
+
+    def _record(self, hits: int, misses: int):
+        self._local.hits = getattr(self._local, "hits", 0) + hits
+        self._local.misses = getattr(self._local, "misses", 0) + misses
+
+    def _embed_cached(self, namespace: str, texts: List[str], embed_fn) -> List[List[float]]:
+        vectors = self.cache.get_many(namespace, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        self._record(len(texts) - sum(vector is None for vector in vectors), len(missing))
+
+        if missing:
+            computed = dict(zip(missing, embed_fn(missing)))
+            self.cache.put_many(namespace, missing, [computed[text] for text in missing])
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(self.model_name, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query embeddings may differ from document embeddings, keep them apart
+        with self._queries_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+        self._record(int(vector is not None), int(vector is None))
+        if vector is not None:
+            return vector
+
+        vector = self.embeddings.embed_query(text)
+        if self.query_cache_size > 0:
+            with self._queries_lock:
+                self._queries[text] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return vector
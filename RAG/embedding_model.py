@@ -0,0 +1,152 @@
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_REDUCTIONS = ("truncate", "pca")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class PCAProjection:
+    """Linear projection onto the top principal components of a sample of embeddings"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dim: int) -> "PCAProjection":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < dim:
+            raise ValueError(f"PCA to {dim} dimensions needs at least {dim} sample vectors, got {len(vectors)}")
+        mean = vectors.mean(axis=0)
+        _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(mean, components[:dim])
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        return (vectors - self.mean) @ self.components.T
+
+    @property
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256(self.mean.tobytes())
+        digest.update(self.components.tobytes())
+        return digest.hexdigest()[:16]
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, mean=self.mean, components=self.components)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PCAProjection":
+        with np.load(path) as data:
+            return cls(data["mean"], data["components"])
+
+
+class ReducedEmbeddings(Embeddings):
+    """Cuts model embeddings down to dim dimensions and re-normalizes them
+
+    truncate keeps the leading dimensions, which is what Matryoshka-trained
+    models such as nomic-embed-text are built for; pca applies a projection
+    fitted on the corpus. Anything else is looked up on the wrapped
+    embeddings, so cache statistics stay reachable.
+    """
+
+    def __init__(self, embeddings: Embeddings, dim: int, reduction: str = "truncate",
+                 projection: Optional[PCAProjection] = None):
+        if reduction == "pca" and projection is None:
+            raise ValueError("PCA reduction needs a fitted projection")
+        self.embeddings = embeddings
+        self.dim = dim
+        self.reduction = reduction
+        self.projection = projection
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["embeddings"], name)
+
+    def reduce(self, vectors: List[List[float]]) -> List[List[float]]:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if not len(matrix):
+            return []
+        matrix = self.projection.apply(matrix) if self.reduction == "pca" else matrix[:, :self.dim]
+        return _normalize(matrix).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.reduce(self.embeddings.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.reduce([self.embeddings.embed_query(text)])[0]
+
+
+class EmbeddingSpec:
+    """Which model and reduction produce the vectors of an index
+
+    dim=0 keeps the model's native width. describe() is what an index records
+    in its manifest, and matches() tells whether a recorded index can be
+    queried with these settings.
+    """
+
+    def __init__(self, model: str, dim: int = 0, reduction: str = "truncate",
+                 projection: Optional[PCAProjection] = None):
+        if reduction not in EMBEDDING_REDUCTIONS:
+            raise ValueError(f"Unknown embedding reduction: {reduction}")
+        if reduction == "pca" and dim and projection is None:
+            raise ValueError("EMBEDDING_REDUCTION=pca needs a projection, build the index with migrate_embeddings.py")
+        self.model = model
+        self.dim = dim
+        self.reduction = reduction
+        self.projection = projection
+
+    @classmethod
+    def from_env(cls, projection_path: Optional[str] = None) -> "EmbeddingSpec":
+        """EMBEDDING_MODEL, EMBEDDING_DIM and EMBEDDING_REDUCTION, falling back to the generation model"""
+        reduction = os.getenv('EMBEDDING_REDUCTION', 'truncate').lower()
+        dim = int(os.getenv('EMBEDDING_DIM', '0'))
+        projection = None
+        if reduction == "pca" and dim and projection_path and os.path.exists(projection_path):
+            projection = PCAProjection.load(projection_path)
+        return cls(
+            model=os.getenv('EMBEDDING_MODEL') or os.getenv('OLLAMA_MODEL', 'deepseek-r1:8b'),
+            dim=dim,
+            reduction=reduction,
+            projection=projection
+        )
+
+    @classmethod
+    def legacy(cls) -> "EmbeddingSpec":
+        """What indexes built before embedding settings were recorded used: the generation model, full width"""
+        return cls(os.getenv('OLLAMA_MODEL', 'deepseek-r1:8b'))
+
+    def describe(self) -> Dict:
+        return {
+            "model": self.model,
+            "dim": self.dim,
+            "reduction": self.reduction if self.dim else None,
+            "projection": self.projection.fingerprint if self.dim and self.projection is not None else None
+        }
+
+    def matches(self, recorded: Dict) -> bool:
+        return self.describe() == {key: recorded.get(key) for key in ("model", "dim", "reduction", "projection")}
+
+    def __str__(self) -> str:
+        if not self.dim:
+            return self.model
+        return f"{self.model} ({self.reduction} to {self.dim} dims)"
+
+    def wrap(self, embeddings: Embeddings) -> Embeddings:
+        """Apply the reduction on top of embeddings from the model; full width vectors stay cacheable underneath"""
+        if not self.dim:
+            return embeddings
+        return ReducedEmbeddings(embeddings, self.dim, self.reduction, self.projection)
@@ -0,0 +1,109 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def log_progress(done: int, total: int):
+    logger.info(f"📦 Embedded {done}/{total} chunks")
+
+
+def print_progress(done: int, total: int):
+    print(f"\rEmbedded {done}/{total} chunks", end="\n" if done == total else "", flush=True)
+
+
+class EmbeddingPipeline(Embeddings):
+    """Embeds texts in fixed-size batches with a cap on in-flight requests and retries"""
+
+    def __init__(self, embeddings: Embeddings, batch_size: int = 32, max_in_flight: int = 4,
+                 max_retries: int = 3, retry_backoff: float = 0.5,
+                 progress_callback: Optional[ProgressCallback] = log_progress):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.progress_callback = progress_callback
+        # Shared by every caller so concurrent uploads cannot overload the server together
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, embeddings: Embeddings, **kwargs) -> "EmbeddingPipeline":
+        settings = {
+            "batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+            "max_in_flight": int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", "4")),
+            "max_retries": int(os.getenv("EMBEDDING_MAX_RETRIES", "3")),
+            "retry_backoff": float(os.getenv("EMBEDDING_RETRY_BACKOFF", "0.5")),
+        }
+        settings.update(kwargs)
+        return cls(embeddings, **settings)
+
+    @contextmanager
+    def track_progress(self, callback: ProgressCallback):
+        """Send progress of embeddings started on this thread to an extra callback"""
+        previous = getattr(self._local, "callback", None)
+        self._local.callback = callback
+        try:
+            yield
+        finally:
+            self._local.callback = previous
+
+    def _report(self, done: int, total: int):
+        for callback in (self.progress_callback, getattr(self._local, "callback", None)):
+            if callback:
+                callback(done, total)
+
+    def _with_retries(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._in_flight:
+                    return fn(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.warning(f"⚠️ Embedding request failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        total = len(texts)
+        starts = range(0, total, self.batch_size)
+        if len(starts) == 1:
+            vectors = self._with_retries(self.embeddings.embed_documents, texts)
+            self._report(total, total)
+            return vectors
+
+        results: List[Optional[List[float]]] = [None] * total
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(starts))) as pool:
+            futures = {
+                pool.submit(tracing.wrap(self._with_retries), self.embeddings.embed_documents,
+                            texts[start:start + self.batch_size]): start
+                for start in starts
+            }
+            for future in as_completed(futures):
+                start = futures[future]
+                vectors = future.result()
+                results[start:start + len(vectors)] = vectors
+                done += len(vectors)
+                self._report(done, total)
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._with_retries(self.embeddings.embed_query, text)
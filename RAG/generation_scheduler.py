@@ -0,0 +1,249 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Optional
+
+import metrics
+import tracing
+
+# Lower runs first; within a priority generations run in arrival order
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class SchedulerRejected(Exception):
+    """A generation the scheduler turned away; status and retry_after become the HTTP response
+
+    reason is queue_full (429), deadline (503) or unavailable (503, the
+    Ollama circuit breaker is open).
+    """
+
+    def __init__(self, message: str, reason: str, status: int, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+    def to_dict(self) -> Dict:
+        return {"error": str(self), "reason": self.reason, "retry_after": int(self.retry_after_header)}
+
+
+class _Waiter:
+    __slots__ = ("priority", "notify", "granted")
+
+    def __init__(self, priority: str, notify: Callable[[], None]):
+        self.priority = priority
+        self.notify = notify
+        self.granted = False
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class GenerationScheduler:
+    """Caps concurrent generations against one Ollama endpoint and queues the rest by priority
+
+    Ollama runs a few generations in parallel at best; anything beyond that
+    only makes every request slower. Callers hold a slot for the duration of
+    a generation, waiting in a bounded priority queue until one frees up.
+    A full queue is rejected straight away (429) and a caller still queued
+    when its deadline passes gives up (503), both with a Retry-After
+    estimated from recent generation times. The deadline bounds the wait for
+    a slot; a running generation is bounded by OLLAMA_TIMEOUT. Queue depth
+    and wait times are served at /rag/scheduler and /metrics.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 32, default_deadline: float = 120.0,
+                 breaker=None, endpoint: str = ""):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.default_deadline = default_deadline
+        self.breaker = breaker
+        self.endpoint = endpoint
+        self._queue: List = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._avg_generation: Optional[float] = None
+        self._avg_wait = 0.0
+        self._rejected = {"queue_full": 0, "deadline": 0, "unavailable": 0}
+        self._lock = threading.Lock()
+        for priority in PRIORITIES:
+            metrics.GENERATION_QUEUE_DEPTH.set(0, priority=priority)
+
+    @classmethod
+    def from_env(cls, endpoint: str = "", breaker=None) -> "GenerationScheduler":
+        return cls(
+            max_concurrent=int(os.getenv('GENERATION_MAX_CONCURRENCY', '2')),
+            max_queue=int(os.getenv('GENERATION_QUEUE_SIZE', '32')),
+            default_deadline=float(os.getenv('GENERATION_DEADLINE', '120')),
+            breaker=breaker,
+            endpoint=endpoint
+        )
+
+    @staticmethod
+    def priority(value: Optional[str]) -> str:
+        value = (value or "interactive").lower()
+        if value not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {value} (expected one of {', '.join(PRIORITIES)})")
+        return value
+
+    def deadline(self, timeout_ms: Optional[float] = None) -> Optional[float]:
+        """Monotonic deadline for a request arriving now, from its own timeout or GENERATION_DEADLINE"""
+        seconds = float(timeout_ms) / 1000 if timeout_ms else self.default_deadline
+        return time.monotonic() + seconds if seconds > 0 else None
+
+    def retry_after(self) -> float:
+        """Roughly how long until the current queue drains"""
+        average = self._avg_generation if self._avg_generation is not None else 5.0
+        return average * (len(self._queue) + 1) / self.max_concurrent
+
+    def _reject(self, reason: str, message: str, retry_after: Optional[float] = None) -> SchedulerRejected:
+        self._rejected[reason] += 1
+        metrics.GENERATIONS_REJECTED.inc(reason=reason)
+        status = 429 if reason == "queue_full" else 503
+        return SchedulerRejected(message, reason, status, self.retry_after() if retry_after is None else retry_after)
+
+    def check(self):
+        """Raise SchedulerRejected if a generation submitted now would be turned away at once"""
+        with self._lock:
+            self._check_admission()
+
+    def _check_admission(self):
+        if self.breaker is not None and self.breaker.state == "open":
+            raise self._reject("unavailable", "Ollama is unavailable", self.breaker.retry_after())
+        if self._running >= self.max_concurrent and len(self._queue) >= self.max_queue:
+            raise self._reject("queue_full", f"Generation queue is full ({self.max_queue} waiting)")
+
+    def _admit(self, priority: str, deadline: Optional[float], notify: Callable[[], None]) -> Optional[_Waiter]:
+        """Take a free slot (returns None) or join the queue (returns the waiter to wait on)"""
+        with self._lock:
+            self._check_admission()
+            if deadline is not None and deadline <= time.monotonic():
+                raise self._reject("deadline", "Request deadline passed before generation started")
+            if self._running < self.max_concurrent:
+                self._running += 1
+                metrics.GENERATIONS_RUNNING.inc()
+                return None
+            waiter = _Waiter(priority, notify)
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._sequence), waiter))
+            metrics.GENERATION_QUEUE_DEPTH.inc(priority=priority)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Take a waiter out of the queue; True if it was handed a slot in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+            heapq.heapify(self._queue)
+            metrics.GENERATION_QUEUE_DEPTH.dec(priority=waiter.priority)
+            return False
+
+    def _release(self, generation_seconds: Optional[float] = None):
+        with self._lock:
+            if generation_seconds is not None:
+                self._avg_generation = generation_seconds if self._avg_generation is None \
+                    else 0.8 * self._avg_generation + 0.2 * generation_seconds
+            if self._queue:
+                # The slot passes straight to the next waiter, so _running stays the same
+                _, _, waiter = heapq.heappop(self._queue)
+                metrics.GENERATION_QUEUE_DEPTH.dec(priority=waiter.priority)
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self._running -= 1
+                metrics.GENERATIONS_RUNNING.dec()
+
+    def _waited(self, priority: str, queued_at: float):
+        wait = time.monotonic() - queued_at
+        with self._lock:
+            self._avg_wait = 0.8 * self._avg_wait + 0.2 * wait
+        metrics.GENERATION_QUEUE_WAIT.observe(wait, priority=priority)
+
+    def _timed_out(self) -> SchedulerRejected:
+        with self._lock:
+            return self._reject("deadline", "Request deadline passed while waiting for a generation slot")
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", deadline: Optional[float] = None):
+        """Hold a generation slot for the body of the with block, blocking the thread while queued"""
+        queued_at = time.monotonic()
+        event = threading.Event()
+        waiter = self._admit(priority, deadline, event.set)
+        if waiter is not None:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            with tracing.span("generation_slot", "scheduler", priority=priority):
+                if not event.wait(timeout) and not self._abandon(waiter):
+                    raise self._timed_out()
+        self._waited(priority, queued_at)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self, priority: str = "interactive", deadline: Optional[float] = None):
+        """slot() for coroutines: waits on the event loop instead of blocking a thread"""
+        queued_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._admit(priority, deadline, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is not None:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                with tracing.span("generation_slot", "scheduler", priority=priority):
+                    await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise self._timed_out()
+            except asyncio.CancelledError:
+                # Handed a slot just as the caller went away: pass it on
+                if self._abandon(waiter):
+                    self._release()
+                raise
+        self._waited(priority, queued_at)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            depth = {priority: 0 for priority in PRIORITIES}
+            for _, _, waiter in self._queue:
+                depth[waiter.priority] += 1
+            return {
+                "endpoint": self.endpoint,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": depth,
+                "avg_wait_seconds": round(self._avg_wait, 3),
+                "avg_generation_seconds": round(self._avg_generation, 3) if self._avg_generation is not None else None,
+                "retry_after": round(self.retry_after(), 1),
+                "rejected": dict(self._rejected)
+            }
+
+
+_schedulers: Dict[str, GenerationScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(endpoint: str, breaker=None) -> GenerationScheduler:
+    """The process-wide scheduler of an Ollama endpoint; every client of that endpoint shares its cap"""
+    with _schedulers_lock:
+        if endpoint not in _schedulers:
+            _schedulers[endpoint] = GenerationScheduler.from_env(endpoint, breaker)
+        return _schedulers[endpoint]
@@ -0,0 +1,254 @@
+"""Single-file index snapshots that the CLI apps (app.py, main.py) load instead of re-embedding
+
+A snapshot holds everything needed to answer retrieval queries for a corpus:
+
+    magic "RAGSNAP\\0" | format version (uint32) | header length (uint32) | header JSON
+    then, each starting on a 64 byte boundary after the header:
+    vectors    float32 [rows, dim], normalized
+    chunks     int64 [rows, 4]: document, first byte, end byte in text, start_index
+    text       UTF-8 text of every document, each stored once
+    documents  JSON list of document metadata
+
+The header records the embedding settings, the source fingerprint and the
+splitter settings the snapshot was built with. A snapshot is only used when
+all of them still match. It is written to a temporary file and renamed into
+place, and opened through mmap, so opening one costs a header parse whatever
+the corpus size.
+"""
+import fnmatch
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from offset_splitter import OffsetTextSplitter
+
+SNAPSHOT_MAGIC = b"RAGSNAP\0"
+SNAPSHOT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 64
+_SECTIONS = ("vectors", "chunks", "text", "documents")
+
+
+class SnapshotError(ValueError):
+    """A snapshot that is missing, unreadable or was built with other settings; the index is rebuilt"""
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def source_fingerprint(directory: str, pattern: str = "*.txt") -> str:
+    """Hash of the names, sizes and modification times of the files a corpus is loaded from"""
+    digest = hashlib.sha256()
+    if os.path.isdir(directory):
+        entries = sorted(
+            (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+            for entry in os.scandir(directory)
+            if entry.is_file() and fnmatch.fnmatch(entry.name, pattern)
+        )
+        for name, size, mtime in entries:
+            digest.update(f"{name}\0{size}\0{mtime}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _byte_offsets(text: str, data: bytes, points: Sequence[int]) -> Dict[int, int]:
+    """UTF-8 byte offset of each character offset in points"""
+    if len(data) == len(text):
+        return {point: point for point in points}
+    offsets = {}
+    char, byte = 0, 0
+    for point in sorted(set(points)):
+        byte += len(text[char:point].encode("utf-8"))
+        char = point
+        offsets[point] = byte
+    return offsets
+
+
+def write_snapshot(path: str, documents: Sequence[Document], spans: Sequence[Sequence[Tuple[int, int]]],
+                   vectors: np.ndarray, header: Dict) -> Dict:
+    """Write a snapshot of documents, their chunk spans and one vector per chunk atomically; returns the header"""
+    texts = []
+    chunks = []
+    position = 0
+    for index, (doc, doc_spans) in enumerate(zip(documents, spans)):
+        data = doc.page_content.encode("utf-8")
+        offsets = _byte_offsets(doc.page_content, data, [point for span in doc_spans for point in span])
+        chunks.extend((index, position + offsets[start], position + offsets[end], start) for start, end in doc_spans)
+        texts.append(data)
+        position += len(data)
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if not chunks:
+        vectors = vectors.reshape(0, 0)
+    sections = {
+        "vectors": vectors.tobytes(),
+        "chunks": np.asarray(chunks, dtype=np.int64).reshape(len(chunks), 4).tobytes(),
+        "text": b"".join(texts),
+        "documents": json.dumps([doc.metadata for doc in documents]).encode("utf-8")
+    }
+    layout, offset = {}, 0
+    for name in _SECTIONS:
+        layout[name] = [offset, len(sections[name])]
+        offset = _aligned(offset + len(sections[name]))
+    header = {
+        **header,
+        "created_at": time.time(),
+        "rows": vectors.shape[0],
+        "dim": vectors.shape[1],
+        "documents": len(documents),
+        "sections": layout
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            for name in _SECTIONS:
+                f.seek(data_start + layout[name][0])
+                f.write(sections[name])
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers see either the old snapshot or the complete new one, never a partial file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return header
+
+
+class SnapshotVectorStore(VectorStore):
+    """Read-only vector store over a memory-mapped snapshot file
+
+    Rows are searched straight from the mapped matrix and chunk text is
+    decoded only for the hits, so opening a snapshot does not read the corpus.
+    Scores are cosine similarities.
+    """
+
+    def __init__(self, path: str, embedding: Embeddings):
+        self.path = path
+        self._embedding = embedding
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"No index snapshot at {path}: {e}")
+        try:
+            magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise SnapshotError(f"{path} is not an index snapshot")
+            if version != SNAPSHOT_VERSION:
+                raise SnapshotError(f"Index snapshot format {version} is not supported (expected {SNAPSHOT_VERSION})")
+            self.header = json.loads(bytes(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+            data_start = _aligned(_PREAMBLE.size + header_length)
+            self._sections = {name: (data_start + start, length)
+                              for name, (start, length) in self.header["sections"].items()}
+            rows, dim = self.header["rows"], self.header["dim"]
+            self.vectors = np.frombuffer(self._map, dtype=np.float32, count=rows * dim,
+                                         offset=self._sections["vectors"][0]).reshape(rows, dim)
+            self.chunks = np.frombuffer(self._map, dtype=np.int64, count=rows * 4,
+                                        offset=self._sections["chunks"][0]).reshape(rows, 4)
+            self._metadatas: Optional[List[Dict]] = None
+        except (struct.error, KeyError, ValueError) as e:
+            self.close()
+            if isinstance(e, SnapshotError):
+                raise
+            raise SnapshotError(f"Index snapshot {path} is damaged: {e}")
+
+    @classmethod
+    def open(cls, path: str, embedding: Embeddings, expected: Dict) -> "SnapshotVectorStore":
+        """Open a snapshot whose header matches every key of expected, raising SnapshotError otherwise"""
+        store = cls(path, embedding)
+        for key, value in expected.items():
+            if store.header.get(key) != value:
+                store.close()
+                raise SnapshotError(f"Index snapshot {key} changed")
+        return store
+
+    @classmethod
+    def build(cls, path: str, documents: Sequence[Document], text_splitter: OffsetTextSplitter,
+              embedding: Embeddings, header: Dict) -> "SnapshotVectorStore":
+        """Split and embed documents, write them as a snapshot and open it
+
+        Chunks carry their true character offset as start_index.
+        """
+        spans = text_splitter.split_many_offsets([doc.page_content for doc in documents])
+        texts = [doc.page_content[start:end] for doc, doc_spans in zip(documents, spans) for start, end in doc_spans]
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32) if texts else np.zeros((0, 0))
+        if len(vectors):
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+        write_snapshot(path, documents, spans, vectors, header)
+        return cls(path, embedding)
+
+    def close(self):
+        self.vectors = self.chunks = None
+        self._map.close()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return self.header["rows"]
+
+    def _document(self, row: int) -> Document:
+        if self._metadatas is None:
+            start, length = self._sections["documents"]
+            self._metadatas = json.loads(bytes(self._map[start:start + length]))
+        doc, first, end, start_index = (int(value) for value in self.chunks[row])
+        text_start = self._sections["text"][0]
+        content = bytes(self._map[text_start + first:text_start + end]).decode("utf-8")
+        return Document(page_content=content, metadata=dict(self._metadatas[doc], start_index=start_index))
+
+    def search_vector(self, embedding: Sequence[float], k: int = 4) -> List[Tuple[int, float]]:
+        """Top-k rows and cosine scores for an already computed query embedding"""
+        rows = len(self)
+        if rows == 0 or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.vectors @ query
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k] if k < rows else np.arange(rows)
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(self._document(row), score) for row, score in self.search_vector(embedding, k)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities in [-1, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def add_texts(self, texts, metadatas=None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("Index snapshots are read-only, build a new one with SnapshotVectorStore.build")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "SnapshotVectorStore":
+        raise NotImplementedError("Build snapshots from documents with SnapshotVectorStore.build")
@@ -0,0 +1,328 @@
+"""Bulk-load a directory of text files into the service index
+
+Files stream through read -> split -> embed -> index, each stage on its own
+thread(s) with bounded queues in between, so memory stays flat however many
+files there are. Chunks of many small files are embedded together in full
+batches. Progress is checkpointed, and an interrupted import picks up where
+it stopped when run again. Run from the RAG directory with the service
+stopped (it keeps its own copy of the index in memory):
+
+    python ingest.py documents --collection manuals --glob "*.txt" --recursive
+
+Each file is indexed under its path relative to the directory, so running
+it again only re-embeds files whose content changed. The collection has to
+be named: the default one (rag_documents) is the one the Go backend queries
+with its own documents. Queries only add to a collection, but one sent with
+"prune": true drops every document it does not name, ingested files included.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from document_index import DocumentIndex
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embedding_model import EmbeddingSpec
+from embedding_pipeline import EmbeddingPipeline
+from offset_splitter import OffsetTextSplitter
+from ollama_client import shared_clients
+from sharded_index import DEFAULT_COLLECTION, CollectionRegistry, ShardedIndex
+
+_DONE = object()
+
+
+class Checkpoint:
+    """Append-only record of the files already indexed, with the size and mtime they had
+
+    Lines are only written after the index manifest that contains those files
+    was saved, so the checkpoint never claims more than the index holds.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Tuple[int, int]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    self.files[entry["path"]] = (entry["size"], entry["mtime_ns"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done(self, rel_path: str, stat: os.stat_result) -> bool:
+        return self.files.get(rel_path) == (stat.st_size, stat.st_mtime_ns)
+
+    def record(self, entries: List[Tuple[str, os.stat_result]]):
+        for rel_path, stat in entries:
+            self.files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+            self._file.write(json.dumps({"path": rel_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def find_files(root: str, pattern: str, recursive: bool) -> Iterator[str]:
+    """Paths relative to root, in a stable order so resumed runs see files the same way"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if not recursive:
+            dirnames.clear()
+        for name in sorted(filenames):
+            if fnmatch.fnmatch(name, pattern):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def in_background(items: Iterable, depth: int) -> Iterator:
+    """Run a generator on its own thread, at most depth items ahead of the consumer"""
+    buffer: queue.Queue = queue.Queue(maxsize=max(1, depth))
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+            return
+        buffer.put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def ordered_map(fn, items: Iterable, workers: int) -> Iterator:
+    """fn over items on a thread pool, in input order, with at most 2 * workers results pending"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: queue.Queue = queue.Queue()
+        for item in items:
+            pending.put(pool.submit(fn, item))
+            if pending.qsize() >= 2 * workers:
+                yield pending.get().result()
+        while not pending.empty():
+            yield pending.get().result()
+
+
+class BulkIngester:
+    def __init__(self, index: ShardedIndex, root: str, checkpoint: Checkpoint, readers: int = 4,
+                 batch_chunks: int = 256, checkpoint_interval: float = 30.0):
+        self.index = index
+        self.root = root
+        self.checkpoint = checkpoint
+        self.readers = max(1, readers)
+        self.batch_chunks = max(1, batch_chunks)
+        self.checkpoint_interval = checkpoint_interval
+        self.stats = {"files": 0, "created": 0, "updated": 0, "unchanged": 0, "skipped": 0, "failed": 0,
+                      "chunks": 0, "bytes": 0}
+        self.stage_seconds = {"read": 0.0, "split": 0.0, "embed": 0.0, "index": 0.0}
+        self._stats_lock = threading.Lock()
+        self.failures: List[Tuple[str, str]] = []
+
+    def _pending_files(self, files: Iterable[str]) -> Iterator[Tuple[str, os.stat_result]]:
+        for rel_path in files:
+            stat = os.stat(os.path.join(self.root, rel_path))
+            if self.checkpoint.done(rel_path, stat):
+                self.stats["skipped"] += 1
+                continue
+            yield rel_path, stat
+
+    def _time(self, stage: str, started: float):
+        with self._stats_lock:
+            self.stage_seconds[stage] += time.perf_counter() - started
+
+    def _prepare(self, item: Tuple[str, os.stat_result]) -> Dict:
+        """Read and split one file (runs on the reader pool)"""
+        rel_path, stat = item
+        started = time.perf_counter()
+        try:
+            with open(os.path.join(self.root, rel_path), "r", encoding="utf-8") as f:
+                content = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            return {"path": rel_path, "stat": stat, "error": str(e)}
+        self._time("read", started)
+
+        started = time.perf_counter()
+        prepared = self.index.prepare(rel_path, content, {
+            "title": os.path.basename(rel_path),
+            "source": rel_path,
+            "file_type": os.path.splitext(rel_path)[1].lstrip(".") or "unknown",
+            "content_length": len(content)
+        })
+        self._time("split", started)
+        return dict(prepared, path=rel_path, stat=stat, size=len(content.encode("utf-8")))
+
+    def _batches(self, prepared: Iterable[Dict]) -> Iterator[List[Dict]]:
+        """Group files until they hold batch_chunks chunks, so small files share embedding requests"""
+        batch, chunks = [], 0
+        for document in prepared:
+            batch.append(document)
+            chunks += len(document.get("chunks", []))
+            if chunks >= self.batch_chunks:
+                yield batch
+                batch, chunks = [], 0
+        if batch:
+            yield batch
+
+    def _embed(self, batch: List[Dict]) -> Tuple[List[Dict], List[List[float]]]:
+        texts = [chunk.page_content for document in batch for chunk in document.get("chunks", [])]
+        started = time.perf_counter()
+        vectors = self.index.embeddings.embed_documents(texts) if texts else []
+        self._time("embed", started)
+        return batch, vectors
+
+    def run(self, files: Iterable[str]) -> Dict:
+        prepared = ordered_map(self._prepare, self._pending_files(files), self.readers)
+        batches = in_background(self._batches(prepared), depth=2)
+        embedded = in_background((self._embed(batch) for batch in batches), depth=2)
+
+        uncommitted: List[Tuple[str, os.stat_result]] = []
+        started = last_report = last_save = time.perf_counter()
+        for batch, vectors in embedded:
+            index_started = time.perf_counter()
+            offset = 0
+            for document in batch:
+                if "error" in document:
+                    self.stats["failed"] += 1
+                    self.failures.append((document["path"], document["error"]))
+                    continue
+                count = len(document["chunks"])
+                result = self.index.commit(document, vectors[offset:offset + count], save=False)
+                offset += count
+                self.stats[result["status"]] += 1
+                self.stats["files"] += 1
+                self.stats["chunks"] += count
+                self.stats["bytes"] += document["size"]
+                uncommitted.append((document["path"], document["stat"]))
+            # Saving rewrites the manifest, so it happens on a timer rather than every N files
+            if time.perf_counter() - last_save >= self.checkpoint_interval:
+                self._save(uncommitted)
+                uncommitted = []
+                last_save = time.perf_counter()
+            self._time("index", index_started)
+
+            if time.perf_counter() - last_report >= 1.0:
+                last_report = time.perf_counter()
+                elapsed = last_report - started
+                print(f"\rIndexed {self.stats['files']} files, {self.stats['chunks']} chunks "
+                      f"({self.stats['files'] / elapsed:.1f} files/s)", end="", flush=True)
+
+        index_started = time.perf_counter()
+        self._save(uncommitted)
+        self._time("index", index_started)
+        self.stats["seconds"] = time.perf_counter() - started
+        return self.stats
+
+    def _save(self, entries: List[Tuple[str, os.stat_result]]):
+        # Manifest first: a crash in between only means those files are looked at again
+        self.index.save()
+        self.checkpoint.record(entries)
+
+
+def print_summary(stats: Dict, stage_seconds: Dict, failures: List[Tuple[str, str]]):
+    seconds = max(stats["seconds"], 1e-9)
+    print(f"\n\nIngested {stats['files']} files in {seconds:.1f}s: "
+          f"{stats['created']} new, {stats['updated']} updated, {stats['unchanged']} unchanged, "
+          f"{stats['skipped']} skipped (checkpoint), {stats['failed']} failed")
+    print(f"  {stats['files'] / seconds:.1f} files/s, {stats['chunks'] / seconds:.1f} chunks/s, "
+          f"{stats['bytes'] / seconds / 1024 / 1024:.2f} MB/s")
+    # Read and split run on several threads, so their totals can exceed the wall-clock time
+    print("  Stage time: " + ", ".join(f"{stage} {value:.1f}s" for stage, value in stage_seconds.items()))
+    for path, error in failures[:20]:
+        print(f"  Failed: {path}: {error}")
+    if len(failures) > 20:
+        print(f"  ... and {len(failures) - 20} more failures")
+
+
+def main(argv: Optional[List[str]] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Stream a directory of text files into the document index")
+    parser.add_argument("directory")
+    parser.add_argument("--glob", default="*.txt", help="file name pattern (default *.txt)")
+    parser.add_argument("--recursive", action="store_true", help="descend into subdirectories")
+    parser.add_argument("--persist-directory", default=os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db"))
+    parser.add_argument("--collection", required=True,
+                        help=f"collection to import into; {DEFAULT_COLLECTION} is the Go backend's own")
+    parser.add_argument("--shards", type=int, help="shard count of a new collection (default COLLECTION_SHARDS)")
+    parser.add_argument("--backend", default=os.getenv("VECTOR_STORE_TYPE", "chroma").lower())
+    parser.add_argument("--readers", type=int, default=4, help="threads reading and splitting files")
+    parser.add_argument("--batch-chunks", type=int, default=256, help="chunks sent to the embedding stage at once")
+    parser.add_argument("--checkpoint-interval", type=float, default=30.0,
+                        help="seconds between index saves, at most this much work is redone after a crash")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: next to the index, one per directory and collection)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and look at every file")
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(args.directory)
+    if not os.path.isdir(root):
+        parser.error(f"{args.directory} is not a directory")
+    checkpoint_key = root if args.collection == DEFAULT_COLLECTION else f"{args.collection}:{root}"
+    checkpoint_path = args.checkpoint or os.path.join(
+        args.persist_directory, f"ingest_{DocumentIndex.content_hash(checkpoint_key)[:12]}.jsonl"
+    )
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    clients = shared_clients()
+    persist_directory = args.persist_directory
+    # Queries of every collection are embedded with the settings of the default one, as in the service
+    spec = EmbeddingSpec.from_env(DocumentIndex.projection_file(
+        persist_directory, DocumentIndex.store_collection(persist_directory)
+    ))
+    cache = EmbeddingCache(
+        cache_dir=os.getenv('EMBEDDING_CACHE_DIR', './embedding_cache'),
+        max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_MB', '512')) * 1024 * 1024
+    )
+    embeddings = spec.wrap(CachedEmbeddings(
+        EmbeddingPipeline.from_env(clients.embeddings(spec.model), progress_callback=None),
+        cache,
+        spec.model
+    ))
+    text_splitter = OffsetTextSplitter(
+        chunk_size=int(os.getenv('CHUNK_SIZE', '500')),
+        chunk_overlap=int(os.getenv('CHUNK_OVERLAP', '100')),
+        separators=["\n\n", "\n", ". ", " "],
+        add_start_index=True,
+        compat=os.getenv('SPLITTER_COMPAT', 'True').lower() == 'true'
+    )
+    collections = CollectionRegistry(persist_directory, embeddings, text_splitter, embedding_spec=spec,
+                                     backend=args.backend,
+                                     default_shards=int(os.getenv('COLLECTION_SHARDS', '1')),
+                                     search_workers=1)
+    try:
+        index = collections.get(args.collection, create=True, shards=args.shards)
+    except ValueError as e:
+        parser.error(str(e))
+
+    checkpoint = Checkpoint(checkpoint_path)
+    print(f"Ingesting {args.glob} from {root} into {index.name} ({len(index.shards)} shards) with {spec}"
+          + (f", {len(checkpoint.files)} files already checkpointed" if checkpoint.files else ""))
+    ingester = BulkIngester(index, root, checkpoint, readers=args.readers, batch_chunks=args.batch_chunks,
+                            checkpoint_interval=args.checkpoint_interval)
+    try:
+        stats = ingester.run(find_files(root, args.glob, args.recursive))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted, run again to resume from {checkpoint_path}")
+        raise SystemExit(130)
+    finally:
+        checkpoint.close()
+    print_summary(stats, ingester.stage_seconds, ingester.failures)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""LangChain callback handlers and wrappers feeding metrics and tracing
+
+Kept apart from metrics.py and tracing.py so those load without LangChain
+and async_service can bind its port before LangChain is imported.
+"""
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import LLMResult
+
+import metrics
+import tracing
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Records embedding latency and the number of texts that reach the model"""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        with metrics.STAGE_SECONDS.time(stage="embedding"):
+            vectors = self.embeddings.embed_documents(texts)
+        metrics.CHUNKS_EMBEDDED.inc(len(texts))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        with metrics.STAGE_SECONDS.time(stage="embedding"):
+            vector = self.embeddings.embed_query(text)
+        metrics.CHUNKS_EMBEDDED.inc()
+        return vector
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Counts prompt and completion tokens from the final Ollama response of each generation"""
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any):
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                metrics.PROMPT_TOKENS.inc(info.get("prompt_eval_count") or 0)
+                metrics.COMPLETION_TOKENS.inc(info.get("eval_count") or 0)
+
+
+class LangChainTracer(BaseCallbackHandler):
+    """Turns LangChain chain and LLM runs into spans"""
+
+    run_inline = True
+
+    def __init__(self, trace: "tracing.Trace"):
+        self.trace = trace
+        self._runs: Dict = {}
+
+    def _start(self, run_id, serialized: Optional[Dict], cat: str, kwargs: Dict):
+        name = kwargs.get("name") or (serialized or {}).get("name") or cat
+        self._runs[run_id] = tracing.Span(self.trace, name, f"langchain.{cat}", {})
+
+    def _end(self, run_id, **args):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            run.end(**args)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        self._start(run_id, serialized, "chain", kwargs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, serialized, "llm", kwargs)
+        self._runs[run_id].args["prompt_chars"] = sum(len(prompt) for prompt in prompts)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error))
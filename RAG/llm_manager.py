@@ -1,37 +1,43 @@
-from langchain_community.llms import Ollama
-from langchain_community.embeddings import OllamaEmbeddings
+from embedding_model import EmbeddingSpec
+from ollama_client import OllamaClients, shared_clients
 
 class LLMManager:
     def __init__(self, model_name: str = "deepseek-r1:8b", base_url: str = "http://127.0.0.1:11434"):
         self.model_name = model_name
         self.base_url = base_url
+        self.clients = self._clients()
         self.llm = None
         self.embeddings = None
+        self.embedding_spec = EmbeddingSpec.from_env()
+
+    def _clients(self) -> OllamaClients:
+        shared = shared_clients()
+        if shared.base_url == self.base_url.rstrip("/"):
+            return shared
+        return OllamaClients(base_url=self.base_url, model=self.model_name, keep_alive=shared.keep_alive)
 
     def get_llm(self):
         if not self.llm:
-            self.llm = Ollama(
-                model=self.model_name,
-                base_url=self.base_url
-            )
+            self.llm = self.clients.llm(self.model_name)
             print(f"Initialized LLM: {self.model_name}")
         return self.llm
 
     def get_embeddings(self):
         if not self.embeddings:
-            self.embeddings = OllamaEmbeddings(
-                model=self.model_name,
-                base_url=self.base_url
-            )
-            print(f"Initialized embeddings: {self.model_name}")
+            spec = self.embedding_spec
+            self.embeddings = spec.wrap(self.clients.embeddings(spec.model))
+            print(f"Initialized embeddings: {spec}")
         return self.embeddings
 
+    def warm_up(self, background: bool = True):
+        return self.clients.warm_up([self.model_name], background=background)
+
     def test_connection(self):
-        try:
-            llm = self.get_llm()
-            response = llm.invoke("Hello")
+        status = self.clients.health(force=True)
+        if status["ollama_connected"]:
             print("LLM connection successful")
+            if self.model_name not in status["models"] and f"{self.model_name}:latest" not in status["models"]:
+                print(f"Model {self.model_name} is not pulled yet: ollama pull {self.model_name}")
             return True
-        except Exception as e:
-            print(f"LLM connection failed: {e}")
-            return False
+        print(f"LLM connection failed: {status.get('error')}")
+        return False
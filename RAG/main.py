@@ -1,32 +1,27 @@
 import os
 import bs4
-from typing import List
+from typing import List, Tuple
 from typing_extensions import TypedDict
 
-from langchain import hub
-from langchain_community.llms import Ollama
 from langchain_community.document_loaders import WebBaseLoader, TextLoader, DirectoryLoader
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langgraph.graph import START, StateGraph
+from embedding_pipeline import EmbeddingPipeline, print_progress
+from offset_splitter import OffsetTextSplitter
+from context_packer import ContextPacker
+from ollama_client import shared_clients
+from embedding_model import EmbeddingSpec
+from index_snapshot import SnapshotError, SnapshotVectorStore, source_fingerprint
 
 class State(TypedDict):
     question: str
     context: List[Document]
     answer: str
 
-def setup_rag_pipeline():
-    print("Setting up RAG pipeline...")
-    
-    llm = Ollama(model="deepseek-r1:8b", base_url="http://127.0.0.1:11434")
-    embeddings = OllamaEmbeddings(model="deepseek-r1:8b", base_url="http://127.0.0.1:11434")
-    
+def load_documents(documents_folder: str) -> Tuple[List[Document], str]:
+    """The corpus and where it came from: documents (the folder's .txt files), web or sample"""
     print("Loading documents...")
     docs = []
     
-    documents_folder = "documents"
     if os.path.exists(documents_folder) and os.listdir(documents_folder):
         try:
             txt_loader = DirectoryLoader(documents_folder, glob="*.txt", loader_cls=TextLoader)
@@ -34,6 +29,7 @@ def setup_rag_pipeline():
             if file_docs:
                 docs.extend(file_docs)
                 print(f"Loaded {len(file_docs)} text files")
+                return docs, "documents"
         except Exception as e:
             print(f"Error loading local documents: {e}")
     
@@ -45,41 +41,85 @@ def setup_rag_pipeline():
             )
             docs = loader.load()
             print(f"Loaded {len(docs)} web documents")
+            if docs:
+                return docs, "web"
         except Exception as e:
             print(f"Could not load web documents: {e}")
     
-    if not docs:
-        docs = [
-            Document(
-                page_content="Retrieval-Augmented Generation (RAG) combines retrieval and generation. It retrieves relevant documents from a knowledge base and uses them to generate better responses. RAG applications have two main components: indexing and retrieval-generation.",
-                metadata={"source": "rag_info"}
-            ),
-            Document(
-                page_content="LangChain is a framework for developing applications powered by language models. It provides tools for document loading, text splitting, embeddings, vector stores, and chains. LangGraph orchestrates complex RAG workflows.",
-                metadata={"source": "langchain_info"}
-            ),
-            Document(
-                page_content="DeepSeek R1 is a powerful language model that can be run locally using Ollama. It provides excellent performance for text generation, question answering, and reasoning tasks. The model supports context windows and can be fine-tuned for specific domains.",
-                metadata={"source": "deepseek_info"}
-            )
-        ]
-        print("Using sample documents")
+    docs = [
+        Document(
+            page_content="Retrieval-Augmented Generation (RAG) combines retrieval and generation. It retrieves relevant documents from a knowledge base and uses them to generate better responses. RAG applications have two main components: indexing and retrieval-generation.",
+            metadata={"source": "rag_info"}
+        ),
+        Document(
+            page_content="LangChain is a framework for developing applications powered by language models. It provides tools for document loading, text splitting, embeddings, vector stores, and chains. LangGraph orchestrates complex RAG workflows.",
+            metadata={"source": "langchain_info"}
+        ),
+        Document(
+            page_content="DeepSeek R1 is a powerful language model that can be run locally using Ollama. It provides excellent performance for text generation, question answering, and reasoning tasks. The model supports context windows and can be fine-tuned for specific domains.",
+            metadata={"source": "deepseek_info"}
+        )
+    ]
+    print("Using sample documents")
+    return docs, "sample"
+
+def setup_rag_pipeline():
+    print("Setting up RAG pipeline...")
     
-    print("Splitting documents into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
+    clients = shared_clients()
+    llm = clients.llm()
+    clients.warm_up()
+    embedding_spec = EmbeddingSpec.from_env()
+    embeddings = EmbeddingPipeline.from_env(
+        embedding_spec.wrap(clients.embeddings(embedding_spec.model)),
+        progress_callback=print_progress
+    )
+    
+    documents_folder = "documents"
+    text_splitter = OffsetTextSplitter(
         chunk_size=500,  # Optimized chunk size
         chunk_overlap=100,  # Better overlap
         separators=["\n\n", "\n", ". ", " "],  # Better splitting
         add_start_index=True
     )
-    all_splits = text_splitter.split_documents(docs)
-    print(f"Created {len(all_splits)} document chunks")
     
-    print("Creating vector store...")
-    vector_store = Chroma.from_documents(documents=all_splits, embedding=embeddings)
-    print(f"Indexed {len(all_splits)} documents in vector store")
+    # An unchanged corpus is loaded from the last run's snapshot instead of being re-embedded
+    snapshot_path = os.getenv('INDEX_SNAPSHOT_PATH', 'index.snapshot')
+    snapshot_key = {
+        "corpus": "documents",
+        "embedding": embedding_spec.describe(),
+        "sources": source_fingerprint(documents_folder),
+        "splitter": {"chunk_size": 500, "chunk_overlap": 100}
+    }
+    vector_store = None
+    if snapshot_path:
+        try:
+            vector_store = SnapshotVectorStore.open(snapshot_path, embeddings, snapshot_key)
+            print(f"Loaded {len(vector_store)} document chunks from {snapshot_path}")
+        except SnapshotError as e:
+            print(f"Building index: {e}")
+    
+    if vector_store is None:
+        docs, corpus_source = load_documents(documents_folder)
+        # Only the documents folder is fingerprinted, so web and sample corpora are never snapshotted
+        if snapshot_path and corpus_source == "documents":
+            print("Splitting and indexing documents...")
+            vector_store = SnapshotVectorStore.build(snapshot_path, docs, text_splitter, embeddings, snapshot_key)
+            print(f"Indexed {len(vector_store)} document chunks into {snapshot_path}")
+        else:
+            print("Splitting documents into chunks...")
+            all_splits = text_splitter.split_documents(docs)
+            print(f"Created {len(all_splits)} document chunks")
+            
+            print("Creating vector store...")
+            from langchain_community.vectorstores import Chroma
+
+            vector_store = Chroma.from_documents(documents=all_splits, embedding=embeddings)
+            print(f"Indexed {len(all_splits)} documents in vector store")
     
     try:
+        from langchain import hub
+
         prompt = hub.pull("rlm/rag-prompt")
         print("Loaded RAG prompt from hub")
     except Exception as e:
@@ -101,7 +141,7 @@ def retrieve(state: State, vector_store):
     return {"context": retrieved_docs}
 
 def generate(state: State, llm, prompt):
-    docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+    docs_content = ContextPacker().pack(state["context"]).context
     
     if hasattr(prompt, 'invoke'):
         try:
@@ -135,6 +175,9 @@ def main():
         def generate_with_llm(state: State):
             return generate(state, llm, prompt)
         
+        # langgraph is imported once the pipeline is set up, not at start-up
+        from langgraph.graph import START, StateGraph
+
         graph_builder = StateGraph(State).add_sequence([retrieve_with_store, generate_with_llm])
         graph_builder.add_edge(START, "retrieve_with_store")
         graph = graph_builder.compile()
@@ -147,7 +190,8 @@ def main():
                 break
             
             if user_input.lower() == "sources":
-                print(f"Vector store contains {vector_store._collection.count()} document chunks")
+                count = len(vector_store) if isinstance(vector_store, SnapshotVectorStore) else vector_store._collection.count()
+                print(f"Vector store contains {count} document chunks")
                 continue
                 
             if not user_input:
@@ -0,0 +1,193 @@
+import bisect
+import threading
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+# Prometheus' default buckets, stretched to cover multi-second local generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {} if labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. a queue depth"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values, optionally split by label values"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[LabelValues, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def time(self, **labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each query stage",
+    ["stage"]
+)
+STAGE_CRITICAL_SECONDS = REGISTRY.histogram(
+    "rag_stage_critical_seconds",
+    "Time a query was held up by each stage; less than the stage duration when it overlapped other work",
+    ["stage"]
+)
+QUERIES = REGISTRY.counter("rag_queries_total", "Queries received", ["mode"])
+QUERY_ERRORS = REGISTRY.counter("rag_query_errors_total", "Queries that raised an error", ["mode"])
+FALLBACK_ANSWERS = REGISTRY.counter(
+    "rag_fallback_answers_total",
+    "Canned answers returned instead of a generated one",
+    ["reason"]
+)
+CHUNKS_EMBEDDED = REGISTRY.counter("rag_chunks_embedded_total", "Texts sent to the embedding model")
+EMBEDDING_CACHE = REGISTRY.counter("rag_embedding_cache_lookups_total", "Embedding cache lookups", ["result"])
+ANSWER_CACHE = REGISTRY.counter("rag_answer_cache_lookups_total", "Semantic answer cache lookups", ["result"])
+PROMPT_TOKENS = REGISTRY.counter("rag_prompt_tokens_total", "Prompt tokens evaluated by the LLM")
+COMPLETION_TOKENS = REGISTRY.counter("rag_completion_tokens_total", "Tokens generated by the LLM")
+OLLAMA_REQUESTS = REGISTRY.counter(
+    "rag_ollama_requests_total", "HTTP requests to Ollama by outcome (ok, error, rejected by the circuit breaker)", ["outcome"]
+)
+CONTEXT_TOKENS = REGISTRY.counter(
+    "rag_context_tokens_total", "Estimated context tokens before and after packing", ["stage"]
+)
+GENERATION_QUEUE_DEPTH = REGISTRY.gauge(
+    "rag_generation_queue_depth", "Generations waiting for a slot", ["priority"]
+)
+GENERATIONS_RUNNING = REGISTRY.gauge("rag_generations_running", "Generations holding a slot")
+GENERATION_QUEUE_WAIT = REGISTRY.histogram(
+    "rag_generation_queue_wait_seconds", "Time a generation waited for a slot", ["priority"]
+)
+DOCUMENT_REFS = REGISTRY.counter(
+    "rag_document_refs_total", "Documents referenced by hash in queries, held by the index or missing", ["result"]
+)
+GENERATIONS_REJECTED = REGISTRY.counter(
+    "rag_generations_rejected_total", "Generations turned away (queue_full, deadline, unavailable)", ["reason"]
+)
@@ -0,0 +1,188 @@
+"""Re-embed the service index with a different embedding model or dimension
+
+Questions are embedded once for every collection, so all collections (and
+their shards) are migrated together. Each gets a new vector store collection
+next to the live one while the service keeps serving, catches up with
+documents changed in the meantime, and has its manifest swapped to point at
+it with one atomic rename. The last catch-up and the swaps run under the
+manifest locks, so a document the service saves meanwhile either makes it
+into the new collection or is rejected. Run from the RAG directory:
+
+    python migrate_embeddings.py --model nomic-embed-text --dim 256 --reduction truncate
+
+Restart the service with the printed EMBEDDING_* settings afterwards; until
+then it keeps answering from the previous collection and rejects writes.
+"""
+import argparse
+import os
+import random
+import shutil
+import time
+from contextlib import ExitStack
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from document_index import DocumentIndex, manifest_lock
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embedding_model import EMBEDDING_REDUCTIONS, EmbeddingSpec, PCAProjection
+from embedding_pipeline import EmbeddingPipeline
+from ollama_client import shared_clients
+from sharded_index import DEFAULT_COLLECTION, CollectionRegistry
+from vector_store import create_vector_store_backend
+
+
+def copy_documents(source: DocumentIndex, target: DocumentIndex, entries: Dict[str, Dict]) -> int:
+    chunks_copied = 0
+    for done, (doc_id, entry) in enumerate(entries.items(), 1):
+        chunks = source.get_chunks(entry["chunk_ids"])
+        content, metadata = source.document_source(doc_id)
+        target.restore_document(doc_id, entry, chunks, content=content, metadata=metadata)
+        chunks_copied += len(chunks)
+        print(f"\rMigrated {done}/{len(entries)} documents ({chunks_copied} chunks)",
+              end="\n" if done == len(entries) else "", flush=True)
+    return chunks_copied
+
+
+def fit_projection(sources: List[DocumentIndex], embeddings, dim: int, sample_size: int,
+                   seed: int) -> PCAProjection:
+    """One projection for all collections, fitted on chunks sampled from all of them"""
+    sample = [(source, chunk_id) for source in sources
+              for entry in source.documents().values() for chunk_id in entry["chunk_ids"]]
+    random.Random(seed).shuffle(sample)
+    texts = [chunk.page_content for source in sources
+             for chunk in source.get_chunks([chunk_id for owner, chunk_id in sample[:sample_size] if owner is source])]
+    print(f"Fitting PCA to {dim} dimensions on {len(texts)} chunks...")
+    return PCAProjection.fit(np.asarray(embeddings.embed_documents(texts)), dim)
+
+
+def catch_up(persist_directory: str, name: str, old_collection: str, target: DocumentIndex, backend: str) -> bool:
+    """Copy documents the service changed in the live index since the last pass; False when there were none"""
+    live = DocumentIndex(None, None, persist_directory, name, backend=backend, read_only=True)
+    if live.collection != old_collection:
+        raise SystemExit(f"Index {name} was migrated to {live.collection} by someone else, aborting")
+    wanted, have = live.documents(), target.documents()
+    changed = {doc_id: entry for doc_id, entry in wanted.items()
+               if doc_id not in have or have[doc_id]["hash"] != entry["hash"]}
+    removed = [doc_id for doc_id in have if doc_id not in wanted]
+    if not changed and not removed:
+        return False
+    print(f"Catching up {name}: {len(changed)} changed, {len(removed)} removed")
+    copy_documents(live, target, changed)
+    for doc_id in removed:
+        target.delete(doc_id, save=False)
+    return True
+
+
+def drop_collection(persist_directory: str, collection: str, backend: str):
+    if backend == "numpy":
+        shutil.rmtree(os.path.join(persist_directory, collection), ignore_errors=True)
+    else:
+        create_vector_store_backend(None, backend, persist_directory, collection).delete_collection()
+    projection = DocumentIndex.projection_file(persist_directory, collection)
+    if os.path.exists(projection):
+        os.remove(projection)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Re-embed the document index and swap it in atomically")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL"), help="embedding model (default EMBEDDING_MODEL)")
+    parser.add_argument("--dim", type=int, default=0, help="reduce vectors to this many dimensions (0 = native)")
+    parser.add_argument("--reduction", choices=EMBEDDING_REDUCTIONS, default="truncate")
+    parser.add_argument("--persist-directory", default=os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db"))
+    parser.add_argument("--backend", default=os.getenv("VECTOR_STORE_TYPE", "chroma").lower())
+    parser.add_argument("--pca-sample", type=int, default=20000, help="chunks used to fit the PCA projection")
+    parser.add_argument("--catch-up-passes", type=int, default=3,
+                        help="passes while the service keeps writing, before the last one under the manifest locks")
+    parser.add_argument("--drop-old", action="store_true",
+                        help="delete the previous collection after the swap (only once nothing serves it)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not args.model:
+        parser.error("--model or EMBEDDING_MODEL is required")
+
+    persist_directory = args.persist_directory
+    registry = CollectionRegistry(persist_directory, None, None, backend=args.backend, search_workers=1)
+    # Indexes without a manifest hold nothing yet and take the new settings when first written
+    names = [name for name in registry.index_names()
+             if os.path.exists(DocumentIndex.manifest_file(persist_directory, name))]
+    if not names:
+        raise SystemExit(f"No index to migrate in {persist_directory}")
+    sources = {name: DocumentIndex(None, None, persist_directory, name, backend=args.backend, read_only=True)
+               for name in names}
+    for name, source in sources.items():
+        print(f"Source: index {name} in collection {source.collection}, {len(source.documents())} documents, "
+              f"embeddings {source.embedding or EmbeddingSpec.legacy().describe()}")
+
+    clients = shared_clients()
+    cache = EmbeddingCache(
+        cache_dir=os.getenv('EMBEDDING_CACHE_DIR', './embedding_cache'),
+        max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_MB', '512')) * 1024 * 1024
+    )
+    model_embeddings = CachedEmbeddings(
+        EmbeddingPipeline.from_env(clients.embeddings(args.model), progress_callback=None),
+        cache,
+        args.model
+    )
+
+    stamp = int(time.time())
+    projection = None
+    if args.dim and args.reduction == "pca":
+        projection = fit_projection(list(sources.values()), model_embeddings, args.dim, args.pca_sample, args.seed)
+    spec = EmbeddingSpec(args.model, args.dim, args.reduction, projection)
+
+    # Staging manifests have their own names, the live ones are only touched by the swap
+    started = time.perf_counter()
+    targets = {}
+    for name, source in sources.items():
+        new_collection = f"{name}.{stamp}"
+        if projection is not None:
+            projection.save(DocumentIndex.projection_file(persist_directory, new_collection))
+        targets[name] = DocumentIndex(spec.wrap(model_embeddings), None, persist_directory, new_collection,
+                                      backend=args.backend, embedding_spec=spec)
+        print(f"Building collection {new_collection} with {spec}")
+        copy_documents(source, targets[name], source.documents())
+
+    # Catch up with documents the service changed while we were embedding
+    for _ in range(args.catch_up_passes):
+        changed = [catch_up(persist_directory, name, sources[name].collection, target, args.backend)
+                   for name, target in targets.items()]
+        if not any(changed):
+            break
+
+    # The swap: with the manifests locked the service's saves wait, and afterwards find the index migrated
+    with ExitStack() as locks:
+        for name in names:
+            locks.enter_context(manifest_lock(DocumentIndex.manifest_file(persist_directory, name)))
+        for name, target in targets.items():
+            catch_up(persist_directory, name, sources[name].collection, target, args.backend)
+            target.save()
+        for name, target in targets.items():
+            DocumentIndex.write_manifest(DocumentIndex.manifest_file(persist_directory, name), target.manifest())
+            os.remove(target.manifest_path)
+            os.remove(target.manifest_path + ".lock")
+    chunks = sum(target.chunk_count() for target in targets.values())
+    print(f"\nSwapped in {len(targets)} indexes ({chunks} chunks) in {time.perf_counter() - started:.1f}s")
+    if projection is not None and DEFAULT_COLLECTION not in targets:
+        # The service loads the projection of the default collection, which has not been written yet
+        projection.save(DocumentIndex.projection_file(persist_directory, DEFAULT_COLLECTION))
+
+    old_collections = [source.collection for source in sources.values()]
+    if args.drop_old:
+        for old_collection in old_collections:
+            drop_collection(persist_directory, old_collection, args.backend)
+        print(f"Dropped previous collections {', '.join(old_collections)}")
+    else:
+        print(f"Previous collections {', '.join(old_collections)} kept for the running service, "
+              f"delete them after the restart")
+
+    print("\nRestart the RAG service with:")
+    print(f"  EMBEDDING_MODEL={spec.model}")
+    print(f"  EMBEDDING_DIM={spec.dim}")
+    print(f"  EMBEDDING_REDUCTION={spec.reduction}")
+
+
+if __name__ == "__main__":
+    main()
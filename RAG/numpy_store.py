@@ -0,0 +1,764 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ann_index import IVFIndex
+from chunk_store import ChunkRef, DocumentTextStore
+from quantization import QUANTIZATION_TYPES, FullPrecisionFile, ScalarQuantizer, remove_stale, row_blocks
+
+logger = logging.getLogger(__name__)
+
+_LOG_NAME = re.compile(r"^changes\.(\d+)\.jsonl$")
+
+
+class ReadWriteLock:
+    """Shared lock for searches, exclusive and reentrant lock for changes
+
+    NumPy releases the GIL while it scores rows, so searches holding the
+    shared lock run in parallel. A waiting writer holds off new readers,
+    which keeps a steady stream of queries from starving an upsert; a thread
+    must therefore not take the read lock twice.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._condition:
+            while self._writer not in (None, me) or (self._waiting_writers and self._writer != me):
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact in-process vector store over one contiguous normalized float32 matrix
+
+    Chunk ids, texts and metadata live in lists parallel to the matrix rows.
+    Search is a single matrix-vector product followed by argpartition, so
+    scores are cosine similarities.
+
+    With persist_path set the store is kept on disk as a snapshot plus a
+    change log. persist() only appends the rows added and the ids deleted
+    since the last call to changes.<generation>.jsonl (vectors in .f32), so
+    its cost follows the change, not the store. Once the log outgrows
+    compact_ratio of the snapshot (and compact_min_rows), a background thread
+    writes the whole store as the next snapshot generation (vectors.<n>.npy,
+    chunks.<n>.json, quantization.<n>.npz) while new changes go to that
+    generation's log. Replacing current.json then switches to it in one
+    atomic step. Loading maps the snapshot's matrix (when mmap is true) and replays
+    the logs written since; a log entry cut short by a crash is dropped.
+
+    index_type="ivf" adds an approximate IVFIndex once the store holds
+    ivf_train_size rows; smaller stores keep using exact search.
+
+    compact_text=True keeps each document's text once in a memory-mapped
+    DocumentTextStore; rows added with add_document_chunks hold a ChunkRef
+    into it instead of a copy of the chunk text and its metadata.
+
+    quantization="float16" or "int8" keeps only 2 or 1 bytes per dimension in
+    the matrix. Searches rank all rows on the codes, then re-score the best
+    rescore_factor * k candidates with the float32 copy kept on disk.
+
+    read_only=True opens a persisted store without truncating or writing any
+    of its files, so another process can read it while its owner appends.
+    """
+
+    def __init__(self, embedding: Embeddings, persist_path: Optional[str] = None, mmap: bool = True,
+                 index_type: str = "flat", nlist: int = 256, nprobe: int = 8,
+                 ivf_train_size: Optional[int] = None, compact_text: bool = False,
+                 quantization: str = "none", rescore_factor: int = 4, read_only: bool = False,
+                 compact_ratio: float = 0.25, compact_min_rows: int = 10000):
+        self._embedding = embedding
+        self.persist_path = persist_path
+        self.read_only = read_only
+        self.mmap = mmap
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        # Changes not yet in the log, as ("add", ids, texts, metadatas, vectors) or ("delete", ids)
+        self._pending: List[Tuple] = []
+        self._replaying = False
+        self._snapshot_generation = 0
+        self._log_generation = 0
+        self._snapshot_rows = 0
+        self._log_rows = 0
+        self._needs_snapshot = False
+        self._centroids_dirty = False
+        self._compaction: Optional[threading.Thread] = None
+        if index_type not in ("flat", "ivf"):
+            raise ValueError(f"Unknown index type: {index_type}")
+        self.index_type = index_type
+        self.ivf = IVFIndex(nlist=nlist, nprobe=nprobe) if index_type == "ivf" else None
+        # k-means needs a few dozen points per centroid to be worth it
+        self.ivf_train_size = ivf_train_size or 39 * nlist
+        if quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.quantization = quantization
+        self.quantizer = ScalarQuantizer(quantization) if quantization != "none" else None
+        self.rescore_factor = rescore_factor
+        self._full: Optional[FullPrecisionFile] = None
+        self._slots = np.zeros(0, dtype=np.int64)
+        # Searches share it, changes and persisting take it exclusively
+        self._lock = ReadWriteLock()
+        self._matrix = np.zeros((0, 0), dtype=self.quantizer.dtype if self.quantizer else np.float32)
+        self._size = 0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict] = []
+        self._rows: Dict[str, int] = {}
+        self.text_store = None
+        if compact_text:
+            self.text_store = DocumentTextStore(
+                os.path.join(persist_path, "documents") if persist_path else tempfile.mkdtemp(prefix="rag-text-"),
+                read_only=read_only
+            )
+        if persist_path and self._persisted():
+            self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Normalized embedding rows currently in use, as stored (codes when quantized)"""
+        return self._matrix[:self._size]
+
+    def memory_bytes(self) -> int:
+        """Size of the in-memory part of the rows in use"""
+        return self.vectors.nbytes
+
+    def _float_rows(self, rows: np.ndarray) -> np.ndarray:
+        if self.quantizer is None:
+            return np.asarray(self._matrix[rows])
+        return self._full.rows(self._slots[rows])
+
+    def _full_file(self, dim: int) -> FullPrecisionFile:
+        if self._full is None:
+            self._full = FullPrecisionFile(self.persist_path or tempfile.mkdtemp(prefix="rag-vectors-"), dim)
+        return self._full
+
+    def _ensure_capacity(self, rows: int, dim: int):
+        if self._matrix.shape[1] not in (0, dim):
+            raise ValueError(f"Embedding dimension {dim} does not match index dimension {self._matrix.shape[1]}")
+        needed = self._size + rows
+        if needed <= self._matrix.shape[0] and not isinstance(self._matrix, np.memmap):
+            return
+        # Grow geometrically so appends stay amortized O(1) and the matrix stays contiguous
+        capacity = max(needed, 2 * self._matrix.shape[0], 64)
+        matrix = np.empty((capacity, dim), dtype=self._matrix.dtype)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+
+    def add_vectors(self, vectors: Sequence[Sequence[float]], texts: List[str],
+                    metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        if not texts:
+            return []
+        metadatas = metadatas or [None if isinstance(text, ChunkRef) else {} for text in texts]
+        ids = [str(i) for i in ids] if ids else [uuid.uuid4().hex for _ in texts]
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock.write():
+            replaced = [i for i in ids if i in self._rows]
+            if replaced:
+                self._delete_rows(replaced)
+            self._ensure_capacity(len(texts), matrix.shape[1])
+            start = self._size
+            if self.quantizer is None:
+                self._matrix[start:start + len(texts)] = matrix
+            else:
+                self._store_quantized(start, matrix)
+            for offset, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                self._rows[chunk_id] = start + offset
+                self.ids.append(chunk_id)
+                self.texts.append(text)
+                self.metadatas.append(dict(metadata) if metadata is not None else None)
+            self._size += len(texts)
+            self._record(("add", ids, list(texts), self.metadatas[start:self._size], matrix))
+
+            if self.ivf is not None:
+                if self.ivf.is_trained:
+                    self.ivf.add(np.arange(start, self._size), matrix)
+                elif self._size >= self.ivf_train_size:
+                    self.build_ann_index()
+        return ids
+
+    def _store_quantized(self, start: int, matrix: np.ndarray):
+        full = self._full_file(matrix.shape[1])
+        end = start + len(matrix)
+        if len(self._slots) < end:
+            slots = np.empty(max(end, 2 * len(self._slots), 64), dtype=np.int64)
+            slots[:start] = self._slots[:start]
+            self._slots = slots
+        self._slots[start:end] = full.append(matrix)
+        if self.quantizer.update_scale(matrix):
+            # Rows encoded with the previous int8 scale are re-encoded from their float32 copy
+            for block_start, block_end in row_blocks(start, matrix.shape[1]):
+                self._matrix[block_start:block_end] = self.quantizer.encode(
+                    full.rows(self._slots[block_start:block_end])
+                )
+        self._matrix[start:end] = self.quantizer.encode(matrix)
+
+    def add_document_chunks(self, doc_key: str, content: str, metadata: Dict, chunks: List[Document],
+                            ids: List[str], vectors: Optional[Sequence[Sequence[float]]] = None) -> List[str]:
+        """Store a document's text once and index its chunks as ranges of it
+
+        Chunks need the start_index metadata that splitters add with add_start_index=True.
+        They are embedded here unless their vectors are given.
+        """
+        self.text_store.put(doc_key, content, metadata)
+        refs = [
+            ChunkRef(doc_key, chunk.metadata["start_index"], chunk.metadata["start_index"] + len(chunk.page_content))
+            for chunk in chunks
+        ]
+        if vectors is None:
+            vectors = self._embedding.embed_documents([chunk.page_content for chunk in chunks])
+        return self.add_vectors(vectors, refs, ids=ids)
+
+    def remove_document_text(self, doc_key: str):
+        """Release a stored document once its chunks are deleted; takes effect on the next persist"""
+        self.text_store.remove(doc_key)
+
+    def chunk_text(self, row: int) -> str:
+        text = self.texts[row]
+        return self.text_store.chunk_text(text) if isinstance(text, ChunkRef) else text
+
+    def build_ann_index(self):
+        """(Re)train the IVF centroids on the current rows and assign every row"""
+        with self._lock.write():
+            self._centroids_dirty = True
+            if self.quantizer is None:
+                self.ivf.train(self.vectors)
+            else:
+                rng = np.random.default_rng(self.ivf.seed)
+                sample = min(self._size, self.ivf.max_training_points)
+                self.ivf.train(self._float_rows(np.sort(rng.choice(self._size, sample, replace=False))))
+            self._assign_ivf_rows()
+
+    def _assign_ivf_rows(self):
+        if self.quantizer is None:
+            self.ivf.add(np.arange(self._size), self.vectors)
+            return
+        for start, end in row_blocks(self._size, self._matrix.shape[1]):
+            rows = np.arange(start, end)
+            self.ivf.add(rows, self._float_rows(rows))
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_vectors(self._embedding.embed_documents(texts), texts, metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock.write():
+            ids = [str(chunk_id) for chunk_id in ids]
+            self._delete_rows(ids)
+            self._record(("delete", ids))
+        return True
+
+    def _delete_rows(self, ids: List[str]):
+        with self._lock.write():
+            if isinstance(self._matrix, np.memmap):
+                self._ensure_capacity(0, self._matrix.shape[1])
+            for chunk_id in ids:
+                row = self._rows.pop(str(chunk_id), None)
+                if row is None:
+                    continue
+                # Move the last row into the hole to keep the matrix dense
+                last = self._size - 1
+                if self.ivf is not None and self.ivf.is_trained:
+                    self.ivf.remove(row)
+                    if row != last:
+                        self.ivf.relabel(last, row)
+                if self.quantizer is not None:
+                    self._full.dead += 1
+                    self._slots[row] = self._slots[last]
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self.ids[row] = self.ids[last]
+                    self.texts[row] = self.texts[last]
+                    self.metadatas[row] = self.metadatas[last]
+                    self._rows[self.ids[row]] = row
+                self.ids.pop()
+                self.texts.pop()
+                self.metadatas.pop()
+                self._size -= 1
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        with self._lock.read():
+            rows = [self._rows[i] for i in ids if i in self._rows]
+            return [self._document(row) for row in rows]
+
+    def _document(self, row: int) -> Document:
+        text = self.texts[row]
+        if isinstance(text, ChunkRef):
+            metadata = dict(self.text_store.metadata(text.doc_key), start_index=text.start, chunk_id=self.ids[row])
+            return Document(id=self.ids[row], page_content=self.text_store.chunk_text(text), metadata=metadata)
+        return Document(id=self.ids[row], page_content=text, metadata=dict(self.metadatas[row]))
+
+    def search_vector(self, embedding: Sequence[float], k: int = 4, exact: bool = False,
+                      nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top-k rows and cosine scores for an already computed query embedding"""
+        with self._lock.read():
+            return self._search_vector(embedding, k, exact, nprobe)
+
+    def _search_vector(self, embedding: Sequence[float], k: int, exact: bool = False,
+                       nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        if self._size == 0 or k <= 0:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        if self.quantizer is not None:
+            return self._search_quantized(query, k, exact, nprobe)
+        if not exact and self.ivf is not None and self.ivf.is_trained:
+            rows, scores = self.ivf.search(self.vectors, query, k, nprobe)
+            return [(int(row), float(score)) for row, score in zip(rows, scores)]
+        scores = self.vectors @ query
+        k = min(k, self._size)
+        if k < self._size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(self._size)
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def _search_quantized(self, query: np.ndarray, k: int, exact: bool,
+                          nprobe: Optional[int]) -> List[Tuple[int, float]]:
+        if exact:
+            # Ground truth straight from the float32 copy, e.g. for recall measurements
+            scores = np.concatenate([
+                self._float_rows(np.arange(start, end)) @ query
+                for start, end in row_blocks(self._size, self._matrix.shape[1])
+            ])
+            rows = np.arange(self._size)
+        else:
+            if self.ivf is not None and self.ivf.is_trained:
+                rows = self.ivf.candidates(query, nprobe)
+                scores = self.quantizer.scores(self._matrix[rows], query)
+            else:
+                rows = np.arange(self._size)
+                scores = self.quantizer.scores(self.vectors, query)
+            # Coarse ranking on codes, then exact scores for a few times k candidates
+            n = min(len(rows), max(k * self.rescore_factor, k))
+            if n < len(rows):
+                keep = np.argpartition(-scores, n - 1)[:n]
+                rows = rows[keep]
+            scores = self._float_rows(rows) @ query
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        with self._lock.read():
+            return [(self._document(row), score) for row, score in self._search_vector(embedding, k)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities in [-1, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_path: Optional[str] = None,
+                   **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(embedding, persist_path=persist_path, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def _snapshot_file(self, kind: str, extension: str, generation: int) -> str:
+        # Generation 0 is the layout from before snapshots were numbered
+        name = f"{kind}.{extension}" if generation == 0 else f"{kind}.{generation}.{extension}"
+        return os.path.join(self.persist_path, name)
+
+    def _log_files(self, generation: int) -> Tuple[str, str]:
+        return (os.path.join(self.persist_path, f"changes.{generation}.jsonl"),
+                os.path.join(self.persist_path, f"changes.{generation}.f32"))
+
+    def _log_generations(self) -> List[int]:
+        if not os.path.isdir(self.persist_path):
+            return []
+        return sorted(int(match.group(1)) for match in map(_LOG_NAME.match, os.listdir(self.persist_path)) if match)
+
+    def _persisted(self) -> bool:
+        return (os.path.exists(os.path.join(self.persist_path, "current.json"))
+                or os.path.exists(self._snapshot_file("chunks", "json", 0))
+                or bool(self._log_generations()))
+
+    def _record(self, change: Tuple):
+        if self.persist_path and not self._replaying:
+            self._pending.append(change)
+
+    def persist(self):
+        """Make every change since the last persist durable by appending it to the change log"""
+        if not self.persist_path:
+            return
+        if self.read_only:
+            raise RuntimeError("Vector store was opened read-only")
+        os.makedirs(self.persist_path, exist_ok=True)
+        with self._lock.write():
+            # Documents referenced by the logged chunks must be on disk before they are
+            if self.text_store is not None:
+                self.text_store.persist()
+            if self._log_rows + self._pending_rows() > self._compaction_threshold() and not self._compacting():
+                # A bulk change is written once, as a snapshot, instead of to the log and then a snapshot
+                self._pending = []
+                self._write_snapshot(self._capture_snapshot())
+            else:
+                self._append_log()
+            if self.text_store is not None:
+                self.text_store.commit_removals()
+            if self._centroids_dirty and self.ivf is not None and self.ivf.is_trained:
+                centroids_path = os.path.join(self.persist_path, "ivf_centroids.npy")
+                with open(centroids_path + ".tmp", "wb") as f:
+                    np.save(f, self.ivf.centroids)
+                os.replace(centroids_path + ".tmp", centroids_path)
+                self._centroids_dirty = False
+            if self._compaction_due():
+                snapshot = self._capture_snapshot()
+                self._compaction = threading.Thread(target=self._write_snapshot_in_background, args=(snapshot,),
+                                                    name="vector-store-compaction", daemon=True)
+                self._compaction.start()
+
+    def compact(self):
+        """Persist, then fold the change log into a new snapshot before returning, e.g. after a bulk load"""
+        if not self.persist_path:
+            return
+        self.persist()
+        if self._compaction is not None:
+            self._compaction.join()
+        with self._lock.write():
+            self._append_log()
+            snapshot = self._capture_snapshot()
+        self._write_snapshot(snapshot)
+
+    def _append_log(self):
+        if not self._pending:
+            return
+        log_path, vectors_path = self._log_files(self._log_generation)
+        entries = []
+        with open(vectors_path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            for change in self._pending:
+                if change[0] == "delete":
+                    entries.append({"op": "delete", "ids": change[1]})
+                    continue
+                _, ids, texts, metadatas, vectors = change
+                entries.append({
+                    "op": "add",
+                    "ids": ids,
+                    "texts": [text.to_json() if isinstance(text, ChunkRef) else text for text in texts],
+                    "metadatas": metadatas,
+                    "offset": f.tell(),
+                    "dim": vectors.shape[1]
+                })
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # An entry is only replayed once its whole line, written after its vectors, is on disk
+        with open(log_path, "ab") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_rows += sum(len(entry["ids"]) for entry in entries)
+        self._pending = []
+
+    def _pending_rows(self) -> int:
+        return sum(len(change[1]) for change in self._pending)
+
+    def _compaction_threshold(self) -> float:
+        return max(self.compact_min_rows, self.compact_ratio * self._snapshot_rows)
+
+    def _compacting(self) -> bool:
+        return self._compaction is not None and self._compaction.is_alive()
+
+    def _compaction_due(self) -> bool:
+        if self._compacting():
+            return False
+        if self._full is not None and self._full.dead > len(self._full) // 2:
+            return True
+        return self._needs_snapshot or self._log_rows > self._compaction_threshold()
+
+    def _capture_snapshot(self) -> Dict:
+        """Copy of the store for a new snapshot; changes from here on go to the next generation's log"""
+        if self._full is not None and self._full.dead > len(self._full) // 2:
+            self._slots[:self._size] = self._full.compact(self._slots[:self._size])
+        generation = self._log_generation + 1
+        snapshot = {
+            "generation": generation,
+            "vectors": np.array(self.vectors),
+            "ids": list(self.ids),
+            "texts": list(self.texts),
+            "metadatas": list(self.metadatas),
+            "quantization": None,
+            "full_path": None
+        }
+        if self._full is not None:
+            snapshot["quantization"] = {
+                "kind": np.array(self.quantization),
+                "scale": self.quantizer.scale.copy() if self.quantizer.scale is not None else np.zeros(0),
+                "slots": self._slots[:self._size].copy(),
+                "generation": np.array(self._full.generation)
+            }
+            snapshot["full_path"] = self._full.path
+        self._log_generation = generation
+        self._log_rows = 0
+        self._needs_snapshot = False
+        return snapshot
+
+    def _write_snapshot_in_background(self, snapshot: Dict):
+        try:
+            self._write_snapshot(snapshot)
+        except OSError as e:
+            # The old snapshot and every log since it are untouched, the next persist tries again
+            logger.error(f"❌ Writing vector store snapshot {snapshot['generation']} to {self.persist_path} "
+                         f"failed: {e}")
+
+    def _write_snapshot(self, snapshot: Dict):
+        generation = snapshot["generation"]
+        if snapshot["quantization"] is not None:
+            with open(self._snapshot_file("quantization", "npz", generation), "wb") as f:
+                np.savez(f, **snapshot["quantization"])
+                f.flush()
+                os.fsync(f.fileno())
+        with open(self._snapshot_file("vectors", "npy", generation), "wb") as f:
+            np.save(f, snapshot["vectors"])
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._snapshot_file("chunks", "json", generation), "w", encoding="utf-8") as f:
+            texts = [text.to_json() if isinstance(text, ChunkRef) else text for text in snapshot["texts"]]
+            # dumps runs the C encoder, dump(f) streams through the much slower pure Python one
+            f.write(json.dumps({"ids": snapshot["ids"], "texts": texts, "metadatas": snapshot["metadatas"]}))
+            f.flush()
+            os.fsync(f.fileno())
+        pointer_path = os.path.join(self.persist_path, "current.json")
+        with open(pointer_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"generation": generation, "rows": len(snapshot["ids"])}))
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock.write():
+            # The one step that switches from the old snapshot and its logs to the new one
+            os.replace(pointer_path + ".tmp", pointer_path)
+            self._snapshot_generation = generation
+            self._snapshot_rows = len(snapshot["ids"])
+            # The previous generation stays for readers that opened it just before the switch
+            self._remove_generations(before=generation - 1)
+            # Older float32 copies are only dropped once nothing persisted points at them
+            remove_stale(self.persist_path, snapshot["full_path"])
+
+    def _remove_generations(self, before: int):
+        for generation in range(0, before):
+            paths = [self._snapshot_file("vectors", "npy", generation),
+                     self._snapshot_file("chunks", "json", generation),
+                     self._snapshot_file("quantization", "npz", generation), *self._log_files(generation)]
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _load(self):
+        pointer_path = os.path.join(self.persist_path, "current.json")
+        generation = 0
+        if os.path.exists(pointer_path):
+            with open(pointer_path, "r", encoding="utf-8") as f:
+                generation = json.load(f)["generation"]
+        chunks_path = self._snapshot_file("chunks", "json", generation)
+        if generation and not os.path.exists(chunks_path):
+            raise ValueError(
+                f"Vector store at {self.persist_path} is missing snapshot {generation}; restore it or re-index"
+            )
+        if os.path.exists(chunks_path):
+            with open(chunks_path, "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            # A memory-mapped matrix is copied into RAM on the first write
+            self._matrix = np.load(self._snapshot_file("vectors", "npy", generation),
+                                   mmap_mode="r" if self.mmap and chunks["ids"] else None)
+            if self._matrix.shape[0] != len(chunks["ids"]):
+                raise ValueError(
+                    f"Vector store at {self.persist_path} is inconsistent: snapshot {generation} has "
+                    f"{self._matrix.shape[0]} vectors for {len(chunks['ids'])} chunks; restore it or re-index"
+                )
+            self._load_quantization(len(chunks["ids"]), generation)
+            self.ids = chunks["ids"]
+            keys = {}
+            self.texts = [
+                ChunkRef(keys.setdefault(text[0], text[0]), text[1], text[2]) if isinstance(text, list) else text
+                for text in chunks["texts"]
+            ]
+            self.metadatas = chunks["metadatas"]
+            self._size = len(self.ids)
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._snapshot_generation = self._log_generation = generation
+        self._snapshot_rows = self._size
+
+        logs = [log for log in self._log_generations() if log >= generation]
+        if logs and self.read_only and self.quantizer is not None:
+            # Replayed rows would be appended to the float32 copy, so a reader searches decoded vectors instead
+            self._matrix = self._float_rows(np.arange(self._size)) if self._size else np.zeros((0, 0), np.float32)
+            self.quantizer = None
+        # Rows are assigned to IVF lists once, after the logs are replayed
+        ivf, self.ivf = self.ivf, None
+        self._replaying = True
+        try:
+            for log in logs:
+                self._log_rows += self._replay_log(log, truncate=not self.read_only and log == logs[-1])
+                self._log_generation = log
+        finally:
+            self._replaying = False
+            self.ivf = ivf
+        if self.text_store is None and any(isinstance(text, ChunkRef) for text in self.texts):
+            self.text_store = DocumentTextStore(os.path.join(self.persist_path, "documents"))
+
+        centroids_path = os.path.join(self.persist_path, "ivf_centroids.npy")
+        if self.ivf is not None and self._size:
+            if os.path.exists(centroids_path):
+                # Reassigning rows is one matrix product, cheaper than retraining
+                self.ivf.load_centroids(np.load(centroids_path))
+                self._assign_ivf_rows()
+            elif self._size >= self.ivf_train_size:
+                self.build_ann_index()
+
+    def _replay_log(self, generation: int, truncate: bool) -> int:
+        """Apply one change log to the loaded store; returns how many rows it added or deleted"""
+        log_path, vectors_path = self._log_files(generation)
+        with open(log_path, "rb") as f:
+            data = f.read()
+        vectors = np.fromfile(vectors_path, dtype=np.float32) if os.path.exists(vectors_path) else np.zeros(0)
+        keys = {}
+        changed, log_end, vectors_end = 0, 0, 0
+        # The last element is empty, or an entry whose write was cut short
+        for line in data.split(b"\n")[:-1]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if entry["op"] == "add":
+                start = entry["offset"] // 4
+                end = start + len(entry["ids"]) * entry["dim"]
+                if end > len(vectors):
+                    break
+                texts = [
+                    ChunkRef(keys.setdefault(text[0], text[0]), text[1], text[2]) if isinstance(text, list) else text
+                    for text in entry["texts"]
+                ]
+                self.add_vectors(vectors[start:end].reshape(len(entry["ids"]), entry["dim"]), texts,
+                                 entry["metadatas"], entry["ids"])
+                vectors_end = max(vectors_end, end * 4)
+            else:
+                self.delete(entry["ids"])
+            changed += len(entry["ids"])
+            log_end += len(line) + 1
+        if truncate:
+            # Appends continue after the last complete entry
+            with open(log_path, "ab") as f:
+                f.truncate(log_end)
+            with open(vectors_path, "ab") as f:
+                f.truncate(vectors_end)
+        return changed
+
+    def _load_quantization(self, size: int, generation: int):
+        """Restore codes and the float32 copy, re-encoding when the configured quantization changed"""
+        quantization_path = self._snapshot_file("quantization", "npz", generation)
+        saved = None
+        if size and os.path.exists(quantization_path):
+            with np.load(quantization_path) as data:
+                saved = {key: data[key] for key in data.files}
+        saved_kind = str(saved["kind"]) if saved is not None else "none"
+        dim = self._matrix.shape[1]
+
+        full = None
+        if saved is not None:
+            slots = saved["slots"].astype(np.int64)
+            if len(slots) != size:
+                raise ValueError(f"Vector store at {self.persist_path} is inconsistent: snapshot {generation} has "
+                                 f"{len(slots)} quantized rows for {size} chunks; restore it or re-index")
+            full = FullPrecisionFile(self.persist_path, dim, generation=int(saved["generation"]),
+                                     slots=int(slots.max()) + 1 if len(slots) else 0, read_only=self.read_only)
+            full.dead = len(full) - size
+
+        if saved_kind == self.quantization:
+            if full is not None:
+                self._full = full
+                self._slots = slots
+                if self.quantizer.kind == "int8":
+                    self.quantizer.scale = saved["scale"].astype(np.float32)
+            return
+
+        vectors = full.rows(slots) if full is not None else np.asarray(self._matrix, dtype=np.float32)
+        # The snapshot on disk still holds the old encoding until the next one is written
+        self._needs_snapshot = not self.read_only
+        if self.quantizer is None or self.read_only:
+            # A read-only store cannot write a float32 copy, it searches the decoded vectors exactly
+            self.quantizer = None
+            self._matrix = vectors
+            return
+        next_generation = full.generation + 1 if full is not None else 0
+        self._full = FullPrecisionFile(self.persist_path, dim, generation=next_generation)
+        self._slots = self._full.append(vectors)
+        self.quantizer.update_scale(vectors)
+        self._matrix = self.quantizer.encode(vectors)
@@ -0,0 +1,207 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+Span = Tuple[int, int]
+
+
+def _pieces(text: str, start: int, end: int, separator: str) -> List[Span]:
+    """Spans of text[start:end] cut before every separator match, as re.split with the separator kept at the start"""
+    if not separator:
+        return [(i, i + 1) for i in range(start, end)]
+    spans = []
+    previous = start
+    match = text.find(separator, start, end)
+    while match != -1:
+        if match > previous:
+            spans.append((previous, match))
+        previous = match
+        match = text.find(separator, match + len(separator), end)
+    if previous < end:
+        spans.append((previous, end))
+    return spans
+
+
+def _strip(text: str, start: int, end: int) -> Optional[Span]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+
+def split_spans(text: str, separators: Sequence[str], chunk_size: int, chunk_overlap: int,
+                start: int = 0, end: Optional[int] = None) -> List[Span]:
+    """Chunk boundaries of text[start:end] with RecursiveCharacterTextSplitter semantics
+
+    Separators are tried in order; the first one present splits the text and
+    pieces still longer than chunk_size are split again with the remaining
+    separators. Pieces are merged greedily up to chunk_size with whitespace
+    stripped from both ends, exactly as LangChain does with keep_separator=True.
+    """
+    end = len(text) if end is None else end
+    out: List[Span] = []
+    _split(text, start, end, list(separators), chunk_size, chunk_overlap, out)
+    return out
+
+
+def _split(text: str, start: int, end: int, separators: List[str], chunk_size: int, chunk_overlap: int,
+           out: List[Span]):
+    separator = separators[-1]
+    remaining: List[str] = []
+    for i, candidate in enumerate(separators):
+        if not candidate:
+            separator = candidate
+            break
+        if text.find(candidate, start, end) != -1:
+            separator = candidate
+            remaining = separators[i + 1:]
+            break
+
+    good: List[Span] = []
+    for span in _pieces(text, start, end, separator):
+        if span[1] - span[0] < chunk_size:
+            good.append(span)
+            continue
+        if good:
+            _merge_spans(text, good, chunk_size, chunk_overlap, out)
+            good = []
+        if remaining:
+            _split(text, span[0], span[1], remaining, chunk_size, chunk_overlap, out)
+        else:
+            out.append(span)
+    if good:
+        _merge_spans(text, good, chunk_size, chunk_overlap, out)
+
+
+def _merge_spans(text: str, splits: List[Span], chunk_size: int, chunk_overlap: int, out: List[Span]):
+    """Greedily merge adjacent splits into chunks, carrying up to chunk_overlap characters forward"""
+    head = 0
+    total = 0
+    for i, (start, end) in enumerate(splits):
+        length = end - start
+        if total + length > chunk_size and i > head:
+            span = _strip(text, splits[head][0], splits[i - 1][1])
+            if span:
+                out.append(span)
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                total -= splits[head][1] - splits[head][0]
+                head += 1
+        total += length
+    if head < len(splits):
+        span = _strip(text, splits[head][0], splits[-1][1])
+        if span:
+            out.append(span)
+
+
+def _segment_bounds(text: str, separator: str, segment_size: int) -> List[Span]:
+    """Cut a large text into roughly segment_size pieces, each starting at a separator"""
+    bounds = []
+    start = 0
+    while len(text) - start > segment_size:
+        cut = text.find(separator, start + segment_size)
+        if cut == -1:
+            break
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, len(text)))
+    return bounds
+
+
+def _split_task(args) -> List[Span]:
+    text, separators, chunk_size, chunk_overlap = args
+    return split_spans(text, separators, chunk_size, chunk_overlap)
+
+
+class OffsetTextSplitter(TextSplitter):
+    """Recursive character splitter that works on (start, end) offsets instead of string copies
+
+    Boundaries are computed in one pass per separator level, chunk text is
+    only sliced out when a Document is built, and large inputs are split on a
+    process pool.
+
+    compat=True reproduces RecursiveCharacterTextSplitter(keep_separator=True)
+    exactly, including its str.find based start_index. compat=False reports the
+    true start offset and also cuts single documents larger than segment_size
+    at a top-level separator so they can be split in parallel; chunks at those
+    seams carry no overlap from the previous segment.
+    """
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 100, separators: Optional[List[str]] = None,
+                 add_start_index: bool = False, compat: bool = True, max_workers: Optional[int] = None,
+                 parallel_threshold: int = 8 * 1024 * 1024, segment_size: int = 4 * 1024 * 1024,
+                 **kwargs: Any):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=add_start_index,
+                         keep_separator=True, strip_whitespace=True, **kwargs)
+        self.separators = list(separators or DEFAULT_SEPARATORS)
+        self.compat = compat
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self.segment_size = segment_size
+
+    def split_offsets(self, text: str) -> List[Span]:
+        return self.split_many_offsets([text])[0]
+
+    def split_many_offsets(self, texts: Sequence[str]) -> List[List[Span]]:
+        """Chunk spans for each text, fanned out over a process pool when the input is large"""
+        tasks = []
+        for index, text in enumerate(texts):
+            if not self.compat and len(text) > self.segment_size:
+                separator = next((s for s in self.separators if s and s in text), None)
+                if separator:
+                    tasks.extend((index, start, end) for start, end in
+                                 _segment_bounds(text, separator, self.segment_size))
+                    continue
+            tasks.append((index, 0, len(text)))
+
+        total = sum(len(text) for text in texts)
+        if self.max_workers > 1 and len(tasks) > 1 and total >= self.parallel_threshold:
+            # Workers get their own copy of each segment and send back only offsets
+            args = [(texts[i][start:end], self.separators, self._chunk_size, self._chunk_overlap)
+                    for i, start, end in tasks]
+            with ProcessPoolExecutor(max_workers=min(self.max_workers, len(tasks))) as pool:
+                chunksize = max(1, len(tasks) // (4 * self.max_workers))
+                relative = pool.map(_split_task, args, chunksize=chunksize)
+                results = [[(start + s, start + e) for s, e in found]
+                           for (_, start, _), found in zip(tasks, relative)]
+        else:
+            results = [split_spans(texts[i], self.separators, self._chunk_size, self._chunk_overlap, start, end)
+                       for i, start, end in tasks]
+
+        spans: List[List[Span]] = [[] for _ in texts]
+        for (index, _, _), found in zip(tasks, results):
+            spans[index].extend(found)
+        return spans
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def iter_documents(self, texts: Sequence[str], metadatas: Optional[Sequence[Dict]] = None) -> Iterator[Document]:
+        """Documents for every chunk, each sliced from its source text only when yielded"""
+        metadatas = metadatas or [{}] * len(texts)
+        for text, metadata, spans in zip(texts, metadatas, self.split_many_offsets(texts)):
+            index = 0
+            previous_length = 0
+            for start, end in spans:
+                chunk = text[start:end]
+                chunk_metadata = dict(metadata)
+                if self._add_start_index:
+                    if self.compat:
+                        # Same lookup as LangChain, which can land on an earlier copy of repeated text
+                        index = text.find(chunk, max(0, index + previous_length - self._chunk_overlap))
+                        previous_length = len(chunk)
+                    else:
+                        index = start
+                    chunk_metadata["start_index"] = index
+                yield Document(page_content=chunk, metadata=chunk_metadata)
+
+    def create_documents(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[Document]:
+        return list(self.iter_documents(texts, metadatas))
+
+    def split_documents(self, documents: Sequence[Document]) -> List[Document]:
+        return self.create_documents([doc.page_content for doc in documents], [doc.metadata for doc in documents])
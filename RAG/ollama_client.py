@@ -0,0 +1,356 @@
+import logging
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+
+import httpx
+
+import metrics
+import tracing
+
+if TYPE_CHECKING:
+    from langchain_ollama import OllamaEmbeddings, OllamaLLM
+
+logger = logging.getLogger(__name__)
+
+# Gateway errors mean Ollama itself is unreachable or overloaded, unlike a 4xx or a model error
+BREAKER_STATUS_CODES = (502, 503, 504)
+
+
+def parse_keep_alive(value: Optional[str]) -> Optional[int]:
+    """Seconds from an Ollama style duration ("300", "30m", "1h", "-1" for forever)"""
+    if value is None or not str(value).strip():
+        return None
+    match = re.fullmatch(r"(-?\d+)\s*([smh]?)", str(value).strip().lower())
+    if not match:
+        raise ValueError(f"Invalid keep_alive: {value}")
+    return int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+class CircuitOpenError(httpx.ConnectError):
+    """Raised instead of sending a request while Ollama is known to be down
+
+    Subclasses ConnectError so the ollama client reports it like any other
+    connection failure.
+    """
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and lets one probe through every reset_timeout"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("🟢 Ollama reachable again, circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"🔴 Ollama failing ({self._failures} errors in a row), circuit open")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "consecutive_failures": self._failures,
+                "retry_after": round(self.retry_after(), 2)}
+
+
+class _TracedStream(httpx.SyncByteStream):
+    """Response body that ends its request's span once read, so streamed generations are timed in full"""
+
+    def __init__(self, stream: httpx.SyncByteStream, span: tracing.Span):
+        self.stream = stream
+        self.span = span
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.stream.close()
+        self.span.end(bytes=self.bytes)
+
+
+class _AsyncTracedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, span: tracing.Span):
+        self.stream = stream
+        self.span = span
+        self.bytes = 0
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.bytes += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        await self.stream.aclose()
+        self.span.end(bytes=self.bytes)
+
+
+def _traced(response: httpx.Response, span: Optional[tracing.Span], stream_class) -> httpx.Response:
+    if span is not None:
+        span.args["status"] = response.status_code
+        response.stream = stream_class(response.stream, span)
+    return response
+
+
+class _BreakerTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, breaker: CircuitBreaker):
+        self.transport = transport
+        self.breaker = breaker
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            metrics.OLLAMA_REQUESTS.inc(outcome="rejected")
+            raise CircuitOpenError("Ollama circuit breaker is open", request=request)
+        span = tracing.start_span(f"{request.method} {request.url.path}", "http")
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TransportError as e:
+            self.breaker.record_failure()
+            metrics.OLLAMA_REQUESTS.inc(outcome="error")
+            if span is not None:
+                span.end(error=repr(e))
+            raise
+        if response.status_code in BREAKER_STATUS_CODES:
+            self.breaker.record_failure()
+            metrics.OLLAMA_REQUESTS.inc(outcome="error")
+        else:
+            self.breaker.record_success()
+            metrics.OLLAMA_REQUESTS.inc(outcome="ok")
+        return _traced(response, span, _TracedStream)
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncBreakerTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self.transport = transport
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            metrics.OLLAMA_REQUESTS.inc(outcome="rejected")
+            raise CircuitOpenError("Ollama circuit breaker is open", request=request)
+        span = tracing.start_span(f"{request.method} {request.url.path}", "http")
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            self.breaker.record_failure()
+            metrics.OLLAMA_REQUESTS.inc(outcome="error")
+            if span is not None:
+                span.end(error=repr(e))
+            raise
+        if response.status_code in BREAKER_STATUS_CODES:
+            self.breaker.record_failure()
+            metrics.OLLAMA_REQUESTS.inc(outcome="error")
+        else:
+            self.breaker.record_success()
+            metrics.OLLAMA_REQUESTS.inc(outcome="ok")
+        return _traced(response, span, _AsyncTracedStream)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class OllamaClients:
+    """One connection pool, circuit breaker and health cache for every Ollama model in the process
+
+    llm() and embeddings() hand out LangChain clients whose HTTP requests all
+    go through the same pooled transport, so connections are reused across
+    generations, embedding batches and health checks. health() answers from a
+    cached /api/tags call instead of running a generation.
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:11434", model: str = "deepseek-r1:8b",
+                 keep_alive: Optional[int] = None, timeout: float = 300.0, connect_timeout: float = 3.0,
+                 max_connections: int = 16, failure_threshold: int = 5, reset_timeout: float = 10.0,
+                 health_ttl: float = 5.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.keep_alive = keep_alive
+        self.health_ttl = health_ttl
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._transport = _BreakerTransport(httpx.HTTPTransport(limits=self.limits), self.breaker)
+        self._http = httpx.Client(base_url=self.base_url, transport=self._transport, timeout=self.timeout)
+        self._health: Optional[Dict] = None
+        self._health_checked = 0.0
+        self._health_lock = threading.Lock()
+        self._last_used: Dict[str, float] = {}
+        self._warm_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "OllamaClients":
+        return cls(
+            base_url=os.getenv('OLLAMA_BASE_URL', 'http://127.0.0.1:11434'),
+            model=os.getenv('OLLAMA_MODEL', 'deepseek-r1:8b'),
+            keep_alive=parse_keep_alive(os.getenv('OLLAMA_KEEP_ALIVE', '30m')),
+            timeout=float(os.getenv('OLLAMA_TIMEOUT', '300')),
+            connect_timeout=float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '3')),
+            max_connections=int(os.getenv('OLLAMA_MAX_CONNECTIONS', '16')),
+            failure_threshold=int(os.getenv('OLLAMA_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv('OLLAMA_BREAKER_RESET', '10')),
+            health_ttl=float(os.getenv('OLLAMA_HEALTH_TTL', '5'))
+        )
+
+    def _client_kwargs(self) -> Dict:
+        # Async clients get their own pool: an async transport is bound to the event loop that uses it
+        return {
+            "sync_client_kwargs": {"transport": self._transport, "timeout": self.timeout},
+            "async_client_kwargs": {
+                "transport": _AsyncBreakerTransport(httpx.AsyncHTTPTransport(limits=self.limits), self.breaker),
+                "timeout": self.timeout
+            }
+        }
+
+    def llm(self, model: Optional[str] = None, **kwargs) -> "OllamaLLM":
+        # Imported on first use, langchain_ollama is the slowest import of the service
+        from langchain_ollama import OllamaLLM
+
+        return OllamaLLM(model=model or self.model, base_url=self.base_url, keep_alive=self.keep_alive,
+                         **self._client_kwargs(), **kwargs)
+
+    def embeddings(self, model: Optional[str] = None, **kwargs) -> "OllamaEmbeddings":
+        from langchain_ollama import OllamaEmbeddings
+
+        return OllamaEmbeddings(model=model or self.model, base_url=self.base_url, keep_alive=self.keep_alive,
+                                **self._client_kwargs(), **kwargs)
+
+    def health(self, force: bool = False) -> Dict:
+        """Reachability and model availability from /api/tags, refreshed at most every health_ttl seconds"""
+        if not force and self._health is not None and time.monotonic() - self._health_checked < self.health_ttl:
+            return self._health
+        # Concurrent probes share one refresh; the others get the previous answer
+        if not self._health_lock.acquire(blocking=self._health is None):
+            return self._health
+        try:
+            started = time.perf_counter()
+            try:
+                response = self._http.get("/api/tags")
+                response.raise_for_status()
+                models = [m.get("name") for m in response.json().get("models", [])]
+                status = {
+                    "ollama_connected": True,
+                    "model_available": self.model in models or f"{self.model}:latest" in models,
+                    "models": models
+                }
+            except Exception as e:
+                status = {"ollama_connected": False, "model_available": False, "error": str(e)}
+            status["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            status["circuit"] = self.breaker.stats()
+            self._health = status
+            self._health_checked = time.monotonic()
+            return status
+        finally:
+            self._health_lock.release()
+
+    def warm_up(self, models: Optional[Iterable[str]] = None, embedding_models: Iterable[str] = (),
+                background: bool = True):
+        """Load models into Ollama memory ahead of the first request"""
+        keep_alive = {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+
+        def run():
+            for model in models or [self.model]:
+                try:
+                    # An empty prompt loads the model without generating anything
+                    self._http.post("/api/generate", json={"model": model, "prompt": "", **keep_alive}).raise_for_status()
+                    with self._warm_lock:
+                        self._last_used[model] = time.monotonic()
+                    logger.info(f"🔥 Warmed up {model}")
+                except Exception as e:
+                    logger.warning(f"⚠️ Warm-up of {model} failed: {e}")
+            for model in embedding_models:
+                try:
+                    self._http.post("/api/embed", json={"model": model, "input": "warm up", **keep_alive}).raise_for_status()
+                    logger.info(f"🔥 Warmed up {model} for embeddings")
+                except Exception as e:
+                    logger.warning(f"⚠️ Warm-up of {model} failed: {e}")
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="ollama-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def prewarm(self, model: Optional[str] = None) -> bool:
+        """Start loading a generation model that Ollama may have unloaded since its last use
+
+        Called as a query arrives, so the load overlaps the query's retrieval
+        instead of delaying its generation. Queries within half the keep_alive
+        window of each other send nothing.
+        """
+        model = model or self.model
+        # Ollama's own default keep_alive is 5 minutes, a negative one keeps the model loaded for good
+        # and with 0 it is unloaded straight after every request, so loading it early would not last
+        window = 300 if self.keep_alive is None else self.keep_alive
+        if window == 0:
+            return False
+        now = time.monotonic()
+        with self._warm_lock:
+            last = self._last_used.get(model)
+            self._last_used[model] = now
+            if last is not None and (window < 0 or now - last < window / 2):
+                return False
+        self.warm_up([model])
+        return True
+
+    def close(self):
+        self._http.close()
+
+
+_shared: Optional[OllamaClients] = None
+_shared_lock = threading.Lock()
+
+
+def shared_clients() -> OllamaClients:
+    """Process-wide OllamaClients configured from the environment"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = OllamaClients.from_env()
+        return _shared
@@ -0,0 +1,127 @@
+import os
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+QUANTIZATION_TYPES = ("none", "float16", "int8")
+
+
+def row_blocks(rows: int, dim: int, max_values: int = 1 << 24) -> Iterator[Tuple[int, int]]:
+    """(start, end) row ranges whose float32 copy stays around 64 MB"""
+    step = max(1, max_values // max(dim, 1))
+    for start in range(0, rows, step):
+        yield start, min(start + step, rows)
+
+
+class ScalarQuantizer:
+    """float16 or per-dimension scaled int8 codes for normalized embeddings
+
+    int8 stores round(x / scale) with scale = max |x| per dimension / 127.
+    The scale only grows; update_scale reports when it did so the caller can
+    re-encode rows written with the old one.
+    """
+
+    def __init__(self, kind: str):
+        if kind not in ("float16", "int8"):
+            raise ValueError(f"Unknown quantization: {kind}")
+        self.kind = kind
+        self.dtype = np.dtype(np.float16 if kind == "float16" else np.int8)
+        self.scale: Optional[np.ndarray] = None
+
+    def update_scale(self, vectors: np.ndarray) -> bool:
+        if self.kind != "int8":
+            return False
+        needed = np.abs(vectors).max(axis=0) / 127.0
+        if self.scale is None:
+            self.scale = np.maximum(needed, 1e-8).astype(np.float32)
+            return False
+        if np.all(needed <= self.scale):
+            return False
+        # Some headroom so a stream of slightly larger values does not re-encode every time
+        self.scale = np.maximum(self.scale, needed * 1.1).astype(np.float32)
+        return True
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.kind == "float16":
+            return vectors.astype(np.float16)
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.kind == "float16":
+            return codes.astype(np.float32)
+        return codes.astype(np.float32) * self.scale
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate dot products of a float32 query with encoded rows, block by block"""
+        weights = query * self.scale if self.kind == "int8" else query
+        scores = np.empty(len(codes), dtype=np.float32)
+        # Small blocks keep the float32 conversion in cache
+        for start, end in row_blocks(len(codes), codes.shape[1] if codes.ndim == 2 else 0, 1 << 18):
+            scores[start:end] = codes[start:end].astype(np.float32) @ weights
+        return scores
+
+
+class FullPrecisionFile:
+    """Append-only float32 copy of every added vector, read back through a memory map
+
+    Rows are addressed by slot, which never changes while a slot is live, so
+    a persisted slot list stays valid no matter what was appended after it.
+    Dead slots are dropped by compact(), which writes a new generation file;
+    older generations are left for the owner to delete with remove_stale()
+    once nothing persisted refers to them.
+    """
+
+    def __init__(self, directory: str, dim: int, generation: int = 0, slots: int = 0, read_only: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.generation = generation
+        self.dead = 0
+        self._map: Optional[np.memmap] = None
+        if not read_only:
+            # Anything past the persisted slot count was never referenced
+            with open(self.path, "ab") as f:
+                f.truncate(slots * dim * 4)
+        self._slots = slots
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"full_vectors.{self.generation}.f32")
+
+    def __len__(self) -> int:
+        return self._slots
+
+    def append(self, vectors: np.ndarray) -> np.ndarray:
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        slots = np.arange(self._slots, self._slots + len(vectors), dtype=np.int64)
+        self._slots += len(vectors)
+        return slots
+
+    def rows(self, slots: np.ndarray) -> np.ndarray:
+        if len(slots) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._map is None or len(self._map) < self._slots:
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self._slots, self.dim))
+        return np.asarray(self._map[slots])
+
+    def compact(self, live_slots: np.ndarray) -> np.ndarray:
+        """Rewrite only the live slots into a new file and return their new slot numbers"""
+        # Map the current file before the generation, and with it self.path, moves on
+        self.rows(live_slots[:1])
+        self.generation += 1
+        with open(self.path, "wb") as f:
+            for start, end in row_blocks(len(live_slots), self.dim):
+                f.write(self.rows(live_slots[start:end]).tobytes())
+        self._map = None
+        self._slots = len(live_slots)
+        self.dead = 0
+        return np.arange(len(live_slots), dtype=np.int64)
+
+
+def remove_stale(directory: str, keep: Optional[str] = None):
+    """Delete every full precision file in directory except keep"""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("full_vectors.") and name.endswith(".f32") and path != keep:
+            os.remove(path)
@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import metrics
+import tracing
+
+
+class Pending:
+    """Result of a stage running in the background; waiting for it counts towards its critical path"""
+
+    def __init__(self, clock: "StageClock", name: str, future: Future):
+        self._clock = clock
+        self._name = name
+        self._future = future
+
+    def result(self):
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"wait:{self._name}", "stage"):
+                return self._future.result()
+        finally:
+            self._clock._add_critical(self._name, time.perf_counter() - start)
+
+
+class StageClock:
+    """Wall-clock and critical-path time of the stages of one query
+
+    wall is how long a stage ran. critical is how long the request was held
+    up by it: all of a stage that runs inline, but only the wait for the
+    result of a stage that runs in the background. Critical times add up to
+    the request's own time; wall times add up to more when stages overlap,
+    and the difference is what the overlap saved.
+    """
+
+    def __init__(self, executor: Executor):
+        self.wall: Dict[str, float] = {}
+        self.critical: Dict[str, float] = {}
+        self._executor = executor
+        self._lock = threading.Lock()
+
+    def _add(self, totals: Dict[str, float], name: str, seconds: float):
+        with self._lock:
+            totals[name] = totals.get(name, 0.0) + seconds
+
+    def _add_critical(self, name: str, seconds: float):
+        self._add(self.critical, name, seconds)
+        metrics.STAGE_CRITICAL_SECONDS.observe(seconds, stage=name)
+
+    def record(self, name: str, seconds: float, critical: bool = True):
+        self._add(self.wall, name, seconds)
+        metrics.STAGE_SECONDS.observe(seconds, stage=name)
+        if critical:
+            self._add_critical(name, seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage run inline on the request's thread"""
+        start = time.perf_counter()
+        try:
+            with tracing.span(name, "stage"):
+                yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def background(self, name: str, fn: Callable, *args) -> Pending:
+        """Start a stage on the pipeline executor; call result() where its output is needed"""
+        def run():
+            start = time.perf_counter()
+            try:
+                with tracing.span(name, "stage"):
+                    return fn(*args)
+            finally:
+                self.record(name, time.perf_counter() - start, critical=False)
+
+        return Pending(self, name, self._executor.submit(tracing.wrap(run)))
+
+    def timings(self) -> Dict:
+        """Wall-clock seconds per stage, plus the critical path and the time saved by overlapping"""
+        with self._lock:
+            wall, critical = dict(self.wall), dict(self.critical)
+        return {
+            **{name: round(seconds, 2) for name, seconds in wall.items()},
+            "critical_path": {name: round(seconds, 2) for name, seconds in critical.items()},
+            "overlap": round(max(0.0, sum(wall.values()) - sum(critical.values())), 2)
+        }
@@ -1,20 +1,27 @@
 from typing import Dict, List
-from langchain import hub
 from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
+from context_packer import ContextPacker
+
+# invoke() answers start with this when retrieval or generation failed
+ERROR_PREFIX = "Error generating response:"
 
 class RAGChain:
-    def __init__(self, llm, vector_store):
+    def __init__(self, llm, vector_store, context_packer: ContextPacker = None):
         self.llm = llm
         self.vector_store = vector_store
+        self.context_packer = context_packer or ContextPacker()
         self.retriever = vector_store.as_retriever(search_kwargs={"k": 4})
         self.prompt = self._get_prompt()
         self.chain = self._build_chain()
 
     def _get_prompt(self):
         try:
+            # langchain.hub is slow to import and only used here
+            from langchain import hub
+
             prompt = hub.pull("rlm/rag-prompt")
             print("Loaded RAG prompt from LangChain hub")
             return prompt
@@ -39,7 +46,7 @@ Helpful Professional Answer:"""
 
     def _build_chain(self):
         def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
+            return self.context_packer.pack(docs).context
 
         chain = (
             {"context": self.retriever | format_docs, "question": RunnablePassthrough()}
@@ -52,7 +59,7 @@ Helpful Professional Answer:"""
 
     def invoke(self, question: str) -> Dict:
         try:
-            retrieved_docs = self.retriever.get_relevant_documents(question)
+            retrieved_docs = self.retriever.invoke(question)
             answer = self.chain.invoke(question)
             
             return {
@@ -63,9 +70,9 @@ Helpful Professional Answer:"""
         except Exception as e:
             return {
                 "question": question,
-                "answer": f"Error generating response: {e}",
+                "answer": f"{ERROR_PREFIX} {e}",
                 "source_documents": []
             }
 
     def get_relevant_documents(self, question: str) -> List[Document]:
-        return self.retriever.get_relevant_documents(question)
+        return self.retriever.invoke(question)
@@ -1,18 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import re
+import asyncio
 import time
+import uuid
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
-from langchain_ollama import OllamaLLM, OllamaEmbeddings
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from document_index import DocumentIndex
+from embedding_pipeline import EmbeddingPipeline
+from streaming import StreamingResponseCleaner, format_sse
+from bm25_index import reciprocal_rank_fusion
+from answer_cache import SemanticAnswerCache
+from offset_splitter import OffsetTextSplitter
+from context_packer import ContextPacker
+from ollama_client import shared_clients
+from embedding_model import EmbeddingSpec
+from sharded_index import CollectionRegistry
+from generation_scheduler import SchedulerRejected, scheduler_for
+from query_pipeline import StageClock
+from wire_format import (MIN_COMPRESS_BYTES, DecompressRequests, MissingDocuments, accepts_gzip, compress,
+                         document_hash, document_key)
+import langchain_hooks
+import metrics
+import tracing
 
 load_dotenv()
 
@@ -20,39 +38,110 @@ app = Flask(__name__)
 
 cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://localhost:8090').split(',')
 CORS(app, origins=cors_origins)
+# The Go backend gzips large request bodies
+app.wsgi_app = DecompressRequests(app.wsgi_app, max_bytes=int(os.getenv('MAX_REQUEST_MB', '512')) * 1024 * 1024)
 
 logging.basicConfig(level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')))
 logger = logging.getLogger(__name__)
 
+ERROR_ANSWER = "I'm here to help with your Bajaj Finserv questions! While I encountered a technical issue processing your specific request, I can still assist you with general information about our policies, loans, and insurance products. Please try asking your question in a different way."
+
+
+def turned_away_answer(error: Exception) -> str:
+    """What the user is shown when a streamed query is turned away before generation"""
+    if isinstance(error, SchedulerRejected):
+        if error.reason == "unavailable":
+            return f"The assistant is temporarily unavailable. Please try again in {error.retry_after_header} seconds."
+        return f"The assistant is busy right now. Please try again in {error.retry_after_header} seconds."
+    return "Some of the documents for this question are still being indexed. Please try again in a moment."
+
 class RAGProcessor:
     def __init__(self):
         try:
-            ollama_url = os.getenv('OLLAMA_BASE_URL', 'http://127.0.0.1:11434')
-            model_name = os.getenv('OLLAMA_MODEL', 'deepseek-r1:8b')
+            # Pooled connections, keep_alive and the circuit breaker are shared by every Ollama client
+            self.ollama = shared_clients()
+            model_name = self.ollama.model
             
             # Optimize LLM settings for detailed responses
-            self.llm = OllamaLLM(
-                model=model_name, 
-                base_url=ollama_url,
+            self.llm = self.ollama.llm(
                 temperature=0.2,        # Slightly higher for more creative responses
                 top_p=0.95,            # Allow more diverse vocabulary
                 num_ctx=4096,          # Larger context for more detailed responses
                 num_predict=1024,      # Allow longer responses (4-6 paragraphs)
             )
-            self.embeddings = OllamaEmbeddings(model=model_name, base_url=ollama_url)
+            self.token_usage = langchain_hooks.TokenUsageHandler()
+            # Bounded concurrent generations per Ollama endpoint, the rest queue by priority
+            self.scheduler = scheduler_for(self.ollama.base_url, self.ollama.breaker)
+
+            # Unchanged chunks are served from disk instead of being re-embedded
+            embedding_cache = EmbeddingCache(
+                cache_dir=os.getenv('EMBEDDING_CACHE_DIR', './embedding_cache'),
+                max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_MB', '512')) * 1024 * 1024
+            )
+            # A small dedicated embedding model (EMBEDDING_MODEL), optionally reduced to EMBEDDING_DIM; questions are
+            # embedded once for all collections, so they share it and migrate_embeddings.py migrates them together
+            persist_directory = os.getenv('CHROMA_PERSIST_DIRECTORY', './chroma_db')
+            self.embedding_spec = EmbeddingSpec.from_env(DocumentIndex.projection_file(
+                persist_directory, DocumentIndex.store_collection(persist_directory)
+            ))
+            # Cache misses go through a batched pipeline with bounded concurrency and retries
+            self.embedding_pipeline = EmbeddingPipeline.from_env(
+                self.ollama.embeddings(self.embedding_spec.model)
+            )
+            # Full width vectors are cached, so changing EMBEDDING_DIM does not re-embed anything
+            self.embeddings = self.embedding_spec.wrap(CachedEmbeddings(
+                langchain_hooks.InstrumentedEmbeddings(self.embedding_pipeline),
+                embedding_cache,
+                self.embedding_spec.model,
+                query_cache_size=int(os.getenv('EMBEDDING_QUERY_CACHE_SIZE', '1024'))
+            ))
+            logger.info(f"🧮 Embeddings: {self.embedding_spec}")
             
             chunk_size = int(os.getenv('CHUNK_SIZE', '500'))
             chunk_overlap = int(os.getenv('CHUNK_OVERLAP', '100'))
             
             # Better chunking strategy for financial documents
-            self.text_splitter = RecursiveCharacterTextSplitter(
+            self.text_splitter = OffsetTextSplitter(
                 chunk_size=chunk_size,     # Use environment variable
                 chunk_overlap=chunk_overlap, # Use environment variable
                 separators=["\n\n", "\n", ". ", " "],  # Better splitting points
                 add_start_index=True,
-                length_function=len
+                # Byte-identical to RecursiveCharacterTextSplitter unless SPLITTER_COMPAT=False
+                compat=os.getenv('SPLITTER_COMPAT', 'True').lower() == 'true',
+                max_workers=int(os.getenv('SPLITTER_WORKERS', '0')) or None
             )
             
+            # Overlapping neighbour chunks are merged and near-duplicates dropped to fit the prompt budget
+            self.context_packer = ContextPacker(
+                token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', '2560')),
+                chars_per_token=float(os.getenv('CONTEXT_CHARS_PER_TOKEN', '4'))
+            )
+            
+            # Answers to near-identical questions are reused until the corpus changes
+            self.answer_cache = None
+            if os.getenv('ANSWER_CACHE_ENABLED', 'True').lower() == 'true':
+                self.answer_cache = SemanticAnswerCache(
+                    threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95')),
+                    max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000')),
+                    ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+                )
+            
+            # Vector hits are fused with BM25 hits so exact policy numbers and product names are found
+            self.hybrid_search = os.getenv('HYBRID_SEARCH', 'True').lower() == 'true'
+            self.rrf_k = int(os.getenv('RRF_K', '60'))
+            
+            # Long-lived indexes, one per named collection (tenant or document set), sharded when large;
+            # documents are embedded once per content version
+            self.collections = CollectionRegistry(
+                persist_directory,
+                self.embeddings,
+                self.text_splitter,
+                embedding_spec=self.embedding_spec,
+                default_shards=int(os.getenv('COLLECTION_SHARDS', '1')),
+                search_workers=int(os.getenv('SHARD_SEARCH_WORKERS', '8'))
+            )
+            self.index = self.collections.get()
+            
             # Enhanced prompt for detailed responses
             self.prompt = PromptTemplate.from_template("""
 You are a knowledgeable Bajaj Finserv policy expert assistant. Always provide comprehensive, detailed, and informative answers to customer questions about insurance policies, loans, and financial products.
@@ -75,6 +164,21 @@ Instructions:
 - When relevant, mention related Bajaj Finserv products or services
 
 Detailed Professional Answer:""")
+            # The prompt is filled in as soon as retrieval is done, generation only sends it
+            self.generation_chain = (self.llm | StrOutputParser()).with_config(callbacks=[self.token_usage])
+            
+            # Query stages that do not wait on each other (question embedding, keyword search) overlap here
+            self.pipeline_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('QUERY_PIPELINE_WORKERS', '8')),
+                thread_name_prefix="query-stage"
+            )
+            
+            # Load the model in the background so the first query does not pay for it
+            if os.getenv('OLLAMA_WARMUP', 'True').lower() == 'true':
+                embedding_models = [self.embedding_spec.model] if self.embedding_spec.model != model_name else []
+                self.ollama.warm_up(embedding_models=embedding_models)
+            # ... and again as a query arrives if it has been idle long enough to be unloaded
+            self.prewarm = os.getenv('OLLAMA_PREWARM', 'True').lower() == 'true'
             
             logger.info("RAG Processor initialized successfully")
             
@@ -103,77 +207,39 @@ Detailed Professional Answer:""")
             logger.info(f"📝 Source: {chunk.metadata.get('title', 'Unknown')}")
 
     def validate_context(self, context: str, query: str) -> bool:
-        """Validate if context is relevant to the query"""
+        """Validate that retrieval produced usable context"""
         if not context.strip():
             logger.warning("⚠️ Empty context provided")
             return False
-            
-        # Check for keyword overlap
-        query_words = set(query.lower().split())
-        context_words = set(context.lower().split())
-        
-        # Remove common words
-        common_words = {'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
-        query_words -= common_words
-        context_words -= common_words
-        
-        overlap = len(query_words.intersection(context_words))
-        relevance_score = overlap / len(query_words) if query_words else 0
-        
-        logger.info(f"📈 Context relevance score: {relevance_score:.2f}")
-        return True  # Always return True since we want to provide an answer
+        return True
 
-    def filter_relevant_chunks(self, chunks: List, query: str, max_chunks: int = 3):
-        """Filter and return most relevant chunks"""
-        if not chunks:
+    def filter_relevant_chunks(self, chunks: List, query: str, max_chunks: int = 3, lexical_chunks: List = None):
+        """Fuse vector and lexical rankings with reciprocal rank fusion and keep the best chunks"""
+        if not chunks and not lexical_chunks:
             logger.warning("⚠️ No chunks available for filtering")
             return []
-            
-        # For now, return top chunks (Chroma already sorts by relevance)
-        filtered = chunks[:max_chunks]
         
-        logger.info(f"🎯 Filtered to {len(filtered)} most relevant chunks")
-        return filtered
-
-    def validate_context(self, context: str, query: str) -> bool:
-        """Validate if context is relevant to the query"""
-        if not context.strip():
-            logger.warning("⚠️ Empty context provided")
-            return False
-            
-        # Check for keyword overlap
-        query_words = set(query.lower().split())
-        context_words = set(context.lower().split())
-        
-        # Remove common words
-        common_words = {'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
-        query_words -= common_words
-        context_words -= common_words
-        
-        overlap = len(query_words.intersection(context_words))
-        relevance_score = overlap / len(query_words) if query_words else 0
-        
-        logger.info(f"📈 Context relevance score: {relevance_score:.2f}")
-        
-        if relevance_score < 0.1:  # Less than 10% overlap
-            logger.warning(f"⚠️ Low relevance score: {relevance_score:.2f}")
-        
-        return relevance_score > 0.05  # At least 5% overlap
-
-    def filter_relevant_chunks(self, chunks: List, query: str, max_chunks: int = 3):
-        """Filter and return most relevant chunks"""
-        if not chunks:
-            return []
-            
-        # For now, return top chunks (Chroma already sorts by relevance)
-        # In future, can add more sophisticated filtering
-        filtered = chunks[:max_chunks]
+        if not lexical_chunks:
+            filtered = chunks[:max_chunks]
+        else:
+            by_id = {}
+            rankings = []
+            for ranked in (chunks, lexical_chunks):
+                ids = []
+                for doc in ranked:
+                    chunk_id = doc.metadata.get('chunk_id') or doc.id or doc.page_content
+                    by_id.setdefault(chunk_id, doc)
+                    ids.append(chunk_id)
+                rankings.append(ids)
+            fused = reciprocal_rank_fusion(rankings, k=self.rrf_k)
+            filtered = [by_id[chunk_id] for chunk_id, _ in fused[:max_chunks]]
+            logger.info(f"🔤 Lexical search matched {len(lexical_chunks)} chunks")
         
         logger.info(f"🎯 Filtered to {len(filtered)} most relevant chunks")
         return filtered
 
     def process_documents(self, documents: List[Dict]) -> List[Document]:
-        """Process and validate documents with enhanced debugging"""
+        """Validate request documents and give each one a stable index id"""
         langchain_docs = []
         
         for i, doc in enumerate(documents):
@@ -182,10 +248,12 @@ Detailed Professional Answer:""")
                 continue
                 
             content = doc['content'].strip()
+            title = doc.get('title', f'Document_{i+1}')
             langchain_doc = Document(
                 page_content=content,
                 metadata={
-                    'title': doc.get('title', f'Document_{i+1}'),
+                    'doc_id': str(doc.get('id') or title),
+                    'title': title,
                     'file_type': doc.get('file_type', 'unknown'),
                     'content_length': len(content)
                 }
@@ -193,157 +261,466 @@ Detailed Professional Answer:""")
             langchain_docs.append(langchain_doc)
             
             # Debug document processing
-            logger.info(f"📄 Processed: {doc.get('title', f'Doc_{i+1}')} ({len(content)} chars)")
+            logger.info(f"📄 Processed: {title} ({len(content)} chars)")
         
         if not langchain_docs:
             logger.error("❌ No valid documents to process")
-            return []
-        
-        chunks = self.text_splitter.split_documents(langchain_docs)
-        logger.info(f"✂️ Created {len(chunks)} chunks from {len(langchain_docs)} documents")
-        
-        # Validate chunk quality
-        for i, chunk in enumerate(chunks[:3]):  # Check first 3 chunks
-            logger.info(f"🔤 Chunk {i+1} preview: {chunk.page_content[:100]}...")
             
-        return chunks
-
-    def create_vector_store(self, documents: List[Document]):
+        return langchain_docs
+
+    def held_documents(self, document_refs: List[Dict], documents: List[Dict] = None, index=None,
+                       record: bool = True) -> List[str]:
+        """Ids of referenced documents the index already holds at the referenced content hash
+
+        Raises MissingDocuments with the hashes that are neither held nor sent
+        in full with the request, so the client can send just those.
+        """
+        index = index or self.index
+        indexed = index.documents()
+        sent = {document_hash(doc.get('content', '')) for doc in documents or []}
+        held, missing = [], []
+        for ref in document_refs:
+            doc_id, ref_hash = document_key(ref), ref.get('hash')
+            if ref_hash in sent:
+                continue
+            if doc_id in indexed and indexed[doc_id]["hash"] == ref_hash:
+                held.append(doc_id)
+            else:
+                missing.append(ref_hash)
+        if record:
+            metrics.DOCUMENT_REFS.inc(len(held), result="held")
+            metrics.DOCUMENT_REFS.inc(len(missing), result="missing")
+        if missing:
+            raise MissingDocuments(missing)
+        return held
+
+    def missing_documents(self, document_refs: List[Dict], documents: List[Dict] = None,
+                          collection: str = None) -> List[str]:
+        """Hashes of referenced documents a query would have to be sent again with"""
         try:
-            persist_dir = os.getenv('CHROMA_PERSIST_DIRECTORY', './chroma_db')
-            vector_store = Chroma.from_documents(
-                documents, 
-                self.embeddings,
-                persist_directory=persist_dir
-            )
-            logger.info("Vector store created successfully")
-            return vector_store
+            self.held_documents(document_refs, documents, self.collections.get(collection, create=True), record=False)
+        except MissingDocuments as e:
+            return e.hashes
+        return []
+
+    def update_index(self, documents: List[Document], index=None, keep: List[str] = (), prune: bool = False) -> Dict:
+        """Upsert the documents sent by the backend into the long-lived index
+
+        Documents are removed through delete_document; prune also drops every
+        indexed document not sent or kept, mirroring the sender's corpus.
+        """
+        index = index or self.index
+        try:
+            stats = index.sync(documents, keep, prune)
+            logger.info(f"🧠 Index sync: {stats}")
+            return stats
         except Exception as e:
-            logger.error(f"Failed to create vector store: {e}")
+            logger.error(f"Failed to update document index: {e}")
             raise
 
-    def query(self, question: str, documents: List[Dict]) -> Dict:
-        start_time = time.time()
-        try:
-            logger.info(f"🚀 Starting RAG query: {question[:50]}...")
-            
-            if not documents:
-                return {
-                    "answer": "I'd be happy to help you with your Bajaj Finserv related questions! However, I need some documents to be uploaded first to provide you with accurate and specific information about policies, loans, or insurance products.",
-                    "source_documents": []
-                }
-
-            # Step 1: Document processing with timing
-            doc_start = time.time()
-            doc_chunks = self.process_documents(documents)
-            doc_time = time.time() - doc_start
-            logger.info(f"📄 Document processing: {doc_time:.2f}s")
-            
-            if not doc_chunks:
-                return {
-                    "answer": "I'm here to help with your Bajaj Finserv questions! While I couldn't extract specific content from the uploaded documents, I can still provide general guidance about our policies, loans, and insurance products. Please feel free to ask your question.",
-                    "source_documents": []
-                }
+    def retrieve_context(self, question: str, documents: List[Dict] = None, collection: str = None,
+                         document_refs: List[Dict] = None, prune: bool = False) -> Dict:
+        """Run document processing, index update and retrieval for a question
+
+        Returns either a ready "answer" when there is nothing to retrieve from, or
+        the filled-in "prompt", the chunks it was built from and the "clock" of its stages.
+        Documents sent with the question create their collection if needed.
+        document_refs stand for documents by content hash. Sent documents are
+        upserted and the whole collection is searched; with prune the collection
+        is first cut down to the referenced documents plus the full ones.
+        """
+        index = self.collections.get(collection, create=bool(documents or document_refs))
+        clock = StageClock(self.pipeline_executor)
+        # Stages that do not depend on the corpus start at once: the model loads while retrieval runs
+        # and the question is embedded while documents are processed and indexed
+        if self.prewarm:
+            self.ollama.prewarm()
+        question_vector = clock.background("question_embedding", self.embeddings.embed_query, question)
+
+        # Step 1: Document processing
+        with clock.stage("document_processing"):
+            held = self.held_documents(document_refs, documents, index) if document_refs else []
+            langchain_docs = self.process_documents(documents) if documents else []
+        logger.info(f"📄 Document processing: {clock.wall['document_processing']:.2f}s")
+        
+        if documents and not langchain_docs and not held:
+            metrics.FALLBACK_ANSWERS.inc(reason="no_content")
+            return {
+                "answer": "I'm here to help with your Bajaj Finserv questions! While I couldn't extract specific content from the uploaded documents, I can still provide general guidance about our policies, loans, and insurance products. Please feel free to ask your question.",
+                "source_documents": []
+            }
 
-            # Step 2: Vector store creation with timing
-            vector_start = time.time()
-            vector_store = self.create_vector_store(doc_chunks)
-            vector_time = time.time() - vector_start
-            logger.info(f"🧠 Vector store creation: {vector_time:.2f}s")
-            
-            # Step 3: Document retrieval with timing
-            retrieval_start = time.time()
-            max_docs = min(int(os.getenv('MAX_DOCUMENTS_PER_QUERY', '6')), len(doc_chunks))
-            retriever = vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": max_docs}
-            )
+        # Step 2: Index update, only new or changed documents are embedded
+        with clock.stage("vector_store"):
+            self.embeddings.reset_request_stats()
+            if langchain_docs or document_refs:
+                self.update_index(langchain_docs, index, held, prune)
+        cache_stats = self.embeddings.request_stats()
+        metrics.EMBEDDING_CACHE.inc(cache_stats['hits'], result="hit")
+        metrics.EMBEDDING_CACHE.inc(cache_stats['misses'], result="miss")
+        logger.info(f"🧠 Index update: {clock.wall['vector_store']:.2f}s "
+                    f"(embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses)")
+        
+        chunk_count = index.chunk_count()
+        if chunk_count == 0:
+            metrics.FALLBACK_ANSWERS.inc(reason="empty_index")
+            return {
+                "answer": "I'd be happy to help you with your Bajaj Finserv related questions! However, I need some documents to be uploaded first to provide you with accurate and specific information about policies, loans, or insurance products.",
+                "source_documents": []
+            }
 
-            retrieved_docs = retriever.invoke(question)
+        max_docs = min(int(os.getenv('MAX_DOCUMENTS_PER_QUERY', '6')), chunk_count)
+        corpus_version = index.version
+        question_vector = question_vector.result()
+        
+        # Near-paraphrases of an earlier question on the same corpus skip retrieval and generation
+        if self.answer_cache is not None:
+            with clock.stage("answer_cache"):
+                cached = self.answer_cache.lookup(question_vector, corpus_version, index.name)
+            metrics.ANSWER_CACHE.inc(result="hit" if cached is not None else "miss")
+            if cached is not None:
+                logger.info(f"💾 Answer cache hit (similarity {cached['cache_similarity']})")
+                cached["cached"] = True
+                cached["processing_time"] = clock.timings()
+                return cached
+        
+        # Step 3: Document retrieval, keyword search runs alongside the vector search
+        lexical = clock.background("lexical_search", index.lexical_search, question, max_docs) \
+            if self.hybrid_search else None
+        with clock.stage("retrieval"):
+            retrieved_docs = index.similarity_search_by_vector(question_vector, k=max_docs)
             self.debug_retrieved_chunks(retrieved_docs, question)
+            lexical_docs = lexical.result() if lexical is not None else []
             
-            # Filter most relevant chunks
-            filtered_docs = self.filter_relevant_chunks(retrieved_docs, question, max_chunks=3)
-            retrieval_time = time.time() - retrieval_start
-            logger.info(f"🔍 Document retrieval: {retrieval_time:.2f}s")
-
-            def format_docs(docs):
-                if not docs:
-                    return "General knowledge about Bajaj Finserv products and services."
-                context = "\n\n".join(doc.page_content for doc in docs)
-                return context
+            # Fuse vector and lexical hits, keep the most relevant chunks
+            filtered_docs = self.filter_relevant_chunks(retrieved_docs, question, max_chunks=3,
+                                                        lexical_chunks=lexical_docs)
+        logger.info(f"🔍 Document retrieval: {clock.wall['retrieval']:.2f}s")
+
+        # Step 4: Prompt assembly, the generation only has to send it
+        with clock.stage("prompt_assembly"):
+            if filtered_docs:
+                packed = self.context_packer.pack(filtered_docs)
+                context, context_docs = packed.context, packed.documents
+                metrics.CONTEXT_TOKENS.inc(packed.input_tokens, stage="retrieved")
+                metrics.CONTEXT_TOKENS.inc(packed.tokens, stage="packed")
+                logger.info(f"📦 Context packed: {packed.input_tokens} -> {packed.tokens} tokens {packed.stats()}")
+            else:
+                context, context_docs = "General knowledge about Bajaj Finserv products and services.", []
 
             # Validate context but always proceed
-            context = format_docs(filtered_docs)
             self.validate_context(context, question)
-
-            # Step 4: LLM Generation with timing
-            gen_start = time.time()
-            chain = (
-                {"context": lambda x: context, "question": RunnablePassthrough()}
-                | self.prompt
-                | self.llm
-                | StrOutputParser()
+            prompt = self.prompt.format(context=context, question=question)
+
+        return {
+            "context": context,
+            "prompt": prompt,
+            "documents": context_docs,
+            "question_vector": question_vector,
+            "corpus_version": corpus_version,
+            "collection": index.name,
+            "clock": clock,
+            "embedding_cache": cache_stats
+        }
+
+    def processing_time(self, retrieval: Dict, total_time: float, **extra) -> Dict:
+        """Per-stage wall-clock and critical-path seconds of a query that reached generation"""
+        return {
+            "total": round(total_time, 2),
+            **retrieval["clock"].timings(),
+            "embedding_cache_hits": retrieval["embedding_cache"]['hits'],
+            "embedding_cache_misses": retrieval["embedding_cache"]['misses'],
+            **extra
+        }
+
+
+    @staticmethod
+    def source_titles(docs: List[Document]) -> List[str]:
+        # Extract source documents (limit to top 3)
+        source_documents = []
+        for doc in docs:
+            title = doc.metadata.get('title', 'Unknown Document')
+            if title not in source_documents:
+                source_documents.append(title)
+        return source_documents[:3]
+
+    def cache_answer(self, retrieval: Dict, answer: str, source_documents: List[str]):
+        if self.answer_cache is not None and answer:
+            self.answer_cache.store(
+                retrieval["question_vector"],
+                retrieval["corpus_version"],
+                {"answer": answer, "source_documents": source_documents},
+                retrieval["collection"]
             )
 
-            logger.info("🤖 Generating response...")
-            answer = chain.invoke(question)
-            
-            # Clean the response to remove <think> tags and limit to 2 paragraphs
+    def _early_answer(self, retrieval: Dict, start_time: float) -> Dict:
+        total_time = time.time() - start_time
+        metrics.STAGE_SECONDS.observe(total_time, stage="total")
+        if "processing_time" in retrieval:
+            retrieval["processing_time"]["total"] = round(total_time, 2)
+        return retrieval
+
+    def _finish_query(self, retrieval: Dict, answer: str, start_time: float, gen_start: float) -> Dict:
+        # Clean the response to remove <think> tags and limit to 2 paragraphs
+        with tracing.span("clean_response"):
             cleaned_answer = self.clean_response(answer)
-            gen_time = time.time() - gen_start
-            logger.info(f"🤖 LLM generation: {gen_time:.2f}s")
+        gen_time = time.time() - gen_start
+        logger.info(f"🤖 LLM generation: {gen_time:.2f}s")
+        retrieval["clock"].record("generation", gen_time)
 
-            # Extract source documents (limit to top 3)
-            source_documents = []
-            for doc in filtered_docs:
-                title = doc.metadata.get('title', 'Unknown Document')
-                if title not in source_documents:
-                    source_documents.append(title)
+        source_documents = self.source_titles(retrieval["documents"])
 
-            total_time = time.time() - start_time
-            logger.info(f"⚡ Total processing time: {total_time:.2f}s")
-            logger.info(f"✅ Successfully processed query with {len(source_documents)} sources")
+        total_time = time.time() - start_time
+        logger.info(f"⚡ Total processing time: {total_time:.2f}s")
+        metrics.STAGE_SECONDS.observe(total_time, stage="total")
+        logger.info(f"✅ Successfully processed query with {len(source_documents)} sources")
+        
+        self.cache_answer(retrieval, cleaned_answer, source_documents)
+        return {
+            "answer": cleaned_answer,
+            "source_documents": source_documents,
+            "processing_time": self.processing_time(retrieval, total_time)
+        }
+
+    def _query_error(self, error: Exception, start_time: float, mode: str) -> Dict:
+        total_time = time.time() - start_time
+        logger.error(f"❌ Error processing query after {total_time:.2f}s: {error}")
+        metrics.QUERY_ERRORS.inc(mode=mode)
+        metrics.FALLBACK_ANSWERS.inc(reason="error")
+        return {
+            "answer": ERROR_ANSWER,
+            "source_documents": [],
+            "error": str(error),
+            "processing_time": {"total": round(total_time, 2)}
+        }
+
+    def query(self, question: str, documents: List[Dict] = None, priority: str = "interactive",
+              deadline: float = None, collection: str = None,
+              document_refs: List[Dict] = None, prune: bool = False) -> Dict:
+        start_time = time.time()
+        metrics.QUERIES.inc(mode="sync")
+        try:
+            logger.info(f"🚀 Starting RAG query: {question[:50]}...")
             
-            return {
-                "answer": cleaned_answer,
-                "source_documents": source_documents[:3],  # Limit to 3 sources
-                "processing_time": {
-                    "total": round(total_time, 2),
-                    "document_processing": round(doc_time, 2),
-                    "vector_store": round(vector_time, 2),
-                    "retrieval": round(retrieval_time, 2),
-                    "generation": round(gen_time, 2)
-                }
-            }
+            retrieval = self.retrieve_context(question, documents, collection, document_refs, prune)
+            if "answer" in retrieval:
+                return self._early_answer(retrieval, start_time)
+
+            # Step 5: LLM Generation with timing
+            with self.scheduler.slot(priority, deadline):
+                gen_start = time.time()
+                logger.info("🤖 Generating response...")
+                answer = self.generation_chain.invoke(retrieval["prompt"], config=tracing.langchain_config())
+            return self._finish_query(retrieval, answer, start_time, gen_start)
+
+        except (SchedulerRejected, MissingDocuments):
+            raise
+        except Exception as e:
+            return self._query_error(e, start_time, "sync")
+
+    async def aquery(self, question: str, documents: List[Dict] = None, priority: str = "interactive",
+                     deadline: float = None, collection: str = None,
+                     document_refs: List[Dict] = None, prune: bool = False) -> Dict:
+        """Non-blocking query: retrieval runs on a worker thread, generation on Ollama's async client"""
+        start_time = time.time()
+        metrics.QUERIES.inc(mode="async")
+        try:
+            logger.info(f"🚀 Starting async RAG query: {question[:50]}...")
+            
+            retrieval = await asyncio.to_thread(self.retrieve_context, question, documents, collection,
+                                              document_refs, prune)
+            if "answer" in retrieval:
+                return self._early_answer(retrieval, start_time)
+
+            async with self.scheduler.aslot(priority, deadline):
+                gen_start = time.time()
+                logger.info("🤖 Generating response...")
+                answer = await self.generation_chain.ainvoke(retrieval["prompt"], config=tracing.langchain_config())
+            return self._finish_query(retrieval, answer, start_time, gen_start)
+
+        except (SchedulerRejected, MissingDocuments):
+            raise
+        except Exception as e:
+            return self._query_error(e, start_time, "async")
 
+    def stream_query(self, question: str, documents: List[Dict] = None, priority: str = "interactive",
+                     deadline: float = None, collection: str = None,
+                     document_refs: List[Dict] = None, prune: bool = False):
+        """Yield server-sent events for a query, sending visible answer text as it is generated"""
+        start_time = time.time()
+        metrics.QUERIES.inc(mode="stream")
+        try:
+            logger.info(f"🚀 Starting streaming RAG query: {question[:50]}...")
+            
+            retrieval = self.retrieve_context(question, documents, collection, document_refs, prune)
+            if "answer" in retrieval:
+                yield format_sse("sources", {"source_documents": retrieval["source_documents"]})
+                yield format_sse("token", {"text": retrieval["answer"]})
+                yield format_sse("done", {"processing_time": {"total": round(time.time() - start_time, 2)}})
+                return
+
+            yield format_sse("sources", {"source_documents": self.source_titles(retrieval["documents"])})
+
+            first_token_time = None
+            visible = []
+            cleaner = StreamingResponseCleaner(max_paragraphs=2)
+            
+            # The slot is held until the stream ends or the client goes away
+            with self.scheduler.slot(priority, deadline):
+                gen_start = time.time()
+                logger.info("🤖 Streaming response...")
+                for chunk in self.generation_chain.stream(retrieval["prompt"], config=tracing.langchain_config()):
+                    text = cleaner.feed(chunk)
+                    if text:
+                        if first_token_time is None:
+                            first_token_time = time.time() - start_time
+                            logger.info(f"⏱️ First visible token after {first_token_time:.2f}s")
+                        visible.append(text)
+                        yield format_sse("token", {"text": text})
+                    if cleaner.done:
+                        # Past the paragraph limit, stop paying for tokens nobody will see
+                        break
+            
+            tail = cleaner.flush()
+            if tail:
+                visible.append(tail)
+                yield format_sse("token", {"text": tail})
+            
+            self.cache_answer(retrieval, "".join(visible), self.source_titles(retrieval["documents"]))
+            
+            gen_time = time.time() - gen_start
+            total_time = time.time() - start_time
+            logger.info(f"⚡ Total streaming time: {total_time:.2f}s")
+            retrieval["clock"].record("generation", gen_time)
+            metrics.STAGE_SECONDS.observe(total_time, stage="total")
+            if first_token_time is not None:
+                metrics.STAGE_SECONDS.observe(first_token_time, stage="first_token")
+            
+            yield format_sse("done", {
+                "processing_time": self.processing_time(
+                    retrieval, total_time,
+                    first_token=round(first_token_time, 2) if first_token_time is not None else None
+                )
+            })
+
+        except (SchedulerRejected, MissingDocuments) as e:
+            logger.warning(f"⏳ Streaming query turned away: {e}")
+            yield format_sse("error", {
+                **e.to_dict(),
+                "answer": turned_away_answer(e),
+                "processing_time": {"total": round(time.time() - start_time, 2)}
+            })
         except Exception as e:
             total_time = time.time() - start_time
-            logger.error(f"❌ Error processing query after {total_time:.2f}s: {e}")
-            return {
-                "answer": "I'm here to help with your Bajaj Finserv questions! While I encountered a technical issue processing your specific request, I can still assist you with general information about our policies, loans, and insurance products. Please try asking your question in a different way.",
-                "source_documents": [],
+            logger.error(f"❌ Error streaming query after {total_time:.2f}s: {e}")
+            metrics.QUERY_ERRORS.inc(mode="stream")
+            metrics.FALLBACK_ANSWERS.inc(reason="error")
+            yield format_sse("error", {
+                "answer": ERROR_ANSWER,
                 "error": str(e),
                 "processing_time": {"total": round(total_time, 2)}
-            }
+            })
+
+class IngestionJobs:
+    """Background document upserts so large uploads do not hold the request open"""
+
+    def __init__(self, max_jobs: int = 100):
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, processor: RAGProcessor, documents: List[Document], index=None) -> Dict:
+        index = index or processor.index
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "running",
+            "collection": index.name,
+            "documents": len(documents),
+            "documents_done": 0,
+            "chunks_embedded": 0,
+            "chunks_total": 0,
+            "results": [],
+            "error": None
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            # Forget the oldest finished jobs once we keep too many around
+            finished = [job_id for job_id, j in self._jobs.items() if j["status"] != "running"]
+            for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+                del self._jobs[job_id]
+
+        threading.Thread(target=self._run, args=(processor, index, documents, job), daemon=True).start()
+        return dict(job)
+
+    def _run(self, processor: RAGProcessor, index, documents: List[Document], job: Dict):
+        def on_progress(done, total):
+            job["chunks_embedded"] = done
+            job["chunks_total"] = total
+
+        try:
+            with processor.embedding_pipeline.track_progress(on_progress):
+                for doc in documents:
+                    job["results"].append(
+                        index.upsert(doc.metadata['doc_id'], doc.page_content, doc.metadata)
+                    )
+                    job["documents_done"] += 1
+            job["status"] = "completed"
+        except Exception as e:
+            logger.error(f"❌ Ingestion job {job['id']} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+ingestion_jobs = IngestionJobs()
 
-try:
-    rag_processor = RAGProcessor()
-    logger.info("RAG service ready")
-except Exception as e:
-    logger.error(f"Failed to initialize RAG service: {e}")
-    rag_processor = None
+def init_processor():
+    """Build the module's RAGProcessor; rag_processor stays None if that fails"""
+    global rag_processor
+    try:
+        rag_processor = RAGProcessor()
+        logger.info("RAG service ready")
+    except Exception as e:
+        logger.error(f"Failed to initialize RAG service: {e}")
+        rag_processor = None
+    return rag_processor
+
+rag_processor = None
+# startup.py serves the port first and builds the processor in the background
+if os.getenv('RAG_DEFER_INIT', 'False').lower() != 'true':
+    init_processor()
 
 @app.route('/health', methods=['GET'])
 def health():
     if rag_processor is None:
         return jsonify({"status": "error", "message": "RAG processor not initialized"}), 500
     
+    # Cached /api/tags probe, load balancer checks never take generation capacity
+    status = rag_processor.ollama.health()
+    if not status["ollama_connected"]:
+        return jsonify({"status": "error", "message": f"Ollama connection failed: {status.get('error')}",
+                        **status}), 503
+    return jsonify({"status": "ok", **status})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the processor is built, without checking Ollama like /health does"""
+    if rag_processor is None:
+        return jsonify({"status": "failed", "message": "RAG processor not initialized"}), 503
+    return jsonify({"status": "ready"})
+
+def _collection_error(name, create=False):
+    """Error response when a request names a collection that is invalid or does not exist"""
     try:
-        test_response = rag_processor.llm.invoke("Hello")
-        return jsonify({"status": "ok", "ollama_connected": True})
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Ollama connection failed: {e}"}), 500
+        rag_processor.collections.get(name, create=create)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except KeyError:
+        return jsonify({"error": f"Collection not found: {name}"}), 404
+    return None
 
 @app.route('/rag/query', methods=['POST'])
 def rag_query():
@@ -360,23 +737,243 @@ def rag_query():
         if not query:
             return jsonify({"error": "Query cannot be empty"}), 400
         
-        documents = data.get('documents', [])
+        documents = data.get('documents') or []
+        try:
+            priority = rag_processor.scheduler.priority(data.get('priority'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        deadline = rag_processor.scheduler.deadline(data.get('deadline_ms'))
+        collection = data.get('collection')
+        document_refs = data.get('document_refs') or []
+        prune = bool(data.get('prune'))
+        error = _collection_error(collection, create=bool(documents or document_refs))
+        if error:
+            return error
         
-        logger.info(f"Processing query: {query[:50]}... with {len(documents)} documents")
+        logger.info(f"Processing {priority} query: {query[:50]}... with {len(documents)} documents"
+                    f" and {len(document_refs)} references")
         
-        result = rag_processor.query(query, documents)
+        result = rag_processor.query(query, documents, priority, deadline, collection, document_refs, prune)
         return jsonify(result)
         
+    except SchedulerRejected as e:
+        logger.warning(f"⏳ Query turned away: {e}")
+        return jsonify(e.to_dict()), e.status, {"Retry-After": e.retry_after_header}
+    except MissingDocuments as e:
+        logger.info(f"📨 Asking for {len(e.hashes)} referenced documents")
+        return jsonify(e.to_dict()), 409
     except Exception as e:
         logger.error(f"Error in rag_query endpoint: {e}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+@app.route('/rag/query/stream', methods=['POST'])
+def rag_query_stream():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    data = request.get_json()
+    
+    if not data or 'query' not in data:
+        return jsonify({"error": "Query is required"}), 400
+    
+    query = data['query'].strip()
+    if not query:
+        return jsonify({"error": "Query cannot be empty"}), 400
+    
+    documents = data.get('documents') or []
+    try:
+        priority = rag_processor.scheduler.priority(data.get('priority'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    deadline = rag_processor.scheduler.deadline(data.get('deadline_ms'))
+    collection = data.get('collection')
+    document_refs = data.get('document_refs') or []
+    prune = bool(data.get('prune'))
+    error = _collection_error(collection, create=bool(documents or document_refs))
+    if error:
+        return error
+    
+    # Once the stream has started the status is 200, so a full queue or missing documents are refused up front
+    try:
+        rag_processor.scheduler.check()
+    except SchedulerRejected as e:
+        return jsonify(e.to_dict()), e.status, {"Retry-After": e.retry_after_header}
+    missing = rag_processor.missing_documents(document_refs, documents, collection) if document_refs else []
+    if missing:
+        return jsonify(MissingDocuments(missing).to_dict()), 409
+    
+    logger.info(f"Streaming {priority} query: {query[:50]}... with {len(documents)} documents"
+                f" and {len(document_refs)} references")
+    
+    return Response(
+        stream_with_context(rag_processor.stream_query(query, documents, priority, deadline, collection,
+                                                       document_refs, prune)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.before_request
+def start_trace():
+    """Trace requests sent with X-RAG-Trace (or ?trace=); see tracing.py"""
+    modes = tracing.requested_modes(request.headers.get('X-RAG-Trace') or request.args.get('trace'))
+    if modes:
+        g.trace = tracing.Trace(f"{request.method} {request.path}", modes).activate()
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        response.headers['X-RAG-Trace-Id'] = trace.id
+        response.headers['X-RAG-Trace-File'] = trace.file_prefix + ".trace.json"
+        # Streamed answers are still being generated here, so the trace ends once the response is sent
+        response.call_on_close(trace.finish)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip JSON answers for clients that accept it; event streams are left alone so tokens are not held back"""
+    if (response.direct_passthrough or response.is_streamed or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers or not accepts_gzip(request.headers.get('Accept-Encoding'))):
+        return response
+    body = response.get_data()
+    if len(body) >= MIN_COMPRESS_BYTES:
+        response.set_data(compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/rag/scheduler', methods=['GET'])
+def generation_scheduler_stats():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    return jsonify(rag_processor.scheduler.stats())
+
+@app.route('/rag/cache', methods=['GET'])
+def answer_cache_stats():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    if rag_processor.answer_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **rag_processor.answer_cache.stats()})
+
+@app.route('/rag/collections', methods=['GET'])
+def list_collections():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    return jsonify({"collections": rag_processor.collections.list()})
+
+@app.route('/rag/collections', methods=['POST'])
+def create_collection():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    data = request.get_json() or {}
+    name = data.get('name')
+    if not name:
+        return jsonify({"error": "Collection name is required"}), 400
+    try:
+        shards = int(data['shards']) if data.get('shards') else None
+        existed = rag_processor.collections.exists(name)
+        index = rag_processor.collections.get(name, create=True, shards=shards)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"collection": index.stats()}), 200 if existed else 201
+
+@app.route('/rag/documents', methods=['GET'])
+def list_documents():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    collection = request.args.get('collection')
+    error = _collection_error(collection)
+    if error:
+        return error
+    return jsonify({"documents": rag_processor.collections.get(collection).list_documents()})
+
+@app.route('/rag/documents', methods=['POST'])
+def upsert_documents():
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('documents'):
+            return jsonify({"error": "Documents are required"}), 400
+        
+        documents = data['documents']
+        if any(not doc.get('id') for doc in documents):
+            return jsonify({"error": "Every document needs an id"}), 400
+        
+        collection = data.get('collection')
+        try:
+            shards = int(data['shards']) if data.get('shards') else None
+            index = rag_processor.collections.get(collection, create=True, shards=shards)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        langchain_docs = rag_processor.process_documents(documents)
+        if data.get('async'):
+            job = ingestion_jobs.start(rag_processor, langchain_docs, index)
+            return jsonify({"job": job}), 202
+        
+        results = [
+            index.upsert(doc.metadata['doc_id'], doc.page_content, doc.metadata)
+            for doc in langchain_docs
+        ]
+        return jsonify({"documents": results})
+        
+    except Exception as e:
+        logger.error(f"Error in upsert_documents endpoint: {e}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+@app.route('/rag/documents/jobs/<job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job": job})
+
+@app.route('/rag/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    if rag_processor is None:
+        return jsonify({"error": "RAG service not available"}), 500
+    
+    collection = request.args.get('collection')
+    error = _collection_error(collection)
+    if error:
+        return error
+    
+    try:
+        if not rag_processor.collections.get(collection).delete(doc_id):
+            return jsonify({"error": "Document not found"}), 404
+        return jsonify({"message": "Document deleted", "id": doc_id})
+        
+    except Exception as e:
+        logger.error(f"Error in delete_document endpoint: {e}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
 if __name__ == '__main__':
     flask_host = os.getenv('FLASK_HOST', '0.0.0.0')
     flask_port = int(os.getenv('FLASK_PORT', '8080'))
-    flask_debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
+    flask_debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+    serve_mode = os.getenv('SERVE_MODE', 'flask').lower()
     
-    print(f"Starting RAG Python service on {flask_host}:{flask_port}")
+    print(f"Starting RAG Python service ({serve_mode}) on {flask_host}:{flask_port}")
     print("Make sure Ollama is running with: ollama serve")
     print(f"Make sure {os.getenv('OLLAMA_MODEL', 'deepseek-r1:8b')} model is available")
-    app.run(host=flask_host, port=flask_port, debug=flask_debug)
+    if serve_mode == 'async':
+        from async_service import run_async_server
+        # The async routes expect a processor; startup.py serves while one is still being built
+        if rag_processor is None:
+            raise SystemExit("RAG processor failed to initialize (use startup.py to defer initialization)")
+        run_async_server(rag_processor, host=flask_host, port=flask_port)
+    else:
+        app.run(host=flask_host, port=flask_port, debug=flask_debug, threaded=True)
@@ -0,0 +1,236 @@
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from document_index import DocumentIndex
+from embedding_model import EmbeddingSpec
+from numpy_store import NumpyVectorStore
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COLLECTION = "rag_documents"
+
+# Short enough that shard and migration suffixes stay within Chroma's 63 character limit
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{1,38}[A-Za-z0-9]$")
+
+
+def shard_for(doc_id: str, shards: int) -> int:
+    """Stable shard of a document id, the same in every process"""
+    return zlib.crc32(str(doc_id).encode("utf-8")) % shards
+
+
+def _vector_hits(index: DocumentIndex, vector: List[float], k: int) -> List[Tuple[Document, float]]:
+    """Top-k chunks of one shard with a higher-is-closer score"""
+    store = index.vector_store
+    with tracing.span("similarity_search", "vectorstore", collection=index.collection, k=k):
+        if isinstance(store, NumpyVectorStore):
+            return store.similarity_search_with_score_by_vector(vector, k)
+        # Chroma scores are distances; every shard uses the same metric, so negated they rank correctly
+        return [(doc, -distance)
+                for doc, distance in store.similarity_search_by_vector_with_relevance_scores(vector, k)]
+
+
+class ShardedIndex:
+    """A named collection of documents spread over DocumentIndex shards by document id
+
+    Each shard has its own vector store collection, manifest and BM25 index,
+    so no single index has to hold the whole collection. Searches run on
+    every shard at once and the per-shard top-k lists are merged; a
+    collection with one shard is a plain DocumentIndex under the collection
+    name, which is how indexes from before collections existed are opened.
+    """
+
+    def __init__(self, name: str, shards: List[DocumentIndex], executor: ThreadPoolExecutor):
+        self.name = name
+        self.shards = shards
+        self._executor = executor
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.shards[0].embeddings
+
+    def shard(self, doc_id: str) -> DocumentIndex:
+        return self.shards[shard_for(doc_id, len(self.shards))]
+
+    def _each(self, fn, items: Optional[List] = None) -> List:
+        """fn over the shards (or other per-shard items), in parallel when there is more than one"""
+        items = self.shards if items is None else items
+        if len(items) == 1:
+            return [fn(items[0])]
+        return list(self._executor.map(tracing.wrap(fn), items))
+
+    def prepare(self, doc_id: str, content: str, metadata: Dict = None) -> Dict:
+        return self.shard(doc_id).prepare(doc_id, content, metadata)
+
+    def commit(self, prepared: Dict, vectors: Optional[List[List[float]]] = None, save: bool = True) -> Dict:
+        return self.shard(prepared["id"]).commit(prepared, vectors, save=save)
+
+    def upsert(self, doc_id: str, content: str, metadata: Dict = None, save: bool = True) -> Dict:
+        return self.shard(doc_id).upsert(doc_id, content, metadata, save=save)
+
+    def delete(self, doc_id: str, save: bool = True) -> bool:
+        return self.shard(doc_id).delete(doc_id, save=save)
+
+    def sync(self, documents: List[Document], keep: Iterable[str] = (), prune: bool = False) -> Dict:
+        """Upsert the given documents into their shards in parallel; with prune, drop all others but keep"""
+        routed: Dict[int, List[Document]] = {i: [] for i in range(len(self.shards))}
+        kept: Dict[int, List[str]] = {i: [] for i in range(len(self.shards))}
+        for doc in documents:
+            routed[shard_for(doc.metadata["doc_id"], len(self.shards))].append(doc)
+        for doc_id in keep:
+            kept[shard_for(doc_id, len(self.shards))].append(doc_id)
+        stats = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        for shard_stats in self._each(lambda i: self.shards[i].sync(routed[i], kept[i], prune), list(routed)):
+            for key, value in shard_stats.items():
+                stats[key] += value
+        return stats
+
+    def save(self):
+        self._each(lambda shard: shard.save())
+
+    @property
+    def version(self) -> str:
+        if len(self.shards) == 1:
+            return self.shards[0].version
+        digest = hashlib.sha256()
+        for shard in self.shards:
+            digest.update(shard.version.encode("utf-8"))
+        return digest.hexdigest()
+
+    def documents(self) -> Dict[str, Dict]:
+        return {doc_id: entry for shard in self.shards for doc_id, entry in shard.documents().items()}
+
+    def list_documents(self) -> List[Dict]:
+        return [doc for shard in self.shards for doc in shard.list_documents()]
+
+    def chunk_count(self) -> int:
+        return sum(shard.chunk_count() for shard in self.shards)
+
+    def similarity_search_by_vector(self, vector: List[float], k: int = 4) -> List[Document]:
+        """Scatter the query to every non-empty shard and keep the k closest chunks overall"""
+        shards = [shard for shard in self.shards if shard.chunk_count()]
+        if not shards:
+            return []
+        hits = self._each(lambda shard: _vector_hits(shard, vector, min(k, shard.chunk_count())), shards)
+        return [doc for doc, _ in heapq.nlargest(k, itertools.chain.from_iterable(hits), key=lambda hit: hit[1])]
+
+    def lexical_search(self, query: str, k: int = 4) -> List[Document]:
+        """BM25 hits of all shards; each shard scores with its own term statistics"""
+        hits = self._each(lambda i: [(score, chunk_id, i) for chunk_id, score in self.shards[i].lexical.search(query, k)],
+                          list(range(len(self.shards))))
+        best = heapq.nlargest(k, itertools.chain.from_iterable(hits), key=lambda hit: hit[0])
+        chunks = {}
+        for i in {i for _, _, i in best}:
+            for chunk in self.shards[i].get_chunks([chunk_id for _, chunk_id, owner in best if owner == i]):
+                chunks[chunk.id] = chunk
+        return [chunks[chunk_id] for _, chunk_id, _ in best if chunk_id in chunks]
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "shards": len(self.shards),
+            "documents": sum(len(shard.documents()) for shard in self.shards),
+            "chunks": self.chunk_count(),
+            "shard_chunks": [shard.chunk_count() for shard in self.shards]
+        }
+
+
+class CollectionRegistry:
+    """The named collections of one persist directory, opened on first use
+
+    collections.json records the shard count of each collection. It is fixed
+    when the collection is created, since documents are routed by
+    doc_id modulo the shard count.
+    """
+
+    def __init__(self, persist_directory: str, embeddings: Embeddings, text_splitter,
+                 embedding_spec: Optional[EmbeddingSpec] = None, backend: Optional[str] = None,
+                 default_shards: int = 1, search_workers: int = 8):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.persist_directory = persist_directory
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.embedding_spec = embedding_spec
+        self.backend = backend
+        self.default_shards = max(1, default_shards)
+        self.layout_path = os.path.join(persist_directory, "collections.json")
+        self._layout = self._load_layout()
+        self._open: Dict[str, ShardedIndex] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, search_workers), thread_name_prefix="shard")
+
+    def _load_layout(self) -> Dict[str, Dict]:
+        try:
+            with open(self.layout_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not read collection layout, using defaults: {e}")
+            return {}
+
+    def _save_layout(self):
+        DocumentIndex.write_manifest(self.layout_path, self._layout)
+
+    @staticmethod
+    def shard_names(name: str, shards: int) -> List[str]:
+        if shards == 1:
+            return [name]
+        return [f"{name}.shard{i}" for i in range(shards)]
+
+    def exists(self, name: str) -> bool:
+        return name in self._layout or (
+            name == DEFAULT_COLLECTION
+            or os.path.exists(DocumentIndex.manifest_file(self.persist_directory, name))
+        )
+
+    def get(self, name: Optional[str] = None, create: bool = False, shards: Optional[int] = None) -> ShardedIndex:
+        """Open a collection; unknown names raise KeyError unless create is set"""
+        name = name or DEFAULT_COLLECTION
+        if not COLLECTION_NAME.match(name):
+            raise ValueError(f"Invalid collection name: {name} (3-40 letters, digits, _ or -)")
+        with self._lock:
+            if name in self._open:
+                return self._open[name]
+            if not self.exists(name) and not create:
+                raise KeyError(name)
+            if name not in self._layout:
+                # The default collection predates sharding and keeps its single index
+                count = 1 if name == DEFAULT_COLLECTION or self.exists(name) else max(1, shards or self.default_shards)
+                self._layout[name] = {"shards": count}
+                self._save_layout()
+            shard_indexes = [
+                DocumentIndex(self.embeddings, self.text_splitter, self.persist_directory, shard_name,
+                              backend=self.backend, embedding_spec=self.embedding_spec)
+                for shard_name in self.shard_names(name, self._layout[name]["shards"])
+            ]
+            index = self._open[name] = ShardedIndex(name, shard_indexes, self._executor)
+            logger.info(f"🗂️ Opened collection {name} ({len(shard_indexes)} shards)")
+            return index
+
+    def names(self) -> List[str]:
+        return sorted(set(self._layout) | {DEFAULT_COLLECTION})
+
+    def index_names(self) -> List[str]:
+        """Document index (manifest) names of every shard of every collection"""
+        return [shard_name for name in self.names()
+                for shard_name in self.shard_names(name, self._layout.get(name, {}).get("shards", 1))]
+
+    def list(self) -> List[Dict]:
+        """Collections with their shard counts; document counts for the ones opened so far"""
+        return [
+            self._open[name].stats() if name in self._open
+            else {"name": name, "shards": self._layout.get(name, {}).get("shards", 1)}
+            for name in self.names()
+        ]
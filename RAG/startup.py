@@ -0,0 +1,184 @@
+"""Fast cold start: bind the port first, load the RAG service in the background
+
+    python startup.py
+
+serves FLASK_PORT before anything heavy is imported. While the service
+loads, /health and /ready answer 503 {"status": "starting"} and every other
+route 503 with a Retry-After header, so load balancers hold traffic back
+instead of having connections refused. Once loaded, requests go to
+rag_service (SERVE_MODE=flask) or async_service (SERVE_MODE=async) exactly as
+when those are run directly. GET /startup reports how long each import and
+initialisation stage took against STARTUP_BUDGET_SECONDS.
+"""
+import importlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')))
+logger = logging.getLogger(__name__)
+
+# Third-party packages that dominate start-up, imported and timed one at a time before the service's own modules
+PRELOAD_MODULES = ("numpy", "httpx", "langchain_core.runnables", "langchain_text_splitters", "langchain_ollama")
+CHROMA_MODULES = ("chromadb", "langchain_community.vectorstores.chroma")
+
+
+def preload_modules() -> Tuple[str, ...]:
+    if os.getenv('VECTOR_STORE_TYPE', 'chroma').lower() == 'chroma':
+        return PRELOAD_MODULES + CHROMA_MODULES
+    return PRELOAD_MODULES
+
+
+class BackgroundStartup:
+    """Imports and initialises the RAG service on a background thread, tracking readiness and stage times
+
+    state is starting, ready or failed. processor and app are set once
+    loading is done; app is None only if rag_service could not be imported.
+    """
+
+    def __init__(self, budget: float = 30.0):
+        self.budget = budget
+        self.state = "starting"
+        self.stage: Optional[str] = None
+        self.error: Optional[str] = None
+        self.stages: List[Dict] = []
+        self.processor = None
+        self.app = None
+        self._started = time.perf_counter()
+        self._elapsed: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "BackgroundStartup":
+        return cls(budget=float(os.getenv('STARTUP_BUDGET_SECONDS', '30')))
+
+    def start(self) -> "BackgroundStartup":
+        threading.Thread(target=self._load, name="startup", daemon=True).start()
+        return self
+
+    @property
+    def elapsed(self) -> float:
+        return self._elapsed if self._elapsed is not None else time.perf_counter() - self._started
+
+    def _run_stage(self, name: str, fn: Callable):
+        self.stage = name
+        modules = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.stages.append({
+                "stage": name,
+                "seconds": round(time.perf_counter() - start, 3),
+                "modules": len(sys.modules) - modules
+            })
+
+    def _load(self):
+        # rag_service builds its processor at import unless told that we do it
+        os.environ['RAG_DEFER_INIT'] = 'True'
+        try:
+            for module in preload_modules():
+                try:
+                    self._run_stage(f"import {module}", lambda: importlib.import_module(module))
+                except ImportError as e:
+                    # Left for the service's own imports to report if it really needs it
+                    logger.warning(f"Could not preload {module}: {e}")
+            service = self._run_stage("import rag_service", lambda: importlib.import_module("rag_service"))
+            self.processor = self._run_stage("RAGProcessor()", service.init_processor)
+            self.app = service.app
+            if self.processor is None:
+                self.state, self.error = "failed", "RAG processor failed to initialize"
+            else:
+                self.state = "ready"
+        except Exception as e:
+            logger.error(f"Failed to load RAG service: {e}")
+            self.state, self.error = "failed", str(e)
+        finally:
+            self.stage = None
+            self._elapsed = time.perf_counter() - self._started
+            self.log_report()
+
+    def report(self) -> Dict:
+        elapsed = self.elapsed
+        return {
+            "status": self.state,
+            "stage": self.stage,
+            "error": self.error,
+            "elapsed_seconds": round(elapsed, 3),
+            "budget_seconds": self.budget,
+            "over_budget": elapsed > self.budget,
+            "stages": list(self.stages)
+        }
+
+    def log_report(self):
+        lines = [f"  {stage['seconds']:7.3f}s  {stage['modules']:5d} modules  {stage['stage']}"
+                 for stage in sorted(self.stages, key=lambda stage: stage['seconds'], reverse=True)]
+        summary = f"🚦 Start-up {self.state} after {self.elapsed:.2f}s (budget {self.budget:.0f}s):\n" + "\n".join(lines)
+        if self.elapsed > self.budget:
+            logger.warning(summary)
+        else:
+            logger.info(summary)
+
+    def unavailable(self) -> Tuple[int, Dict, Dict[str, str]]:
+        """Status, body and headers of the answer to a request that arrives before the service is ready"""
+        if self.state == "failed":
+            return 503, {"status": "failed", "error": self.error}, {}
+        retry_after = max(1, math.ceil(self.budget - self.elapsed))
+        return 503, {"status": "starting", "stage": self.stage, "elapsed_seconds": round(self.elapsed, 2)}, \
+            {"Retry-After": str(retry_after)}
+
+
+class StartupGate:
+    """WSGI app answering for the Flask service until it has loaded, then handing every request to it"""
+
+    def __init__(self, startup: BackgroundStartup):
+        self.startup = startup
+
+    @staticmethod
+    def _json(start_response, status: int, body: Dict, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode("utf-8")
+        reason = {200: "OK", 503: "Service Unavailable"}[status]
+        start_response(f"{status} {reason}", [("Content-Type", "application/json"),
+                                              ("Content-Length", str(len(data))), *(headers or {}).items()])
+        return [data]
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") == "/startup":
+            return self._json(start_response, 200, self.startup.report())
+        app = self.startup.app
+        if app is not None:
+            return app(environ, start_response)
+        return self._json(start_response, *self.startup.unavailable())
+
+
+def serve(host: str, port: int, serve_mode: str = "flask"):
+    startup = BackgroundStartup.from_env()
+    if serve_mode == 'async':
+        from aiohttp import web
+        from async_service import create_app
+
+        app = create_app(None, startup=startup)
+        startup.start()
+        web.run_app(app, host=host, port=port)
+    else:
+        from werkzeug.serving import run_simple
+
+        startup.start()
+        run_simple(host, port, StartupGate(startup), threaded=True)
+
+
+if __name__ == '__main__':
+    flask_host = os.getenv('FLASK_HOST', '0.0.0.0')
+    flask_port = int(os.getenv('FLASK_PORT', '8080'))
+    serve_mode = os.getenv('SERVE_MODE', 'flask').lower()
+
+    print(f"Starting RAG Python service ({serve_mode}, background start-up) on {flask_host}:{flask_port}")
+    serve(flask_host, flask_port, serve_mode)
@@ -0,0 +1,94 @@
+import json
+
+
+def format_sse(event: str, data) -> str:
+    """Encode one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamingResponseCleaner:
+    """Incremental version of RAGProcessor.clean_response for token streams
+
+    Suppresses <think>...</think> spans even when a tag is split across
+    chunks, collapses blank-line runs into paragraph breaks, trims leading and
+    trailing whitespace and stops after max_paragraphs paragraphs.
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self, max_paragraphs: int = 2):
+        self.max_paragraphs = max_paragraphs
+        self.done = False
+        self._pending = ""
+        self._in_think = False
+        self._whitespace = ""
+        self._started = False
+        self._paragraphs = 1
+
+    @staticmethod
+    def _partial_tag_length(text: str, tag: str) -> int:
+        """Length of the longest suffix of text that could be the start of tag"""
+        lowered = text[-len(tag):].lower()
+        for size in range(min(len(tag) - 1, len(lowered)), 0, -1):
+            if tag.startswith(lowered[-size:]):
+                return size
+        return 0
+
+    def _strip_think(self, text: str) -> str:
+        buffer = self._pending + text
+        visible = []
+        while buffer:
+            tag = self.CLOSE_TAG if self._in_think else self.OPEN_TAG
+            index = buffer.lower().find(tag)
+            if index >= 0:
+                if not self._in_think:
+                    visible.append(buffer[:index])
+                buffer = buffer[index + len(tag):]
+                self._in_think = not self._in_think
+                continue
+
+            keep = self._partial_tag_length(buffer, tag)
+            if not self._in_think:
+                visible.append(buffer[:len(buffer) - keep])
+            buffer = buffer[len(buffer) - keep:] if keep else ""
+            break
+
+        self._pending = buffer
+        return "".join(visible)
+
+    def _normalize(self, text: str) -> str:
+        out = []
+        for char in text:
+            if self.done:
+                break
+            if char.isspace():
+                self._whitespace += char
+                continue
+            if self._whitespace:
+                if not self._started:
+                    pass
+                elif self._whitespace.count("\n") >= 2:
+                    self._paragraphs += 1
+                    if self._paragraphs > self.max_paragraphs:
+                        self.done = True
+                        break
+                    out.append("\n\n")
+                else:
+                    out.append(self._whitespace)
+                self._whitespace = ""
+            self._started = True
+            out.append(char)
+        return "".join(out)
+
+    def feed(self, chunk: str) -> str:
+        """Return the part of chunk that is safe to show to the user"""
+        if self.done:
+            return ""
+        return self._normalize(self._strip_think(chunk))
+
+    def flush(self) -> str:
+        """Release text held back as a possible tag prefix once the stream ends"""
+        text = "" if self._in_think else self._pending
+        self._pending = ""
+        return self._normalize(text) if not self.done else ""
@@ -0,0 +1,283 @@
+"""Opt-in span tracing and profiling of single requests
+
+A request sent with an X-RAG-Trace header (or ?trace= parameter) records a
+span for every pipeline stage, LangChain run, Ollama HTTP call, text split,
+vector store call and response cleanup it goes through, and writes them to
+TRACE_DIR as a Chrome trace (chrome://tracing, ui.perfetto.dev or
+speedscope.app). The header value picks extras, comma separated:
+
+    X-RAG-Trace: 1                spans only
+    X-RAG-Trace: sample           + stack samples of the request's threads (.speedscope.json)
+    X-RAG-Trace: cprofile         + cProfile of the request thread (.prof, e.g. for snakeviz)
+
+Requests without the header pay one context variable lookup per span.
+"""
+import contextvars
+import cProfile
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("rag_trace", default=None)
+_NO_SPAN = nullcontext()
+# cProfile can only run once per process at a time from Python 3.12
+_profiler_lock = threading.Lock()
+
+MODES = ("spans", "sample", "cprofile")
+
+
+def current() -> Optional["Trace"]:
+    return _current.get()
+
+
+def requested_modes(value: Optional[str]) -> Optional[Set[str]]:
+    """Modes asked for by an X-RAG-Trace header value; None when tracing is off or disabled"""
+    if not value or value.strip().lower() in ("0", "false", "off"):
+        return None
+    if os.getenv('TRACING_ENABLED', 'True').lower() != 'true':
+        return None
+    return {"spans"} | {mode for mode in (part.strip().lower() for part in value.split(",")) if mode in MODES}
+
+
+class Span:
+    __slots__ = ("trace", "name", "cat", "args", "start", "tid")
+
+    def __init__(self, trace: "Trace", name: str, cat: str, args: Dict):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = time.perf_counter()
+        self.tid = threading.get_ident()
+
+    def end(self, **args):
+        self.trace.add(self.name, self.cat, self.start, time.perf_counter(), self.tid, {**self.args, **args})
+
+
+def start_span(name: str, cat: str = "app", **args) -> Optional[Span]:
+    """Open a span to be ended explicitly (e.g. when a streamed response is closed); None when not tracing"""
+    trace = _current.get()
+    return Span(trace, name, cat, args) if trace is not None else None
+
+
+def span(name: str, cat: str = "app", **args):
+    """Context manager timing a block as a span of the current request's trace"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return trace.span(name, cat, **args)
+
+
+def wrap(fn: Callable) -> Callable:
+    """fn carrying the current trace into executor threads; fn itself when not tracing"""
+    if _current.get() is None:
+        return fn
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy, a context can only be entered by one thread at a time
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def langchain_config() -> Optional[Dict]:
+    """RunnableConfig adding a span per LangChain run while tracing, None otherwise"""
+    trace = _current.get()
+    if trace is None:
+        return None
+    # Imported here so async_service can bind its port before LangChain loads (see startup.py)
+    from langchain_hooks import LangChainTracer
+
+    return {"callbacks": [LangChainTracer(trace)]}
+
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of the threads a trace has seen, for a speedscope sampled profile"""
+
+    def __init__(self, trace: "Trace", interval: float):
+        super().__init__(name="trace-sampler", daemon=True)
+        self.trace = trace
+        self.interval = interval
+        self.frames: List[Dict] = []
+        self._frame_index: Dict = {}
+        self.samples: Dict[int, List] = {}
+        self._stop_event = threading.Event()
+
+    def _frame(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        if key not in self._frame_index:
+            self._frame_index[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return self._frame_index[key]
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            for tid in list(self.trace.threads):
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self.samples.setdefault(tid, []).append((stack[::-1], now - last))
+            last = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def speedscope(self, name: str) -> Dict:
+        profiles = []
+        for tid, samples in self.samples.items():
+            weights = [weight for _, weight in samples]
+            profiles.append({
+                "type": "sampled",
+                "name": f"{name} ({self.trace.threads.get(tid, tid)})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": [stack for stack, _ in samples],
+                "weights": weights
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "rag tracing",
+            "shared": {"frames": self.frames},
+            "profiles": profiles
+        }
+
+
+class Trace:
+    """Spans of one request, written out as a Chrome trace when it finishes"""
+
+    def __init__(self, name: str, modes: Set[str] = frozenset({"spans"})):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.modes = set(modes)
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.events: List[Dict] = []
+        self.threads: Dict[int, str] = {threading.get_ident(): threading.current_thread().name}
+        self.notes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._token = None
+        self._sampler: Optional[_Sampler] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._end: Optional[float] = None
+
+    @property
+    def file_prefix(self) -> str:
+        return os.path.join(trace_directory(), f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}-{self.id}")
+
+    def add(self, name: str, cat: str, start: float, end: float, tid: int, args: Dict):
+        event = {
+            "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": tid,
+            "ts": round((start - self.origin) * 1e6, 1), "dur": round((end - start) * 1e6, 1)
+        }
+        if args:
+            event["args"] = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                             for key, value in args.items()}
+        with self._lock:
+            self.events.append(event)
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+
+    @contextmanager
+    def span(self, name: str, cat: str = "app", **args):
+        span_ = Span(self, name, cat, args)
+        try:
+            yield span_
+        except BaseException as e:
+            span_.args["error"] = repr(e)
+            raise
+        finally:
+            span_.end()
+
+    def activate(self):
+        """Make this the trace of the current context and start the profilers it asked for"""
+        self._token = _current.set(self)
+        if "sample" in self.modes:
+            self._sampler = _Sampler(self, float(os.getenv('TRACE_SAMPLE_INTERVAL_MS', '5')) / 1000)
+            self._sampler.start()
+        if "cprofile" in self.modes:
+            if _profiler_lock.acquire(blocking=False):
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+            else:
+                self.notes["cprofile"] = "skipped, another request was being profiled"
+        return self
+
+    def stop(self):
+        """Stop profiling and end the request span; call on the thread that activated the trace"""
+        if self._end is not None:
+            return
+        self._end = time.perf_counter()
+        if self._profile is not None:
+            self._profile.disable()
+            _profiler_lock.release()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                # Finished from another context (e.g. when a streamed response closes)
+                _current.set(None)
+        self.add(self.name, "request", self.origin, self._end, next(iter(self.threads)), {"trace_id": self.id})
+
+    def finish(self) -> List[str]:
+        """Stop profiling, write the trace files and return their paths"""
+        self.stop()
+
+        os.makedirs(trace_directory(), exist_ok=True)
+        prefix = self.file_prefix
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in self.threads.items()
+        ]
+        paths = [f"{prefix}.trace.json"]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "traceEvents": metadata + self.events,
+                "displayTimeUnit": "ms",
+                "otherData": {"trace_id": self.id, "request": self.name, "started_at": self.started_at,
+                              "modes": sorted(self.modes), **self.notes}
+            }))
+        if self._sampler is not None:
+            paths.append(f"{prefix}.speedscope.json")
+            with open(paths[-1], "w", encoding="utf-8") as f:
+                f.write(json.dumps(self._sampler.speedscope(self.name)))
+        if self._profile is not None:
+            paths.append(f"{prefix}.prof")
+            self._profile.dump_stats(paths[-1])
+        prune_traces(int(os.getenv('TRACE_MAX_FILES', '200')))
+        logger.info(f"🔬 Trace {self.id}: {', '.join(paths)}")
+        return paths
+
+
+def trace_directory() -> str:
+    return os.getenv('TRACE_DIR', './traces')
+
+
+def prune_traces(max_files: int):
+    """Keep the newest max_files trace files so always-on tracing cannot fill the disk"""
+    files = sorted(glob.glob(os.path.join(trace_directory(), "*-*.*")), key=os.path.getmtime)
+    for path in files[:max(0, len(files) - max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
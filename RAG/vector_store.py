@@ -1,26 +1,91 @@
-from typing import List
+import os
+from typing import Dict, List, Optional
 from langchain_core.documents import Document
-from langchain_community.vectorstores import Chroma
 from langchain_core.embeddings import Embeddings
+from embedding_pipeline import EmbeddingPipeline, print_progress
+from numpy_store import NumpyVectorStore
+from index_snapshot import SnapshotError, SnapshotVectorStore
+from offset_splitter import OffsetTextSplitter
+
+def create_vector_store_backend(embeddings: Embeddings, backend: Optional[str] = None,
+                                persist_directory: Optional[str] = None, collection_name: str = "langchain",
+                                read_only: bool = False):
+    """Build an empty vector store of the configured type (VECTOR_STORE_TYPE)"""
+    backend = (backend or os.getenv('VECTOR_STORE_TYPE', 'chroma')).lower()
+    
+    if backend == 'numpy':
+        persist_path = os.path.join(persist_directory, collection_name) if persist_directory else None
+        mmap = os.getenv('VECTOR_STORE_MMAP', 'True').lower() == 'true'
+        return NumpyVectorStore(
+            embeddings,
+            persist_path=persist_path,
+            mmap=mmap,
+            index_type=os.getenv('VECTOR_INDEX_TYPE', 'flat').lower(),
+            nlist=int(os.getenv('IVF_NLIST', '256')),
+            nprobe=int(os.getenv('IVF_NPROBE', '8')),
+            compact_text=os.getenv('VECTOR_STORE_COMPACT_TEXT', 'False').lower() == 'true',
+            quantization=os.getenv('VECTOR_QUANTIZATION', 'none').lower(),
+            rescore_factor=int(os.getenv('VECTOR_RESCORE_FACTOR', '4')),
+            read_only=read_only
+        )
+    
+    if backend == 'chroma':
+        # Imported only when selected, the numpy backend starts without loading chromadb
+        from langchain_community.vectorstores import Chroma
+
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory=persist_directory
+        )
+    
+    raise ValueError(f"Unknown vector store type: {backend}")
 
 class VectorStoreManager:
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None):
+        self.backend = backend
         self.vector_store = None
         self.document_count = 0
 
     def create_vector_store(self, documents: List[Document], embeddings: Embeddings):
         print("Creating vector store and indexing documents...")
         
-        self.vector_store = Chroma.from_documents(
-            documents=documents,
-            embedding=embeddings
-        )
+        if not isinstance(embeddings, EmbeddingPipeline):
+            embeddings = EmbeddingPipeline.from_env(embeddings, progress_callback=print_progress)
+        
+        self.vector_store = create_vector_store_backend(embeddings, self.backend)
+        self.vector_store.add_documents(documents)
         
         self.document_count = len(documents)
         print(f"Indexed {self.document_count} documents in vector store")
         
         return self.vector_store
 
+    def open_snapshot(self, path: str, embeddings: Embeddings, expected: Dict) -> Optional[SnapshotVectorStore]:
+        """The index saved by the last run, or None when it is missing or was built from something else"""
+        try:
+            self.vector_store = SnapshotVectorStore.open(path, embeddings, expected)
+        except SnapshotError as e:
+            print(f"Building index: {e}")
+            return None
+        self.document_count = len(self.vector_store)
+        print(f"Loaded {self.document_count} document chunks from {path}")
+        return self.vector_store
+
+    def create_snapshot(self, path: str, documents: List[Document], text_splitter: OffsetTextSplitter,
+                        embeddings: Embeddings, header: Dict) -> SnapshotVectorStore:
+        """Split, embed and index documents into a snapshot file the next run can open instead"""
+        print("Splitting and indexing documents...")
+        
+        if not isinstance(embeddings, EmbeddingPipeline):
+            embeddings = EmbeddingPipeline.from_env(embeddings, progress_callback=print_progress)
+        
+        self.vector_store = SnapshotVectorStore.build(path, documents, text_splitter, embeddings, header)
+        self.document_count = len(self.vector_store)
+        print(f"Indexed {self.document_count} document chunks into {path}")
+        
+        return self.vector_store
+
     def get_vector_store(self):
         return self.vector_store
 
@@ -0,0 +1,81 @@
+"""Wire format shared with the Go backend
+
+Queries may carry document_refs (id, title and content hash) instead of the
+full documents. Until the service holds every referenced document at that
+hash, it answers 409 with the missing hashes, and the backend resends just
+those in full. Request and response bodies may be gzip compressed.
+"""
+import gzip
+import io
+import zlib
+from typing import Dict, List, Optional
+
+# Smaller bodies are not worth the extra header and the CPU
+MIN_COMPRESS_BYTES = 1024
+# Fastest level: bodies are compressed per request and latency matters more than ratio
+COMPRESS_LEVEL = 1
+
+
+class MissingDocuments(Exception):
+    """Referenced documents the service does not hold; the caller resends them in full (409)"""
+
+    def __init__(self, hashes: List[str]):
+        super().__init__(f"{len(hashes)} referenced documents are not indexed")
+        self.hashes = hashes
+
+    def to_dict(self) -> Dict:
+        return {"error": str(self), "missing": self.hashes}
+
+
+def document_hash(content: str) -> str:
+    """Hash a client gives in a document reference: sha256 of the content without surrounding whitespace"""
+    # Imported here so async_service can bind its port before the index modules load (see startup.py)
+    from document_index import DocumentIndex
+
+    return DocumentIndex.content_hash(content.strip())
+
+
+def document_key(doc: Dict) -> str:
+    return str(doc.get('id') or doc.get('title'))
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    return any(part.split(";")[0].strip() == "gzip" for part in (accept_encoding or "").split(","))
+
+
+def compress(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+
+
+def decompress(body: bytes, max_bytes: int) -> bytes:
+    """Inflate a gzip or zlib request body, refusing anything that grows past max_bytes"""
+    decoder = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)
+    data = decoder.decompress(body, max_bytes + 1)
+    if len(data) > max_bytes or decoder.unconsumed_tail:
+        raise ValueError(f"Decompressed request body exceeds {max_bytes} bytes")
+    return data
+
+
+class DecompressRequests:
+    """WSGI middleware that inflates request bodies sent with Content-Encoding: gzip or deflate
+
+    The application sees a plain body, so request.get_json() works unchanged.
+    """
+
+    def __init__(self, app, max_bytes: int = 512 * 1024 * 1024):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding in ("gzip", "deflate"):
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            try:
+                body = decompress(environ["wsgi.input"].read(length), self.max_bytes)
+            except (ValueError, zlib.error) as e:
+                start_response("400 Bad Request", [("Content-Type", "text/plain")])
+                return [f"Invalid {encoding} request body: {e}".encode("utf-8")]
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            del environ["HTTP_CONTENT_ENCODING"]
+        return self.app(environ, start_response)
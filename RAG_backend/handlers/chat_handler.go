@@ -1,11 +1,16 @@
 package handlers
 
 import (
+	"bufio"
+	"encoding/json"
+	"errors"
+	"math"
 	"net/http"
 	"rag-backend/database"
 	"rag-backend/models"
 	"rag-backend/services"
 	"strconv"
+	"strings"
 
 	"github.com/gin-gonic/gin"
 )
@@ -20,34 +25,113 @@ func NewChatHandler(ragService *services.RAGService) *ChatHandler {
 	}
 }
 
-func (h *ChatHandler) ProcessQuery(c *gin.Context) {
-	var request struct {
-		Query string `json:"query" binding:"required"`
+// loadDocumentRefs lists the stored documents by content hash without reading their content
+func loadDocumentRefs() ([]services.DocumentRef, error) {
+	var documents []models.Document
+	if err := database.GetDB().Select("id", "title", "file_type", "content_hash").Find(&documents).Error; err != nil {
+		return nil, err
 	}
 
-	if err := c.ShouldBindJSON(&request); err != nil {
-		c.JSON(http.StatusBadRequest, gin.H{"error": err.Error()})
-		return
+	refs := make([]services.DocumentRef, 0, len(documents))
+	for _, doc := range documents {
+		if doc.ContentHash == "" {
+			// Stored before hashes were recorded
+			hash, err := backfillContentHash(doc.ID)
+			if err != nil {
+				return nil, err
+			}
+			doc.ContentHash = hash
+		}
+		refs = append(refs, services.DocumentRef{
+			ID:       strconv.FormatUint(uint64(doc.ID), 10),
+			Title:    doc.Title,
+			FileType: doc.FileType,
+			Hash:     doc.ContentHash,
+		})
 	}
+	return refs, nil
+}
 
+func backfillContentHash(id uint) (string, error) {
+	var doc models.Document
+	if err := database.GetDB().First(&doc, id).Error; err != nil {
+		return "", err
+	}
+	hash := services.ContentHash(doc.Content)
+	if err := database.GetDB().Model(&doc).UpdateColumn("content_hash", hash).Error; err != nil {
+		return "", err
+	}
+	return hash, nil
+}
+
+// loadDocumentsForRAG reads the full documents the RAG service asked for
+func loadDocumentsForRAG(refs []services.DocumentRef) ([]services.DocumentForRAG, error) {
+	ids := make([]string, len(refs))
+	for i, ref := range refs {
+		ids[i] = ref.ID
+	}
 	var documents []models.Document
-	if err := database.GetDB().Find(&documents).Error; err != nil {
-		c.JSON(http.StatusInternalServerError, gin.H{"error": "Failed to fetch documents"})
-		return
+	if err := database.GetDB().Where("id IN ?", ids).Find(&documents).Error; err != nil {
+		return nil, err
 	}
 
 	var docsForRAG []services.DocumentForRAG
 	for _, doc := range documents {
 		docsForRAG = append(docsForRAG, services.DocumentForRAG{
+			ID:       strconv.FormatUint(uint64(doc.ID), 10),
 			Content:  doc.Content,
 			Title:    doc.Title,
 			FileType: doc.FileType,
 		})
 	}
+	return docsForRAG, nil
+}
+
+// queryCorpus answers queries against the default collection from the stored documents. A named
+// collection is filled through the Python service's document API and queried as it is.
+func queryCorpus(collection string) (services.QueryCorpus, error) {
+	if collection != "" {
+		return services.QueryCorpus{Collection: collection}, nil
+	}
+	refs, err := loadDocumentRefs()
+	if err != nil {
+		return services.QueryCorpus{}, err
+	}
+	return services.QueryCorpus{Refs: refs, Load: loadDocumentsForRAG}, nil
+}
+
+// respondQueryError passes the Python service's backpressure on to the client, so it can retry later
+func respondQueryError(c *gin.Context, err error) {
+	var busy *services.BackpressureError
+	if errors.As(err, &busy) {
+		seconds := int(math.Max(1, math.Ceil(busy.RetryAfter.Seconds())))
+		c.Header("Retry-After", strconv.Itoa(seconds))
+		c.JSON(busy.StatusCode, gin.H{"error": busy.Message, "retry_after": seconds})
+		return
+	}
+	c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
+}
+
+func (h *ChatHandler) ProcessQuery(c *gin.Context) {
+	var request struct {
+		Query      string `json:"query" binding:"required"`
+		Collection string `json:"collection"`
+	}
+
+	if err := c.ShouldBindJSON(&request); err != nil {
+		c.JSON(http.StatusBadRequest, gin.H{"error": err.Error()})
+		return
+	}
 
-	response, err := h.ragService.ProcessQuery(request.Query, docsForRAG)
+	corpus, err := queryCorpus(request.Collection)
 	if err != nil {
-		c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
+		c.JSON(http.StatusInternalServerError, gin.H{"error": "Failed to fetch documents"})
+		return
+	}
+
+	response, err := h.ragService.ProcessQuery(request.Query, corpus)
+	if err != nil {
+		respondQueryError(c, err)
 		return
 	}
 
@@ -63,6 +147,69 @@ func (h *ChatHandler) ProcessQuery(c *gin.Context) {
 	})
 }
 
+// StreamQuery relays the Python service's server-sent events and stores the answer once it is complete.
+func (h *ChatHandler) StreamQuery(c *gin.Context) {
+	var request struct {
+		Query      string `json:"query" binding:"required"`
+		Collection string `json:"collection"`
+	}
+
+	if err := c.ShouldBindJSON(&request); err != nil {
+		c.JSON(http.StatusBadRequest, gin.H{"error": err.Error()})
+		return
+	}
+
+	corpus, err := queryCorpus(request.Collection)
+	if err != nil {
+		c.JSON(http.StatusInternalServerError, gin.H{"error": "Failed to fetch documents"})
+		return
+	}
+
+	stream, err := h.ragService.ProcessQueryStream(request.Query, corpus)
+	if err != nil {
+		respondQueryError(c, err)
+		return
+	}
+	defer stream.Close()
+
+	c.Header("Content-Type", "text/event-stream")
+	c.Header("Cache-Control", "no-cache")
+	c.Header("X-Accel-Buffering", "no")
+	c.Status(http.StatusOK)
+
+	var answer strings.Builder
+	event := ""
+	scanner := bufio.NewScanner(stream)
+	scanner.Buffer(make([]byte, 64*1024), 1024*1024)
+	for scanner.Scan() {
+		line := scanner.Text()
+		if strings.HasPrefix(line, "event: ") {
+			event = strings.TrimPrefix(line, "event: ")
+		} else if strings.HasPrefix(line, "data: ") && event == "token" {
+			var token struct {
+				Text string `json:"text"`
+			}
+			if json.Unmarshal([]byte(strings.TrimPrefix(line, "data: ")), &token) == nil {
+				answer.WriteString(token.Text)
+			}
+		}
+
+		c.Writer.WriteString(line + "\n")
+		if line == "" {
+			c.Writer.Flush()
+		}
+	}
+	c.Writer.Flush()
+
+	if answer.Len() > 0 {
+		chat := models.Chat{
+			Query:    request.Query,
+			Response: answer.String(),
+		}
+		database.GetDB().Create(&chat)
+	}
+}
+
 func (h *ChatHandler) GetChatHistory(c *gin.Context) {
 	limit := 50
 	if l := c.Query("limit"); l != "" {
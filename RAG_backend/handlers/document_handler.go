@@ -2,6 +2,7 @@ package handlers
 
 import (
 	"fmt"
+	"log"
 	"net/http"
 	"path/filepath"
 	"rag-backend/database"
@@ -45,11 +46,12 @@ func (h *DocumentHandler) UploadDocument(c *gin.Context) {
 	}
 
 	document := models.Document{
-		Title:    title,
-		Content:  content,
-		FileType: filepath.Ext(header.Filename),
-		FileName: header.Filename,
-		FileSize: header.Size,
+		Title:       title,
+		Content:     content,
+		ContentHash: services.ContentHash(content),
+		FileType:    filepath.Ext(header.Filename),
+		FileName:    header.Filename,
+		FileSize:    header.Size,
 	}
 
 	if err := database.GetDB().Create(&document).Error; err != nil {
@@ -67,6 +69,16 @@ func (h *DocumentHandler) UploadDocument(c *gin.Context) {
 		database.GetDB().Create(&documentChunk)
 	}
 
+	// Index now so the first chat query does not pay for embedding
+	if err := h.ragService.UpsertDocument(services.DocumentForRAG{
+		ID:       strconv.FormatUint(uint64(document.ID), 10),
+		Content:  document.Content,
+		Title:    document.Title,
+		FileType: document.FileType,
+	}); err != nil {
+		log.Printf("Failed to index document %d: %v", document.ID, err)
+	}
+
 	c.JSON(http.StatusOK, gin.H{
 		"message":  "Document uploaded successfully",
 		"document": document,
@@ -102,5 +114,9 @@ func (h *DocumentHandler) DeleteDocument(c *gin.Context) {
 		return
 	}
 
+	if err := h.ragService.DeleteDocument(id); err != nil {
+		log.Printf("Failed to remove document %d from index: %v", docID, err)
+	}
+
 	c.JSON(http.StatusOK, gin.H{"message": "Document deleted successfully"})
 }
@@ -6,7 +6,9 @@ import (
 	"rag-backend/database"
 	"rag-backend/handlers"
 	"rag-backend/services"
+	"strconv"
 	"strings"
+	"time"
 
 	"github.com/gin-contrib/cors"
 	"github.com/gin-gonic/gin"
@@ -41,6 +43,12 @@ func main() {
 
 	pythonRagURL := getEnv("PYTHON_RAG_URL", "http://localhost:8080")
 	ragService := services.NewRAGService(pythonRagURL)
+	if retries, err := strconv.Atoi(getEnv("RAG_BUSY_RETRIES", "2")); err == nil {
+		ragService.MaxRetries = retries
+	}
+	if maxWait, err := time.ParseDuration(getEnv("RAG_BUSY_MAX_WAIT", "10s")); err == nil {
+		ragService.MaxRetryWait = maxWait
+	}
 
 	documentHandler := handlers.NewDocumentHandler(ragService)
 	chatHandler := handlers.NewChatHandler(ragService)
@@ -71,6 +79,7 @@ func main() {
 		chat := api.Group("/chat")
 		{
 			chat.POST("/query", chatHandler.ProcessQuery)
+			chat.POST("/query/stream", chatHandler.StreamQuery)
 			chat.GET("/history", chatHandler.GetChatHistory)
 		}
 	}
@@ -5,14 +5,16 @@ import (
 )
 
 type Document struct {
-	ID         uint      `json:"id" gorm:"primaryKey"`
-	Title      string    `json:"title" gorm:"not null"`
-	Content    string    `json:"content" gorm:"type:longtext"`
-	FileType   string    `json:"file_type"`
-	FileName   string    `json:"file_name"`
-	FileSize   int64     `json:"file_size"`
-	UploadedAt time.Time `json:"uploaded_at" gorm:"autoCreateTime"`
-	UpdatedAt  time.Time `json:"updated_at" gorm:"autoUpdateTime"`
+	ID      uint   `json:"id" gorm:"primaryKey"`
+	Title   string `json:"title" gorm:"not null"`
+	Content string `json:"content" gorm:"type:longtext"`
+	// ContentHash is services.ContentHash(Content), sent to the RAG service in place of the content
+	ContentHash string    `json:"content_hash" gorm:"size:64"`
+	FileType    string    `json:"file_type"`
+	FileName    string    `json:"file_name"`
+	FileSize    int64     `json:"file_size"`
+	UploadedAt  time.Time `json:"uploaded_at" gorm:"autoCreateTime"`
+	UpdatedAt   time.Time `json:"updated_at" gorm:"autoUpdateTime"`
 }
 
 type Chat struct {
@@ -2,23 +2,66 @@ package services
 
 import (
 	"bytes"
+	"compress/gzip"
+	"crypto/sha256"
+	"encoding/hex"
 	"encoding/json"
 	"fmt"
 	"io"
 	"net/http"
+	"net/url"
+	"strconv"
 	"strings"
+	"time"
 )
 
 type RAGService struct {
 	PythonServiceURL string
+	// MaxRetries and MaxRetryWait bound how long a query waits out 429/503 answers from a busy Python service
+	MaxRetries   int
+	MaxRetryWait time.Duration
+}
+
+// BackpressureError means the Python service turned the query away (429 queue full, 503 unavailable)
+// and it did not get through within MaxRetryWait. RetryAfter is the service's own estimate.
+type BackpressureError struct {
+	StatusCode int
+	RetryAfter time.Duration
+	Message    string
+}
+
+func (e *BackpressureError) Error() string {
+	return fmt.Sprintf("RAG service busy (status %d): %s", e.StatusCode, e.Message)
 }
 
 type RAGRequest struct {
-	Query     string           `json:"query"`
-	Documents []DocumentForRAG `json:"documents"`
+	Query        string           `json:"query"`
+	Documents    []DocumentForRAG `json:"documents,omitempty"`
+	DocumentRefs []DocumentRef    `json:"document_refs,omitempty"`
+	Collection   string           `json:"collection,omitempty"`
+}
+
+// DocumentRef stands for a document the Python service may already hold, without its content
+type DocumentRef struct {
+	ID       string `json:"id"`
+	Title    string `json:"title"`
+	FileType string `json:"file_type"`
+	Hash     string `json:"hash"`
+}
+
+// DocumentLoader fetches the full documents behind the references the Python service does not hold
+type DocumentLoader func(refs []DocumentRef) ([]DocumentForRAG, error)
+
+// QueryCorpus is what a query is answered from: the documents behind Refs, of which only the ones
+// the Python service is missing are loaded and sent, or the named Collection as it is indexed.
+type QueryCorpus struct {
+	Refs       []DocumentRef
+	Load       DocumentLoader
+	Collection string
 }
 
 type DocumentForRAG struct {
+	ID       string `json:"id"`
 	Content  string `json:"content"`
 	Title    string `json:"title"`
 	FileType string `json:"file_type"`
@@ -33,26 +76,166 @@ type RAGResponse struct {
 func NewRAGService(pythonURL string) *RAGService {
 	return &RAGService{
 		PythonServiceURL: pythonURL,
+		MaxRetries:       2,
+		MaxRetryWait:     10 * time.Second,
 	}
 }
 
-func (r *RAGService) ProcessQuery(query string, documents []DocumentForRAG) (*RAGResponse, error) {
-	reqData := RAGRequest{
-		Query:     query,
-		Documents: documents,
-	}
+// ContentHash is the hash the Python service keeps a document's content under
+func ContentHash(content string) string {
+	sum := sha256.Sum256([]byte(strings.TrimSpace(content)))
+	return hex.EncodeToString(sum[:])
+}
 
-	jsonData, err := json.Marshal(reqData)
+// Request bodies from this size up are gzipped; extracted document text compresses several times over
+const compressThreshold = 16 * 1024
+
+func encodeBody(v interface{}) ([]byte, string, error) {
+	data, err := json.Marshal(v)
 	if err != nil {
-		return nil, fmt.Errorf("failed to marshal request: %v", err)
+		return nil, "", fmt.Errorf("failed to marshal request: %v", err)
+	}
+	if len(data) < compressThreshold {
+		return data, "", nil
+	}
+	var buf bytes.Buffer
+	zw, _ := gzip.NewWriterLevel(&buf, gzip.BestSpeed)
+	if _, err := zw.Write(data); err != nil {
+		return nil, "", fmt.Errorf("failed to compress request: %v", err)
 	}
+	if err := zw.Close(); err != nil {
+		return nil, "", fmt.Errorf("failed to compress request: %v", err)
+	}
+	return buf.Bytes(), "gzip", nil
+}
 
-	resp, err := http.Post(r.PythonServiceURL+"/rag/query", "application/json", bytes.NewBuffer(jsonData))
+// post sends an encoded body. The transport asks for gzip responses and inflates them by itself.
+func (r *RAGService) post(path string, body []byte, encoding string) (*http.Response, error) {
+	req, err := http.NewRequest(http.MethodPost, r.PythonServiceURL+path, bytes.NewReader(body))
+	if err != nil {
+		return nil, fmt.Errorf("failed to create request: %v", err)
+	}
+	req.Header.Set("Content-Type", "application/json")
+	if encoding != "" {
+		req.Header.Set("Content-Encoding", encoding)
+	}
+	resp, err := http.DefaultClient.Do(req)
 	if err != nil {
 		return nil, fmt.Errorf("failed to call Python service: %v", err)
 	}
+	return resp, nil
+}
+
+func retryAfter(resp *http.Response) time.Duration {
+	value := resp.Header.Get("Retry-After")
+	if seconds, err := strconv.Atoi(value); err == nil {
+		return time.Duration(seconds) * time.Second
+	}
+	if at, err := http.ParseTime(value); err == nil {
+		return time.Until(at)
+	}
+	return time.Second
+}
+
+func errorMessage(resp *http.Response) string {
+	var body struct {
+		Error string `json:"error"`
+	}
+	data, _ := io.ReadAll(resp.Body)
+	if json.Unmarshal(data, &body) == nil && body.Error != "" {
+		return body.Error
+	}
+	return http.StatusText(resp.StatusCode)
+}
+
+// postQuery sends a query to the Python service, waiting out 429/503 answers for as long as their
+// Retry-After and MaxRetryWait allow. Any other response is returned to the caller, who must close it.
+func (r *RAGService) postQuery(path string, body []byte, encoding string) (*http.Response, error) {
+	var waited time.Duration
+	for attempt := 0; ; attempt++ {
+		resp, err := r.post(path, body, encoding)
+		if err != nil {
+			return nil, err
+		}
+		if resp.StatusCode != http.StatusTooManyRequests && resp.StatusCode != http.StatusServiceUnavailable {
+			return resp, nil
+		}
+
+		wait := retryAfter(resp)
+		message := errorMessage(resp)
+		resp.Body.Close()
+		if attempt >= r.MaxRetries || waited+wait > r.MaxRetryWait {
+			return nil, &BackpressureError{StatusCode: resp.StatusCode, RetryAfter: wait, Message: message}
+		}
+		time.Sleep(wait)
+		waited += wait
+	}
+}
+
+// sendQuery posts a query with document references. When the Python service answers 409 with the
+// hashes it does not hold, just those documents are loaded and the query is sent again with them.
+func (r *RAGService) sendQuery(path, query string, corpus QueryCorpus) (*http.Response, error) {
+	reqData := RAGRequest{
+		Query:        query,
+		DocumentRefs: corpus.Refs,
+		Collection:   corpus.Collection,
+	}
+	for attempt := 0; ; attempt++ {
+		body, encoding, err := encodeBody(reqData)
+		if err != nil {
+			return nil, err
+		}
+		resp, err := r.postQuery(path, body, encoding)
+		if err != nil {
+			return nil, err
+		}
+		if resp.StatusCode != http.StatusConflict || attempt > 0 || corpus.Load == nil {
+			return resp, nil
+		}
+
+		missing, err := missingRefs(resp, corpus.Refs)
+		resp.Body.Close()
+		if err != nil {
+			return nil, err
+		}
+		if reqData.Documents, err = corpus.Load(missing); err != nil {
+			return nil, fmt.Errorf("failed to load documents: %v", err)
+		}
+	}
+}
+
+func missingRefs(resp *http.Response, refs []DocumentRef) ([]DocumentRef, error) {
+	var body struct {
+		Missing []string `json:"missing"`
+	}
+	if err := json.NewDecoder(resp.Body).Decode(&body); err != nil {
+		return nil, fmt.Errorf("failed to read missing documents: %v", err)
+	}
+	wanted := make(map[string]bool, len(body.Missing))
+	for _, hash := range body.Missing {
+		wanted[hash] = true
+	}
+	var missing []DocumentRef
+	for _, ref := range refs {
+		if wanted[ref.Hash] {
+			missing = append(missing, ref)
+		}
+	}
+	return missing, nil
+}
+
+// ProcessQuery answers a query, sending document content only for documents the Python service lacks.
+func (r *RAGService) ProcessQuery(query string, corpus QueryCorpus) (*RAGResponse, error) {
+	resp, err := r.sendQuery("/rag/query", query, corpus)
+	if err != nil {
+		return nil, err
+	}
 	defer resp.Body.Close()
 
+	if resp.StatusCode != http.StatusOK {
+		return nil, fmt.Errorf("Python service returned status %d: %s", resp.StatusCode, errorMessage(resp))
+	}
+
 	body, err := io.ReadAll(resp.Body)
 	if err != nil {
 		return nil, fmt.Errorf("failed to read response: %v", err)
@@ -66,6 +249,57 @@ func (r *RAGService) ProcessQuery(query string, documents []DocumentForRAG) (*RA
 	return &ragResp, nil
 }
 
+// ProcessQueryStream opens the server-sent event stream for a query. The caller must close it.
+func (r *RAGService) ProcessQueryStream(query string, corpus QueryCorpus) (io.ReadCloser, error) {
+	resp, err := r.sendQuery("/rag/query/stream", query, corpus)
+	if err != nil {
+		return nil, err
+	}
+
+	if resp.StatusCode != http.StatusOK {
+		resp.Body.Close()
+		return nil, fmt.Errorf("Python service returned status %d", resp.StatusCode)
+	}
+
+	return resp.Body, nil
+}
+
+func (r *RAGService) UpsertDocument(document DocumentForRAG) error {
+	body, encoding, err := encodeBody(map[string][]DocumentForRAG{"documents": {document}})
+	if err != nil {
+		return err
+	}
+
+	resp, err := r.post("/rag/documents", body, encoding)
+	if err != nil {
+		return err
+	}
+	defer resp.Body.Close()
+
+	if resp.StatusCode != http.StatusOK {
+		return fmt.Errorf("Python service returned status %d", resp.StatusCode)
+	}
+	return nil
+}
+
+func (r *RAGService) DeleteDocument(id string) error {
+	req, err := http.NewRequest(http.MethodDelete, r.PythonServiceURL+"/rag/documents/"+url.PathEscape(id), nil)
+	if err != nil {
+		return fmt.Errorf("failed to create request: %v", err)
+	}
+
+	resp, err := http.DefaultClient.Do(req)
+	if err != nil {
+		return fmt.Errorf("failed to call Python service: %v", err)
+	}
+	defer resp.Body.Close()
+
+	if resp.StatusCode != http.StatusOK && resp.StatusCode != http.StatusNotFound {
+		return fmt.Errorf("Python service returned status %d", resp.StatusCode)
+	}
+	return nil
+}
+
 func (r *RAGService) ChunkText(text string) []string {
 	const chunkSize = 1000
 	const overlap = 200
@@ -63,6 +63,54 @@ export const chatApi = {
     return response.data;
   },
 
+  // Streams the answer as server-sent events; onAnswer receives the visible text so far
+  queryStream: async (request: QueryRequest, onAnswer: (answer: string) => void): Promise<QueryResponse> => {
+    const response = await fetch(`${API_BASE_URL}/chat/query/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(request),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Stream failed: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    let sources: string[] = [];
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop() || '';
+
+      for (const raw of events) {
+        const lines = raw.split('\n');
+        const event = lines.find((line) => line.startsWith('event: '))?.slice(7);
+        const data = lines.find((line) => line.startsWith('data: '))?.slice(6);
+        if (!event || !data) continue;
+
+        const payload = JSON.parse(data);
+        if (event === 'token') {
+          answer += payload.text;
+          onAnswer(answer);
+        } else if (event === 'sources') {
+          sources = payload.source_documents;
+        } else if (event === 'error' && !answer) {
+          answer = payload.answer || payload.error || 'Something went wrong, please try again.';
+          onAnswer(answer);
+        }
+      }
+    }
+
+    return { answer, source_documents: sources };
+  },
+
   getHistory: async (limit?: number): Promise<Chat[]> => {
     const response = await api.get<{ chats: Chat[] }>('/chat/history', {
       params: { limit },
@@ -11,6 +11,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ onNewChat }) => {
   const [query, setQuery] = useState('');
   const [loading, setLoading] = useState(false);
   const [timer, setTimer] = useState(0);
+  const [partialAnswer, setPartialAnswer] = useState('');
 
   // Timer effect
   useEffect(() => {
@@ -43,7 +44,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ onNewChat }) => {
     console.log('Submitting query:', query.trim());
     setLoading(true);
     try {
-      const response = await chatApi.query({ query: query.trim() });
+      const response = await chatApi.queryStream({ query: query.trim() }, setPartialAnswer);
       console.log('API response:', response);
       onNewChat(query.trim(), response);
       setQuery('');
@@ -53,6 +54,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ onNewChat }) => {
       alert(`Unable to process your query at the moment. Please try again or contact support.`);
     } finally {
       setLoading(false);
+      setPartialAnswer('');
     }
   };
 
@@ -71,6 +73,13 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ onNewChat }) => {
         </div>
       )}
 
+      {/* Answer text as it streams in */}
+      {loading && partialAnswer && (
+        <div className="p-4 bg-white rounded-lg border border-gray-200 text-sm text-gray-800 whitespace-pre-wrap">
+          {partialAnswer}
+        </div>
+      )}
+
       <form onSubmit={handleSubmit} className="space-y-4">
         <div className="relative">
           <textarea